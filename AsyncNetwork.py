@@ -0,0 +1,400 @@
+"""
+文件名：    AsyncNetwork.py
+功  能：    游戏网络层定义。基于asyncio事件循环的server模块，用法与Network.Server相同。
+"""
+import time
+import socket
+import struct
+import asyncio
+from threading import Thread, Event
+
+import Network
+import Metrics
+import RoundBarrier
+import ConnectionTable
+import TimingWheel
+import Spectators
+from Network import CMD
+
+WRITE_BUFFER_LIMIT = 16 << 20  # 字节，发送缓冲区积压超过此值的客户端（几轮结果都没读走）被断开，按掉线处理
+
+
+class AsyncServer:
+    """
+    网络层-服务器模块（事件循环版）。GameBoard的所有属性初始化后才能实例化本类！
+
+    所有客户端连接都由同一个后台线程里的asyncio事件循环处理，不再为每个客户端创建线程，
+    单核即可承载上万连接（需要足够的文件描述符上限）。
+    GameBoard线程通过get_player_inputs/send_result与事件循环交互，接口与Network.Server一致。
+
+    启动方式：server.listen(target_port)
+    """
+
+    def __init__(self, client_number: int, input_deadline: float = None, quorum: int = 1, multicast: bool = False,
+                 heartbeat_timeout: float = Network.HEARTBEAT_TIMEOUT):
+        """
+        input_deadline, quorum, multicast, heartbeat_timeout: 见Network.Server。
+        """
+        self._CLIENT_NUMBER = client_number
+        self._ip = None  # type: str  # listen时确定
+        self._port = None
+        self.server_socket = None
+        self._loop = None  # type: asyncio.AbstractEventLoop
+        self._aio_server = None  # type: asyncio.AbstractServer
+        # 连接表，只在事件循环中访问。每个连接是一个列表：
+        # [StreamWriter, 编码, 是否接受增量结果, 是否持有上一轮分数, 下一个输入属于哪一轮, 是否通过组播接收结果]
+        self.connections = ConnectionTable.ConnectionTable(self._CLIENT_NUMBER)
+        # 截止时刻（心跳超时、重连保留期），含义同Network.Server，由事件循环每Network.DEADLINE_TICK秒推进一次
+        self._HEARTBEAT_TIMEOUT = heartbeat_timeout
+        self._deadlines = TimingWheel.TimingWheel(Network.DEADLINE_TICK)
+
+        self.barrier = RoundBarrier.RoundBarrier(client_number, input_deadline, quorum)  # 按轮次收集玩家输入
+        # 缓存的临时数据
+        self._closed_round = None  # GameBoard正在计算的轮次
+        self._player_inputs = None
+        self._t_result = None  # type: Network.RoundResult
+        self._t_play_again = True
+        # 运行指标，名称与Network.Server相同
+        self.metrics = Metrics.Registry()
+        # 组播，见Network.MulticastSender
+        self._multicast = None  # type: Network.MulticastSender
+        self._unicast_ids = set()  # 需要逐个发送结果的玩家ID，广播时不必遍历通过组播接收的客户端
+        self._spectators = None  # type: Spectators.SpectatorHub  # 第一个观战者到来时创建
+        if multicast:
+            if Network.MulticastSender.fits(client_number):
+                self._multicast = Network.MulticastSender()
+                self._multicast.start()
+            else:
+                print(f'S-INFO: Results of {client_number} players do not fit in one datagram, multicast disabled.')
+
+    def listen(self, target_port: int, ip_: str = None, fallback: bool = True):
+        """listen(target_port, ip_=None, fallback=True) -> (server_ip, listened_port)
+
+        该函数用于启动服务器。参数含义见Network.Server.listen。
+        """
+        self._ip = Network.get_lan_ip() if ip_ is None else ip_
+        if self.server_socket is not None:
+            self.server_socket.close()
+        self.server_socket = Network.bind_socket(self._ip, target_port, fallback)
+        self._port = self.server_socket.getsockname()[1]
+        self._loop = asyncio.new_event_loop()
+        started = Event()
+        T_event_loop = Thread(target=self._run_loop, args=(started,))
+        T_event_loop.setDaemon(True)
+        T_event_loop.start()
+        started.wait()
+        print(f"S-INFO: async server start listen {self._ip}:{self._port}")
+        return self.server_socket.getsockname()
+
+    def _run_loop(self, started: Event):
+        asyncio.set_event_loop(self._loop)
+        # 一次性涌入大量玩家时，backlog太小会让连接请求被内核丢弃后重试
+        self._aio_server = self._loop.run_until_complete(
+            asyncio.start_server(self._client_handler, sock=self.server_socket, backlog=self._CLIENT_NUMBER))
+        self._loop.call_later(Network.DEADLINE_TICK, self._check_deadlines)
+        started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    def server_exit(self):
+        if self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._close_all(), self._loop)
+
+    async def _close_all(self):
+        self._aio_server.close()
+        if self._multicast is not None:
+            self._multicast.close()
+        if self._spectators is not None:
+            self._spectators.close()
+        for client_id in self.connections.ids():
+            self._client_cleaner(client_id)
+        # 连接关闭后各客户端协程会读到EOF并自行退出，等它们结束再停止事件循环
+        handlers = asyncio.all_tasks() - {asyncio.current_task()}
+        await asyncio.gather(*handlers, return_exceptions=True)
+        self._loop.stop()
+
+    def _claim_session(self, token):
+        """_claim_session(token) -> (client_id, token, resumed)
+
+        令牌有效时拿回原来的ID，否则分配一个新ID和新令牌；房间已满时client_id为None。
+        """
+        client_id = self.connections.lookup(token)
+        if client_id is not None:
+            self.connections.last_seen[client_id] = time.monotonic()
+            old_conn = self.connections.conns[client_id]
+            if old_conn is not None:  # 服务器可能还没发现旧连接已经断了
+                old_conn[0].close()
+            self.connections.conns[client_id] = None
+            return client_id, token, True
+        client_id, token = self.connections.allocate(None)  # 连接状态由调用方随后填入
+        if client_id is not None:
+            self.barrier.join(client_id)
+        return client_id, token, False
+
+    def player_names(self) -> list:
+        """
+        见Network.Server.player_names。名字只在事件循环中修改，复制列表即可。
+        """
+        return list(self.connections.names)
+
+    def _client_dropped(self, client_id: int, writer: asyncio.StreamWriter):
+        """
+        游戏进行中连接断开：保留玩家ID和令牌Network.RECONNECT_GRACE秒，到期后才释放。
+        """
+        writer.close()
+        conn = self.connections.conns[client_id]
+        if conn is None or conn[0] is not writer:  # 已经重连了，这是旧连接
+            return
+        self.connections.conns[client_id] = None
+        self.connections.last_seen[client_id] = time.monotonic()
+        self._watch(client_id)
+        print(f'S-INFO: Client {client_id} disconnected, waiting {Network.RECONNECT_GRACE}s for reconnect.')
+
+    def _deadline_of(self, client_id: int):
+        """
+        见Network.Server._deadline_of。
+        """
+        table = self.connections
+        if client_id not in table:
+            return None
+        if table.conns[client_id] is None:
+            return table.last_seen[client_id] + Network.RECONNECT_GRACE
+        if table.heartbeat[client_id] and self._HEARTBEAT_TIMEOUT is not None:
+            return table.last_seen[client_id] + self._HEARTBEAT_TIMEOUT
+        return None
+
+    def _watch(self, client_id: int):
+        deadline = self._deadline_of(client_id)
+        if deadline is None:
+            self._deadlines.cancel(client_id)
+        else:
+            self._deadlines.schedule(client_id, deadline)
+
+    def _check_deadlines(self):
+        """
+        推进时间轮，见Network.Server._deadline_checker。
+        """
+        now = time.monotonic()
+        for client_id in self._deadlines.advance(now):
+            deadline = self._deadline_of(client_id)
+            if deadline is None:
+                continue
+            if deadline > now:
+                self._deadlines.schedule(client_id, deadline)
+                continue
+            conn = self.connections.conns[client_id]
+            if conn is not None:  # 对方已经不在了，发送缓冲区里的数据不必再等
+                print(f'S-INFO: Client {client_id} sent nothing for {self._HEARTBEAT_TIMEOUT}s, considered dead.')
+                self.metrics.inc('heartbeat_timeouts', 1, client_id)
+                conn[0].transport.abort()
+            self._client_cleaner(client_id)
+        self._loop.call_later(Network.DEADLINE_TICK, self._check_deadlines)
+
+    def _client_cleaner(self, client_id: int):
+        conn, token = self.connections.release(client_id)
+        self._unicast_ids.discard(client_id)
+        self._deadlines.cancel(client_id)
+        if conn is not None:
+            conn[0].close()
+        if token is not None:
+            self.barrier.leave(client_id)  # 之后的轮次不再等待该玩家
+            print(f"S-INFO: Client {client_id} offline.")
+
+    def _snapshot(self) -> dict:
+        """
+        重连时发给客户端的快照，见Network.Server._snapshot。
+        """
+        if self._t_result is None:
+            return {'ROUND': self.barrier.round}
+        result = self._t_result
+        return {'ROUND': self.barrier.round, 'RESULT_ROUND': result.round, 'INPUTS': result.inputs,
+                'G': result.g_value, 'SCORE': result.scores, 'AGAIN': result.play_again}
+
+    def _add_spectator(self, writer: asyncio.StreamWriter, msg: dict):
+        """
+        把观战者的连接从事件循环中摘出来，交给SpectatorHub的分发线程，见Network.Server._add_spectator。
+        """
+        transport_socket = writer.get_extra_info('socket')
+        client = socket.fromfd(transport_socket.fileno(), transport_socket.family, transport_socket.type)  # 复制一份
+        writer.transport.abort()  # 只关闭事件循环持有的那一份，连接本身不受影响
+        codec = Network.negotiate_codec(msg['DATA'].get('CODECS'))
+        compress = Network.negotiate_compression(msg['DATA'].get('COMPRESS'))
+        greeting = Network._encode_frame(CMD.S_SPECTATE, {'OK': True, 'CODEC': codec, 'ROUND': self.barrier.round,
+                                                          'COMPRESS': Network.compression_name(compress)})
+        codec |= compress
+        if self._spectators is None:
+            self._spectators = Spectators.SpectatorHub(self.metrics)
+            if self._t_result is not None:
+                self._spectators.publish(self._t_result)
+        self._spectators.add(client, codec, greeting)
+
+    @staticmethod
+    async def _recv_frame(reader: asyncio.StreamReader):
+        """
+        Network._recv_frame的协程版本，只接收客户端的消息，不接受压缩的帧。
+        """
+        length, codec = Network._FRAME_HEADER.unpack(await reader.readexactly(Network._FRAME_HEADER.size))
+        Network._check_frame_size(length)
+        payload = await reader.readexactly(length)
+        return Network._decode_payload(payload, codec, compressed=False), Network._FRAME_HEADER.size + length
+
+    async def _client_handler(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        处理客户端消息。
+        """
+        addr = writer.get_extra_info('peername')
+        print(f'S-INFO: Accept a new client {addr[0]}:{addr[1]}')
+        # 第一次握手
+        client_id = None
+        try:
+            msg, _ = await self._recv_frame(reader)
+            if CMD.C_SPECTATE == msg['CMD']:
+                self._add_spectator(writer, msg)
+                return
+            assert CMD.C_JOIN == msg['CMD']
+            codec = Network.negotiate_codec(msg['DATA'].get('CODECS'))
+            compress = Network.negotiate_compression(msg['DATA'].get('COMPRESS'))
+            delta = bool(msg['DATA'].get('DELTA'))
+            client_id, token, resumed = self._claim_session(msg['DATA'].get('TOKEN'))
+            if client_id is None:  # 房间已满
+                writer.write(Network._encode_frame(CMD.S_JOIN, CMD.protocol[CMD.S_JOIN].copy()))
+                writer.close()
+                return
+            multicast = self._multicast is not None and bool(msg['DATA'].get('MULTICAST'))
+            conn = self.connections.conns[client_id] = [writer, codec | compress, delta, False, self.barrier.round,
+                                                        multicast]
+            heartbeat = self._HEARTBEAT_TIMEOUT is not None and bool(msg['DATA'].get('HEARTBEAT'))
+            self.connections.heartbeat[client_id] = heartbeat
+            self.connections.names[client_id] = Network.player_name(msg['DATA'].get('NAME'))
+            self._watch(client_id)
+            if multicast:
+                self._unicast_ids.discard(client_id)
+            else:
+                self._unicast_ids.add(client_id)
+            data = CMD.protocol[CMD.S_JOIN].copy()
+            data.update(ID=client_id, CODEC=codec, DELTA=delta, ROUND=self.barrier.round, TOKEN=token,
+                        MULTICAST=list(self._multicast.address) if multicast else None,
+                        COMPRESS=Network.compression_name(compress),
+                        HEARTBEAT=self._HEARTBEAT_TIMEOUT / Network.HEARTBEAT_MISSES if heartbeat else None)
+            writer.write(Network._encode_frame(CMD.S_JOIN, data))
+            codec |= compress  # 之后发给该客户端的结果和快照都可以压缩
+            if resumed:
+                data = CMD.protocol[CMD.S_SNAPSHOT].copy()
+                data.update(self._snapshot())
+                writer.write(Network._encode_frame(CMD.S_SNAPSHOT, data, codec))
+                conn[3] = self._t_result is not None  # 快照中的分数就是下一次增量结果的基础
+                print(f'S-INFO: Client {client_id} reconnected at round {self.barrier.round}.')
+        except (ValueError, struct.error, KeyError, AssertionError,
+                asyncio.IncompleteReadError, OSError) as e:  # 不是从合法客户端发来的消息
+            print(f'S-INFO: First handshake with Client {client_id} failed. \n\t\tError reported as ', repr(e))
+            if client_id is None:
+                writer.close()
+            else:
+                self._client_dropped(client_id, writer)
+            return
+        # 后续通讯
+        while self._t_play_again:
+            try:
+                msg, size = await self._recv_frame(reader)
+                self.connections.touch(client_id, size)
+                self.metrics.inc('bytes_in', size, client_id)
+                self.metrics.inc('messages_in', 1, client_id)
+                if CMD.C_HEARTBEAT == msg['CMD']:  # 只需要更新last_seen
+                    continue
+                if CMD.C_RESEND == msg['CMD']:
+                    self._resend_results(writer, client_id, codec, msg['DATA']['ROUNDS'])
+                    continue
+                assert CMD.C_INPUT == msg['CMD']
+                round_ = msg['DATA'].get('ROUND')
+                round_ = conn[4] if round_ is None else round_
+                self._handle_client_input(msg['DATA'], client_id, round_)
+            except AssertionError:  # 客户端发来的命令未在CMD中枚举
+                print(f'S-EXCEPTION: Unable to parse command "{msg["CMD"]}" from Client {client_id}.')
+            except (ValueError, struct.error, KeyError) as e:  # 无法解码的帧，之后的字节流已经不可信
+                print(f'S-EXCEPTION: Malformed frame from Client {client_id}.\n\t\tError reported as ', repr(e))
+                self._client_dropped(client_id, writer)
+                break
+            except (asyncio.IncompleteReadError, OSError):  # 客户端断开链接，保留ID等待重连
+                print(f'S-EXCEPTION: Client {client_id} forcibly closed an existing connection.')
+                self._client_dropped(client_id, writer)
+                break
+
+    def _resend_results(self, writer: asyncio.StreamWriter, client_id: int, codec: int, rounds: list):
+        """
+        补发组播中丢失的结果，见Network.Server._resend_results。
+        """
+        for round_ in rounds:
+            result = self._multicast.lookup(round_) if self._multicast is not None else None
+            if result is None:
+                continue
+            frame = result.frame(codec)
+            writer.write(frame)
+            self.connections.sent(client_id, len(frame))
+            self.metrics.inc('bytes_out', len(frame), client_id)
+            self.metrics.inc('messages_out', 1, client_id)
+            self.metrics.inc('resent_results', 1, client_id)
+
+    def _handle_client_input(self, data, client_id: int, round_: int) -> str:
+        """
+        结果总是广播给所有在线客户端，被拒绝的输入不需要回复。
+        """
+        status = self.barrier.submit(round_, client_id, data['VALUE'])
+        if status == RoundBarrier.ACCEPTED:
+            self.connections.submitted(client_id, round_)
+        else:
+            print(f'S-EXCEPTION: Reject {status} input of round {round_} from Client {client_id}.')
+            self.metrics.inc(f'{status}_inputs', 1, client_id)
+        return status
+
+    def get_player_inputs(self):
+        """
+        阻塞至本轮结束（所有玩家都上传了输入，或者到了截止时间），缺席玩家的输入为Scoring.ABSENT。
+        """
+        self._closed_round, self._player_inputs, absent = self.barrier.wait_inputs()
+        self.metrics.set('last_arrival', self.barrier.last_arrival)  # 本轮最后一个提交输入的客户端
+        self.metrics.inc('last_arrivals', 1, self.barrier.last_arrival)
+        if absent:
+            self.metrics.inc('absent_inputs', len(absent))
+            print(f'S-INFO: Round {self._closed_round} closed without Client {absent}.')
+        return self._player_inputs
+
+    def send_result(self, g_value: float, scores: list, play_again: bool):
+        self._loop.call_soon_threadsafe(self._broadcast_result, g_value, scores, play_again)
+
+    def _broadcast_result(self, g_value: float, scores: list, play_again: bool):
+        """
+        在事件循环中向所有客户端返回本轮游戏结果。写入只进入发送缓冲区，不会被单个慢客户端阻塞；
+        缓冲区积压超过WRITE_BUFFER_LIMIT的客户端直接断开（可以重连），积压不会无限增长。
+
+        round_broadcast_seconds记录的是写入发送缓冲区的耗时，不包括内核把数据发出去的时间。
+        """
+        begin = time.perf_counter()
+        self._t_play_again = play_again
+        last_scores = self._t_result.scores if self._t_result is not None else None
+        self._t_result = Network.RoundResult(self._player_inputs, g_value, scores, play_again, last_scores,
+                                             self._closed_round)
+        if self._spectators is not None:
+            self._spectators.publish(self._t_result)
+        if self._multicast is not None:  # 通过组播接收的客户端共用这一次发送
+            self.metrics.inc('multicast_bytes_out', self._multicast.send(self._t_result))
+            self.metrics.inc('multicast_messages_out')
+        conns, bytes_out = self.connections.conns, self.connections.bytes_out
+        for client_id in self._unicast_ids:
+            conn = conns[client_id]
+            if conn is None:
+                continue
+            writer, codec, delta, has_scores, _, _ = conn
+            if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                print(f'S-INFO: Client {client_id} has not read {WRITE_BUFFER_LIMIT} bytes of results, disconnect it.')
+                self.metrics.inc('slow_client_drops', 1, client_id)
+                writer.transport.abort()  # 丢弃积压的数据，不等它发完
+                self._client_dropped(client_id, writer)
+                continue
+            frame = self._t_result.frame(codec, delta and has_scores)  # 每种编码只序列化一次
+            writer.write(frame)
+            conn[3] = True
+            conn[4] = self._closed_round + 1
+            bytes_out[client_id] += len(frame)
+            self.metrics.inc('bytes_out', len(frame), client_id)
+            self.metrics.inc('messages_out', 1, client_id)
+        self.metrics.observe('round_broadcast_seconds', time.perf_counter() - begin)
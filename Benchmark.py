@@ -0,0 +1,614 @@
+"""
+文件名：    Benchmark.py
+功  能：    性能测试。运行方式：python Benchmark.py [测试名 ...]，不写测试名时运行全部测试。
+"""
+import io
+import sys
+import json
+import time
+import random
+import timeit
+import secrets
+import socket
+import statistics
+import contextlib
+from threading import Thread
+
+import Network
+import Scoring
+
+
+def _best_of(stmt, number: int, repeat: int = 5) -> float:
+    """
+    返回单次执行stmt的最短用时（秒）。
+    """
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def bench_codec(player_numbers=(10, 100, 1000, 10000)):
+    """
+    每轮S_INPUT消息的编码+解码耗时：旧的json.dumps/loads vs 帧协议的json和二进制编码。
+    """
+    print('codec: S_INPUT encode+decode per round')
+    print(f'{"players":>8} {"legacy json":>14} {"framed json":>14} {"binary":>14} {"bytes json/bin":>16}')
+    for n in player_numbers:
+        data = {'ROUND': 3, 'INPUTS': [random.uniform(0, 100) for _ in range(n)], 'G': 30.9,
+                'SCORE': [random.randint(-200, 2000) for _ in range(n)], 'AGAIN': True}
+        number = max(1, 20000 // n)
+
+        def legacy():
+            json.loads(json.dumps({'CMD': Network.CMD.S_INPUT, 'DATA': data}).encode().decode())
+
+        def framed(codec):
+            frame = Network._encode_frame(Network.CMD.S_INPUT, data, codec)
+            length, codec_ = Network._FRAME_HEADER.unpack_from(frame)
+            Network._decode_payload(frame[Network._FRAME_HEADER.size:], codec_)
+
+        t_legacy = _best_of(legacy, number)
+        t_json = _best_of(lambda: framed(Network.CODEC_JSON), number)
+        t_bin = _best_of(lambda: framed(Network.CODEC_BINARY), number)
+        size_json = len(Network._encode_frame(Network.CMD.S_INPUT, data, Network.CODEC_JSON))
+        size_bin = len(Network._encode_frame(Network.CMD.S_INPUT, data, Network.CODEC_BINARY))
+        print(f'{n:>8} {t_legacy * 1e6:>12.1f}us {t_json * 1e6:>12.1f}us {t_bin * 1e6:>12.1f}us '
+              f'{size_json:>8}/{size_bin:<7}')
+
+
+class _BotSwarm:
+    """
+    在一个线程里用裸socket模拟大量客户端，避免测试端自身的线程开销干扰服务器测量。
+    """
+
+    def __init__(self, server_addr, bot_number: int, codec: int = Network.CODEC_BINARY):
+        self.sockets = []
+        self.ids = []
+        for _ in range(bot_number):
+            s = socket.create_connection(server_addr)
+            Network._send_data(s, Network.CMD.C_JOIN, CODECS=[codec])
+            msg = Network._recv_data(s)
+            self.sockets.append(s)
+            self.ids.append(msg['DATA']['ID'])
+        self.codec = codec
+
+    def play_round(self) -> float:
+        """
+        所有bot提交输入并收齐结果，返回本轮耗时（秒）。
+        """
+        begin = time.perf_counter()
+        for s, id_ in zip(self.sockets, self.ids):
+            Network._send_data(s, Network.CMD.C_INPUT, self.codec, ID=id_, VALUE=random.uniform(0, 100))
+        for s in self.sockets:
+            Network._recv_data(s)
+        return time.perf_counter() - begin
+
+    def close(self):
+        for s in self.sockets:
+            s.close()
+
+
+def _serve_rounds(server, player_number: int, rounds: int):
+    """
+    代替GameBoard驱动服务器，只做最少的计算，测量的就是网络层本身。
+    """
+    scores = [0] * player_number
+    for round_ in range(rounds):
+        inputs = server.get_player_inputs()
+        server.send_result(sum(inputs) / len(inputs) * 0.618, scores, round_ < rounds - 1)
+
+
+def bench_server(player_numbers=(10, 100, 1000, 5000), rounds: int = 20):
+    """
+    线程版Network.Server与事件循环版AsyncNetwork.AsyncServer的每轮延迟对比。
+    10k以上连接需要把文件描述符上限调到2倍连接数以上（测试端和服务器在同一进程）。
+    """
+    import AsyncNetwork
+    print('server: per-round latency (all inputs sent -> all results received)')
+    print(f'{"engine":>8} {"players":>8} {"p50":>10} {"p99":>10} {"max":>10}')
+    for n in player_numbers:
+        for name, server_class in (('thread', Network.Server), ('asyncio', AsyncNetwork.AsyncServer)):
+            with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽服务器的连接日志
+                server = server_class(n)
+                addr = server.listen(0)  # 由系统分配端口
+                swarm = _BotSwarm(addr, n)
+                T_game = Thread(target=_serve_rounds, args=(server, n, rounds))
+                T_game.setDaemon(True)
+                T_game.start()
+                latencies = sorted(swarm.play_round() for _ in range(rounds))
+                T_game.join()
+                swarm.close()
+                server.server_exit()
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f'{name:>8} {n:>8} {statistics.median(latencies) * 1e3:>8.2f}ms {p99 * 1e3:>8.2f}ms '
+                  f'{latencies[-1] * 1e3:>8.2f}ms')
+
+
+def _legacy_scores(inputs: list, last_scores: list) -> list:
+    """
+    原GameBoard._calculate_scores的实现（字典+排序），作为对照。
+    """
+    n = len(inputs)
+    g_value = sum(inputs) / n * 0.618
+    t_inputs = dict(zip(range(n), inputs))
+    for id_, input_ in t_inputs.items():
+        t_inputs[id_] = abs(input_ - g_value)
+    t_inputs = sorted(t_inputs.items(), key=lambda x: x[1], reverse=False)
+    t_scores = dict(zip(range(n), last_scores))
+    id_, input_ = t_inputs[0]
+    for player in t_inputs:
+        if input_ != player[1]:
+            break
+        t_scores[player[0]] += n
+    id_, input_ = t_inputs[-1]
+    for player in t_inputs[::-1]:
+        if input_ != player[1]:
+            break
+        t_scores[player[0]] += -2
+    return list(t_scores.values())
+
+
+def bench_scoring(player_numbers=(10, 1000, 100000)):
+    """
+    计分内核与原实现的耗时对比（输入取整数以制造大量并列）。结果是否一致见tests/test_scoring.py。
+    """
+    print('scoring: one round of G + closest/farthest + new scores')
+    print(f'{"players":>8} {"legacy":>12} {"python":>12} {"numpy":>12}')
+    for n in player_numbers:
+        inputs = [float(random.randint(1, 99)) for _ in range(n)]
+        last_scores = [random.randint(-20, 200) for _ in range(n)]
+
+        def kernel(find_extremes):
+            g_value = Scoring.calculate_g(inputs)
+            closest, farthest = find_extremes(inputs, g_value)
+            return Scoring.apply_points(last_scores, closest, farthest, n)
+
+        number = max(1, 100000 // n)
+        t_legacy = _best_of(lambda: _legacy_scores(inputs, last_scores), number)
+        t_python = _best_of(lambda: kernel(Scoring._find_extremes_python), number)
+        if Scoring._load_numpy() is not None:
+            t_numpy = f'{_best_of(lambda: kernel(Scoring._find_extremes_numpy), number) * 1e6:>10.1f}us'
+        else:
+            t_numpy = f'{"n/a":>12}'
+        print(f'{n:>8} {t_legacy * 1e6:>10.1f}us {t_python * 1e6:>10.1f}us {t_numpy}')
+
+
+def bench_broadcast(player_numbers=(10, 100, 1000, 5000)):
+    """
+    每轮结果广播的编码耗时与字节数：逐个客户端编码 vs 只编码一次；全量帧 vs 增量帧。
+    """
+    print('broadcast: encode cost per round for the whole room, bytes per client')
+    print(f'{"players":>8} {"per-client json":>16} {"once json":>12} {"once binary":>12} '
+          f'{"full bytes":>11} {"delta bytes":>12}')
+    for n in player_numbers:
+        inputs = [random.uniform(0, 100) for _ in range(n)]
+        last_scores = [random.randint(-200, 2000) for _ in range(n)]
+        g_value, scores, _, _ = Scoring.score_round(inputs, last_scores)
+        number = max(1, 200 // n)
+
+        def per_client():  # 每个客户端的编码相同，测一次再乘以n
+            Network._encode_frame(Network.CMD.S_INPUT, {'ROUND': 0, 'INPUTS': inputs, 'G': g_value,
+                                                        'SCORE': scores, 'AGAIN': True})
+
+        def once(codec):
+            result = Network.RoundResult(inputs, g_value, scores, True, last_scores)
+            for _ in range(n):
+                result.frame(codec)
+
+        t_per_client = _best_of(per_client, number, repeat=3) * n
+        t_json = _best_of(lambda: once(Network.CODEC_JSON), number, repeat=3)
+        t_bin = _best_of(lambda: once(Network.CODEC_BINARY), number, repeat=3)
+        result = Network.RoundResult(inputs, g_value, scores, True, last_scores)
+        full, delta = len(result.frame(Network.CODEC_BINARY)), len(result.frame(Network.CODEC_BINARY, True))
+        print(f'{n:>8} {t_per_client * 1e3:>14.2f}ms {t_json * 1e3:>10.2f}ms {t_bin * 1e3:>10.2f}ms '
+              f'{full:>11} {delta:>12}')
+
+
+def bench_metrics(player_numbers=(10, 100, 1000), rounds: int = 30):
+    """
+    插桩本身的开销：单次记录操作的耗时，以及线程版服务器开启/关闭指标时的每轮延迟。
+    """
+    import Metrics
+    print('metrics: cost of one recording call')
+    for enabled in (True, False):
+        registry = Metrics.Registry(enabled)
+        t_inc = _best_of(lambda: registry.inc('bytes_in', 64, 7), 100000)
+        t_observe = _best_of(lambda: registry.observe('round_compute_seconds', 0.0012), 100000)
+        print(f'{"enabled" if enabled else "disabled":>10}: inc {t_inc * 1e9:>6.0f}ns  '
+              f'observe {t_observe * 1e9:>6.0f}ns')
+    print('metrics: thread server per-round latency p50, instrumentation on/off')
+    print(f'{"players":>8} {"on":>10} {"off":>10} {"overhead":>10}')
+    for n in player_numbers:
+        p50 = {}
+        for enabled in (True, False):
+            with contextlib.redirect_stdout(io.StringIO()):
+                server = Network.Server(n)
+                server.metrics.enabled = enabled
+                swarm = _BotSwarm(server.listen(0), n)
+                T_game = Thread(target=_serve_rounds, args=(server, n, rounds))
+                T_game.setDaemon(True)
+                T_game.start()
+                p50[enabled] = statistics.median(swarm.play_round() for _ in range(rounds))
+                T_game.join()
+                swarm.close()
+                server.server_exit()
+        print(f'{n:>8} {p50[True] * 1e3:>8.2f}ms {p50[False] * 1e3:>8.2f}ms '
+              f'{(p50[True] / p50[False] - 1) * 100:>9.1f}%')
+
+
+def _time_to_ready(args: list) -> float:
+    """
+    启动服务器进程，返回从启动到第一个客户端连接成功的耗时（秒）。服务器就绪时打印"ready on ip:port"。
+    """
+    import subprocess
+    begin = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-u'] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True)
+    try:
+        for line in process.stdout:
+            if 'ready on' in line:
+                ip_, _, port_ = line.split('ready on ')[1].split()[0].rpartition(':')
+                socket.create_connection((ip_, int(port_))).close()
+                return time.perf_counter() - begin
+        raise RuntimeError(f'{args} exited before ready.')
+    finally:
+        process.kill()
+        process.wait()
+
+
+def bench_startup(repeat: int = 5):
+    """
+    无界面服务器从启动进程到可以接受连接的耗时，与空解释器启动和导入GUI模块对比。
+    """
+    import subprocess
+    print('startup: process start -> first connection accepted (best of %d)' % repeat)
+
+    def interpreter(code: str):
+        begin = time.perf_counter()
+        if subprocess.run([sys.executable, '-c', code], stderr=subprocess.DEVNULL).returncode:
+            return None
+        return time.perf_counter() - begin
+
+    rows = (('python -c pass', lambda: interpreter('pass')),
+            ('import tkinter+matplotlib', lambda: interpreter('import tkinter, matplotlib.pyplot')),
+            ('Headless.py', lambda: _time_to_ready(['Headless.py', '2', '--rounds', '1', '--port', '0',
+                                                    '--host', '127.0.0.1'])))
+    for name, run in rows:
+        times = [run() for _ in range(repeat)]
+        best = 'n/a' if None in times else f'{min(times) * 1e3:.1f}ms'
+        print(f'{name:>26} {best:>10}')
+
+
+def bench_replay(player_numbers=(10, 100, 1000), rounds: int = 200000):
+    """
+    对局日志的回放速度：整块NumPy计算 vs 逐轮计算。回放的正确性见tests/test_matchlog.py。
+    """
+    import os
+    import tempfile
+    import MatchLog
+    import Replay
+    print('replay: rounds per second when re-scoring a match log')
+    print(f'{"players":>8} {"rounds":>8} {"log size":>10} {"numpy":>12} {"python":>12}')
+    for n in player_numbers:
+        fd, path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        try:
+            total = max(1000, rounds * 10 // n)
+            writer = MatchLog.MatchLogWriter(path, n)
+            scores = [0] * n
+            for round_ in range(total):
+                inputs = [float(random.randint(1, 99)) for _ in range(n)]
+                g_value, scores, _, _ = Scoring.score_round(inputs, scores)
+                writer.append(round_, inputs, g_value, scores)
+            writer.close()
+            speed = {}
+            for use_numpy in (True, False):
+                if use_numpy and Scoring._load_numpy() is None:
+                    continue
+                report = Replay.replay(path, use_numpy=use_numpy)
+                speed[use_numpy] = report['rounds_per_sec']
+            t_numpy = f'{speed[True]:>12.0f}' if True in speed else f'{"n/a":>12}'
+            print(f'{n:>8} {total:>8} {os.path.getsize(path) / 2 ** 20:>8.1f}MB {t_numpy} {speed[False]:>12.0f}')
+        finally:
+            os.remove(path)
+
+
+def bench_stats(player_numbers=(100, 1000, 10000, 100000)):
+    """
+    排行榜查询：每次重新排序全部分数 vs Ranking；以及每轮更新统计的耗时。
+    """
+    import Statistics
+    print('stats: leaderboard queries and per-round update')
+    print(f'{"players":>8} {"sort top10":>12} {"tree top10":>12} {"scan rank":>12} {"tree rank":>12} '
+          f'{"update":>10}')
+    for n in player_numbers:
+        stats = Statistics.PlayerStats(n)
+        scores = [0] * n
+        for _ in range(20):
+            inputs = [float(random.randint(1, 99)) for _ in range(n)]
+            g_value, scores, closest, farthest = Scoring.score_round(inputs, scores)
+            stats.update(inputs, g_value, scores, closest, farthest)
+        number = max(1, 100000 // n)
+        t_sort = _best_of(lambda: sorted(range(n), key=lambda i: (-scores[i], i))[:10], number, repeat=3)
+        t_top = _best_of(lambda: stats.top(10), 10000)
+        player_id = n // 2
+        t_scan = _best_of(lambda: 1 + sum(s > scores[player_id] for s in scores), number, repeat=3)
+        t_rank = _best_of(lambda: stats.rank(player_id), 10000)
+        t_update = _best_of(lambda: stats.update(inputs, g_value, scores, closest, farthest), max(1, 1000 // n * 10),
+                            repeat=3)
+        print(f'{n:>8} {t_sort * 1e6:>10.1f}us {t_top * 1e6:>10.1f}us {t_scan * 1e6:>10.1f}us '
+              f'{t_rank * 1e6:>10.1f}us {t_update * 1e3:>8.2f}ms')
+
+
+def bench_compress(player_numbers=(10, 100, 1000, 10000, 100000)):
+    """
+    结果帧压缩的CPU与字节数权衡：服务器每轮压缩一次的耗时，客户端解压并解码的耗时，以及压缩前后的字节数。
+    输入取一位小数（玩家手动输入的数字），分数为累计若干轮后的整数。
+    """
+    print(f'compress: zlib level {Network.COMPRESS_LEVEL} on one S_INPUT frame, '
+          f'threshold {Network.COMPRESS_THRESHOLD}B')
+    print(f'{"players":>8} {"codec":>7} {"raw bytes":>10} {"zlib bytes":>11} {"ratio":>6} '
+          f'{"compress":>10} {"decode raw":>11} {"decode zlib":>12}')
+    for n in player_numbers:
+        inputs = [round(random.uniform(0, 100), 1) for _ in range(n)]
+        scores = [random.randint(-40, 40) * 2 for _ in range(n)]
+        g_value = Scoring.calculate_g(inputs)
+        number = max(1, 20000 // n)
+        for codec, name in ((Network.CODEC_JSON, 'json'), (Network.CODEC_BINARY, 'binary')):
+            result = Network.RoundResult(inputs, g_value, scores, True)
+            raw = result.frame(codec)
+            packed = result.frame(codec | Network.COMPRESS_ZLIB)
+
+            def compress():  # 每轮每种编码只压缩一次，这里包含编码本身的耗时再减去
+                Network.RoundResult(inputs, g_value, scores, True).frame(codec | Network.COMPRESS_ZLIB)
+
+            def encode():
+                Network.RoundResult(inputs, g_value, scores, True).frame(codec)
+
+            def decode(frame):
+                length, frame_codec = Network._FRAME_HEADER.unpack_from(frame)
+                return Network._decode_payload(frame[Network._FRAME_HEADER.size:], frame_codec)
+
+            assert decode(packed) == decode(raw)
+            t_compress = _best_of(compress, number, repeat=3) - _best_of(encode, number, repeat=3)
+            t_raw = _best_of(lambda: decode(raw), number, repeat=3)
+            t_zlib = _best_of(lambda: decode(packed), number, repeat=3)
+            print(f'{n:>8} {name:>7} {len(raw):>10} {len(packed):>11} {len(packed) / len(raw):>6.2f} '
+                  f'{t_compress * 1e3:>8.3f}ms {t_raw * 1e3:>9.3f}ms {t_zlib * 1e3:>10.3f}ms')
+
+
+def bench_simulator(player_numbers=(10, 100, 1000), rounds: int = 1000000):
+    """
+    离线策略模拟的速度：100玩家时模拟rounds轮，其他规模按玩家数反比调整，即玩家输入的总数相同。
+    每局100轮，一半玩家随机乱猜、一半跟随上一轮的G。
+    """
+    import Simulator
+    if Scoring._load_numpy() is None:
+        print('simulator: n/a (requires NumPy)')
+        return
+    print('simulator: rounds per second, half uniform / half follow, 100 rounds per game')
+    print(f'{"players":>8} {"rounds":>9} {"seconds":>8} {"rounds/s":>10}')
+    for n in player_numbers:
+        games = max(1, rounds // n)
+        report = Simulator.simulate({'uniform': n - n // 2, 'follow': n // 2}, 100, games)
+        print(f'{n:>8} {100 * games:>9} {report["seconds"]:>8.2f} {report["rounds_per_sec"]:>10.0f}')
+
+
+def _legacy_allocate(tokens: list, sessions: dict, number: int):
+    """
+    原来的分配方式：每次从头扫描第一个空闲ID。
+    """
+    for _ in range(number):
+        client_id = tokens.index(None)
+        token = secrets.token_hex(16)
+        tokens[client_id] = token
+        sessions[token] = client_id
+
+
+def _table_allocate(table, number: int):
+    for _ in range(number):
+        table.allocate()
+
+
+def _join_burst(server_addr, bot_number: int) -> float:
+    """
+    先建立全部连接，再一起发送C_JOIN，返回从开始连接到收齐所有S_JOIN的耗时（秒）。
+    """
+    begin = time.perf_counter()
+    sockets = [socket.create_connection(server_addr) for _ in range(bot_number)]
+    for s in sockets:
+        Network._send_data(s, Network.CMD.C_JOIN, CODECS=[Network.CODEC_BINARY])
+    ids = {Network._recv_data(s)['DATA']['ID'] for s in sockets}
+    seconds = time.perf_counter() - begin
+    assert ids == set(range(bot_number))
+    for s in sockets:
+        s.close()
+    return seconds
+
+
+def bench_join(player_numbers=(100, 1000, 5000)):
+    """
+    一次涌入大量玩家：逐个扫描空闲ID vs ConnectionTable的空闲栈，以及两种服务器收齐一批握手的耗时。
+    """
+    import AsyncNetwork
+    import ConnectionTable
+    print('join: slot allocation for a full room, and a burst of joins over TCP')
+    print(f'{"players":>8} {"scan":>10} {"free list":>10} {"thread":>10} {"asyncio":>10}')
+    for n in player_numbers:
+        t_scan = _best_of(lambda: _legacy_allocate([None] * n, {}, n), 1, repeat=3)
+        t_table = _best_of(lambda: _table_allocate(ConnectionTable.ConnectionTable(n), n), 1, repeat=3)
+        bursts = []
+        for server_class in (Network.Server, AsyncNetwork.AsyncServer):
+            with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽服务器的连接日志
+                server = server_class(n)
+                bursts.append(_join_burst(server.listen(0), n))
+                server.server_exit()
+                time.sleep(0.2)  # 等各连接的断线日志打印完
+        print(f'{n:>8} {t_scan * 1e3:>8.2f}ms {t_table * 1e3:>8.2f}ms {bursts[0] * 1e3:>8.1f}ms '
+              f'{bursts[1] * 1e3:>8.1f}ms')
+
+
+def bench_deadlines(player_numbers=(1000, 10000, 100000)):
+    """
+    时间轮：为n个连接设置截止时刻，每个tick推进一格（没有到期的键），以及同一时刻全部到期。
+    对比为每个连接创建一个threading.Timer（每个Timer是一个线程，只测1000个）。
+    """
+    import threading
+    import TimingWheel
+    print('deadlines: hashed timing wheel, per-connection deadlines')
+    print(f'{"players":>8} {"schedule":>10} {"tick":>10} {"expire all":>12} {"Timer x1000":>12}')
+    t_timer = None
+    for n in player_numbers:
+        wheel = TimingWheel.TimingWheel(Network.DEADLINE_TICK, now=0.0)
+        begin = time.perf_counter()
+        for key in range(n):
+            wheel.schedule(key, 15.0 + key % 1000 * 0.001)  # 心跳超时都落在同一秒内
+        t_schedule = time.perf_counter() - begin
+        t_tick = _best_of(lambda: wheel.advance(1.0), 1000)
+        begin = time.perf_counter()
+        expired = wheel.advance(16.0)
+        t_expire = time.perf_counter() - begin
+        assert len(expired) == n and not len(wheel)
+        if t_timer is None:
+            def timers():
+                started = [threading.Timer(15.0, int) for _ in range(1000)]
+                for timer in started:
+                    timer.start()
+                for timer in started:
+                    timer.cancel()
+            t_timer = _best_of(timers, 1, repeat=3)
+        print(f'{n:>8} {t_schedule / n * 1e9:>8.0f}ns {t_tick * 1e6:>8.2f}us {t_expire * 1e3:>10.2f}ms '
+              f'{t_timer * 1e3:>10.2f}ms')
+
+
+def bench_store(rounds: int = 1000000, player_number: int = 10, matches: int = 20000):
+    """
+    MatchStore：游戏线程每轮入队的耗时、后台线程的写入速度，以及库中有rounds轮、matches局时排行榜和玩家记录的查询耗时。
+    """
+    import os
+    import tempfile
+    import MatchStore
+    print(f'store: {rounds} rounds x {player_number} players, then {matches} finished matches')
+    with tempfile.TemporaryDirectory() as directory:
+        store = MatchStore.MatchStore(os.path.join(directory, 'bench.db'))
+        match = store.begin_match(player_number)
+        inputs = [random.uniform(0, 100) for _ in range(player_number)]
+        scores = list(range(player_number))
+        begin = time.perf_counter()
+        for round_ in range(rounds):
+            store.add_round(match, round_, 30.9, inputs, scores)
+        t_enqueue = time.perf_counter() - begin
+        store.flush()
+        t_write = time.perf_counter() - begin
+        names = [f'player{i}' for i in range(1000)]
+        for _ in range(matches):
+            handle = store.begin_match(player_number)
+            store.finish_match(handle, [{'id': id_, 'name': name, 'score': random.randint(-20, 100), 'rank': id_ + 1,
+                                         'played': 10, 'wins': 1, 'penalties': 1, 'mean_input': 50.0}
+                                        for id_, name in enumerate(random.sample(names, player_number))])
+        store.flush()
+        t_top = _best_of(lambda: store.leaderboard(10), 100)
+        t_history = _best_of(lambda: store.player_history('player7', 20), 100)
+        t_rounds = _best_of(lambda: sum(1 for _ in store.match_rounds(match.match_id, 500000, 500099)), 100)
+        store.close()
+        size = os.path.getsize(os.path.join(directory, 'bench.db'))
+    print(f'  enqueue {t_enqueue / rounds * 1e6:.2f}us/round, written at {rounds / t_write:.0f} rounds/s, '
+          f'{size / 2 ** 20:.0f}MB')
+    print(f'  top10 {t_top * 1e3:.2f}ms, player history {t_history * 1e3:.2f}ms, 100 rounds of a match '
+          f'{t_rounds * 1e3:.2f}ms')
+
+
+def _legacy_send_data(target_socket, protocol, codec, **kw):
+    data = Network.CMD.protocol[protocol].copy()
+    data.update(kw)
+    target_socket.sendall(Network._encode_frame(protocol, data, codec))
+
+
+def bench_buffers(batch: int = 100, repeat: int = 50):
+    """
+    一个连接上收发帧：_recv_frame（每帧两次recv，每次新分配）与FrameReader（复用缓冲区，一次recv_into读入多帧）的接收耗时，
+    以及旧的发送方式（复制协议模板、帧头与负载拼接后sendall）与现在的发送耗时：C_INPUT用_send_input（一个Struct打包整帧），
+    C_HEARTBEAT用_send_fixed（只编码一次），其余用_send_data（大负载sendmsg聚集写）。
+    每批先写入batch帧（大帧减少到32KB以内）再全部读出，不超过socket的默认缓冲区，两种方式读写的字节完全相同。
+    """
+    sender, receiver = socket.socketpair()
+    inputs, scores = [random.uniform(0, 100) for _ in range(5000)], list(range(5000))
+    cases = [('C_INPUT binary', Network.CMD.C_INPUT, Network.CODEC_BINARY, {'ID': 7, 'VALUE': 42.5, 'ROUND': 3},
+              lambda sock: Network._send_input(sock, Network.CODEC_BINARY, 7, 42.5, 3)),
+             ('C_INPUT json', Network.CMD.C_INPUT, Network.CODEC_JSON, {'ID': 7, 'VALUE': 42.5, 'ROUND': 3},
+              lambda sock: Network._send_input(sock, Network.CODEC_JSON, 7, 42.5, 3)),
+             ('C_HEARTBEAT', Network.CMD.C_HEARTBEAT, Network.CODEC_JSON, {},
+              lambda sock: Network._send_fixed(sock, Network.CMD.C_HEARTBEAT)),
+             ('S_INPUT(100) binary', Network.CMD.S_INPUT, Network.CODEC_BINARY,
+              {'ROUND': 3, 'G': 30.9, 'AGAIN': True, 'INPUTS': inputs[:100], 'SCORE': scores[:100]}, None),
+             ('S_INPUT(5000) binary', Network.CMD.S_INPUT, Network.CODEC_BINARY,
+              {'ROUND': 3, 'G': 30.9, 'AGAIN': True, 'INPUTS': inputs, 'SCORE': scores}, None)]
+    drain = bytearray(128 << 10)
+    gather = f'from {Network.GATHER_THRESHOLD} bytes' if Network._HAS_SENDMSG else 'unavailable'
+    print(f'buffers: up to {batch} frames per batch over a socketpair, gather writes {gather}')
+    print(f'{"frame":>20} {"bytes":>6} {"recv_frame":>11} {"FrameReader":>12} {"speedup":>8} '
+          f'{"old send":>9} {"new send":>11} {"speedup":>8}')
+    for name, protocol, codec, kw, send in cases:
+        if send is None:
+            def send(sock):
+                Network._send_data(sock, protocol, codec, **kw)
+        frame = Network._encode_frame(protocol, {**Network.CMD.protocol[protocol], **kw}, codec)
+        frames = max(1, min(batch, (32 << 10) // len(frame)))
+        blob = frame * frames
+
+        def legacy_recv():
+            sender.sendall(blob)
+            for _ in range(frames):
+                Network._recv_frame(receiver)
+
+        reader = Network.FrameReader(receiver)
+
+        def buffered_recv():
+            sender.sendall(blob)
+            for _ in range(frames):
+                reader.recv()
+
+        def drain_all():
+            left = len(blob)
+            while left:
+                left -= receiver.recv_into(drain, min(left, len(drain)))
+
+        def legacy_send():
+            for _ in range(frames):
+                _legacy_send_data(sender, protocol, codec, **kw)
+            drain_all()
+
+        def new_send():
+            for _ in range(frames):
+                send(sender)
+            drain_all()
+
+        t_legacy = _best_of(legacy_recv, 1, repeat) / frames
+        t_reader = _best_of(buffered_recv, 1, repeat) / frames
+        t_old_send = _best_of(legacy_send, 1, repeat) / frames
+        t_send = _best_of(new_send, 1, repeat) / frames
+        print(f'{name:>20} {len(frame):>6} {t_legacy * 1e6:>9.2f}us {t_reader * 1e6:>10.2f}us '
+              f'{t_legacy / t_reader:>7.1f}x {t_old_send * 1e6:>7.2f}us {t_send * 1e6:>9.2f}us '
+              f'{t_old_send / t_send:>7.1f}x')
+    sender.close()
+    receiver.close()
+
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'server': bench_server,
+    'scoring': bench_scoring,
+    'broadcast': bench_broadcast,
+    'metrics': bench_metrics,
+    'startup': bench_startup,
+    'replay': bench_replay,
+    'stats': bench_stats,
+    'compress': bench_compress,
+    'simulator': bench_simulator,
+    'join': bench_join,
+    'deadlines': bench_deadlines,
+    'store': bench_store,
+    'buffers': bench_buffers,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
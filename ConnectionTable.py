@@ -0,0 +1,119 @@
+"""
+文件名：    ConnectionTable.py
+功  能：    服务器的连接表。玩家ID是并列数组的下标，每个玩家的连接、会话令牌、最近提交的轮次、最后活跃时间和收发字节数
+            各占一个数组的一格；空闲ID放在栈中，分配和释放都是O(1)，一次涌入上千名玩家时不必逐个扫描空位。
+"""
+import time
+import secrets
+from array import array
+
+
+class ConnectionTable:
+    """
+    ID的三种状态：空闲（令牌为None）、在线（令牌和连接都不为None）、等待重连（有令牌，连接为None）。
+    后两种称为占用，占用的ID另外存放在一个紧凑列表中（删除时与末尾交换），遍历时不必经过空闲的ID。
+
+    本类不加锁：Network.Server在_SESSION_LOCK内调用分配/释放，AsyncNetwork只在事件循环中调用；
+    touch/submitted/sent只由该玩家自己的连接写入。
+    """
+    __slots__ = ('capacity', 'conns', 'tokens', 'names', 'rounds', 'last_seen', 'heartbeat', 'waiting', 'bytes_in',
+                 'bytes_out', '_sessions', '_free', '_used', '_position')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.conns = [None] * capacity  # 连接：socket，或AsyncNetwork的连接状态列表；None表示空闲或等待重连
+        self.tokens = [None] * capacity  # 会话令牌，None表示该ID空闲
+        self.names = [None] * capacity  # 玩家在C_JOIN中报上的名字，跨对局识别同一个玩家（见MatchStore），None表示匿名
+        self.rounds = array('q', [-1]) * capacity  # 最近一次被接受的输入属于哪一轮，-1表示还没有
+        self.last_seen = array('d', bytes(8 * capacity))  # 最近一次收到消息的time.monotonic()，等待重连时为断线的时刻
+        self.heartbeat = bytearray(capacity)  # 客户端是否会定期发送心跳，只有发送心跳的客户端才会因为长时间沉默被清理
+        self.waiting = bytearray(capacity)  # Network.Server的处理线程正在等待本轮结果，这期间不读取socket，收不到心跳
+        self.bytes_in = array('Q', bytes(8 * capacity))
+        self.bytes_out = array('Q', bytes(8 * capacity))
+        self._sessions = {}  # 令牌 -> 玩家ID
+        self._free = list(range(capacity - 1, -1, -1))  # 栈顶是最小的空闲ID，刚开局时ID按加入顺序从0分配
+        self._used = []  # 占用的ID
+        self._position = array('i', [-1]) * capacity  # ID在_used中的下标，-1表示空闲
+
+    def __len__(self):
+        return len(self._used)
+
+    def __contains__(self, client_id: int) -> bool:
+        return self._position[client_id] >= 0
+
+    def free_count(self) -> int:
+        return len(self._free)
+
+    def ids(self) -> list:
+        """
+        占用的ID（含等待重连的），返回副本，遍历时可以释放。
+        """
+        return list(self._used)
+
+    def lookup(self, token) -> int:
+        """
+        令牌对应的ID，无效的令牌返回None。
+        """
+        return self._sessions.get(token) if token is not None else None
+
+    def allocate(self, conn=None):
+        """allocate(conn) -> (client_id, token)
+
+        分配一个空闲ID和新令牌，并清零该ID的状态；已满时返回(None, None)。conn可以稍后再填入conns。
+        """
+        if not self._free:
+            return None, None
+        client_id = self._free.pop()
+        token = secrets.token_hex(16)
+        self.conns[client_id] = conn
+        self.tokens[client_id] = token
+        self.names[client_id] = None
+        self.rounds[client_id] = -1
+        self.last_seen[client_id] = time.monotonic()
+        self.heartbeat[client_id] = 0
+        self.waiting[client_id] = 0
+        self.bytes_in[client_id] = self.bytes_out[client_id] = 0
+        self._sessions[token] = client_id
+        self._position[client_id] = len(self._used)
+        self._used.append(client_id)
+        return client_id, token
+
+    def release(self, client_id: int):
+        """release(client_id) -> (conn, token)
+
+        释放ID，返回它原来的连接和令牌（连接由调用方关闭）；ID本来就空闲时返回(None, None)。
+        """
+        position = self._position[client_id]
+        if position < 0:
+            return None, None
+        conn, token = self.conns[client_id], self.tokens[client_id]
+        self.conns[client_id] = None
+        self.tokens[client_id] = None
+        self.names[client_id] = None
+        self._sessions.pop(token, None)
+        last = self._used.pop()
+        if last != client_id:  # 末尾的ID填到空出的位置
+            self._used[position] = last
+            self._position[last] = position
+        self._position[client_id] = -1
+        self._free.append(client_id)
+        return conn, token
+
+    def touch(self, client_id: int, size: int):
+        """
+        收到该玩家的一条消息，size为帧的字节数。
+        """
+        self.last_seen[client_id] = time.monotonic()
+        self.bytes_in[client_id] += size
+
+    def sent(self, client_id: int, size: int):
+        self.bytes_out[client_id] += size
+
+    def submitted(self, client_id: int, round_: int):
+        self.rounds[client_id] = round_
+
+    def client(self, client_id: int) -> dict:
+        return {'id': client_id, 'name': self.names[client_id], 'connected': self.conns[client_id] is not None,
+                'round': self.rounds[client_id], 'idle_seconds': time.monotonic() - self.last_seen[client_id],
+                'heartbeat': bool(self.heartbeat[client_id]), 'waiting': bool(self.waiting[client_id]),
+                'bytes_in': self.bytes_in[client_id], 'bytes_out': self.bytes_out[client_id]}
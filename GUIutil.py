@@ -1,4 +1,8 @@
 import tkinter as tk
+from tkinter import ttk
+from collections import deque
+
+import Statistics
 
 
 class ButtonHover(tk.Button):
@@ -85,6 +89,225 @@ class StatusFrame(tk.Frame):
         pass
 
 
+class ResultChart(tk.Frame):
+    """
+    组件：每轮的G值和所有玩家的输入。
+
+    最近window轮逐点显示；更早的轮次按桶压缩，每桶只画一条最小值到最大值的竖线，桶数超过max_buckets时相邻两桶合并。
+    新一轮的数据追加到已有的图形对象上，坐标轴不变时只用blit重绘这几个对象，横轴在数据超出时翻倍（此时才完整重绘），
+    因此每轮的重绘开销与对局长度无关。
+    """
+
+    def __init__(self, master=None, window: int = 50, max_buckets: int = 100, cnf={}, **kw):
+        super().__init__(master=master, cnf=cnf, **kw)
+        # matplotlib导入较慢，创建图表时才导入
+        import numpy as np
+        from matplotlib.figure import Figure
+        from matplotlib.ticker import MaxNLocator, FuncFormatter
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        self._np = np
+        self._WINDOW = window
+        self._MAX_BUCKETS = max_buckets
+        self._rounds = 0
+        self._recent = deque()  # 最近window轮：(轮次, G值, 到场玩家的输入)
+        self._buckets = []  # 压缩后的旧轮次：[第一轮, G最小值, G最大值, 输入最小值, 输入最大值]
+        self._bucket_size = 1
+        self._x_max = window  # 横轴上限
+        self._background = None
+
+        fig = Figure(figsize=(4, 4), tight_layout=True)  # 不经过pyplot，图表只属于这个画布
+        self.canvas = FigureCanvasTkAgg(fig, master=self)
+        self.canvas.get_tk_widget().grid(row=0, column=0)
+        self.ax = fig.add_subplot()
+        self.ax.set_title('Result')
+        self.ax.set_xlim(-0.5, self._x_max)
+        self.ax.set_ylim(0, 100)
+        self.ax.xaxis.set_major_locator(MaxNLocator(nbins=8, integer=True))  # 刻度数量固定，不再每轮一个
+        self.ax.xaxis.set_major_formatter(FuncFormatter(lambda x, _: 'R%d' % (x + 1)))
+        self.ax.grid()  # 网格线
+        # animated的对象不参与完整重绘，由blit单独绘制
+        self._g_range, = self.ax.plot([], [], '-y', alpha=0.6, animated=True)
+        self._input_range, = self.ax.plot([], [], '-', color='gray', alpha=0.3, animated=True)
+        self._g_line, = self.ax.plot([], [], 'o:y', label='G-num', animated=True)
+        self._input_points, = self.ax.plot([], [], 'x', linestyle='', animated=True)  # 所有玩家共用一个对象
+        self._g_text = self.ax.text(0, 0, '', ha='center', va='bottom', animated=True)
+        self.ax.legend()  # 图例
+        self.canvas.mpl_connect('draw_event', self._on_draw)  # 窗口缩放等引起完整重绘后，重新保存背景
+        self.canvas.draw()
+
+    def add_round(self, g_value: float, inputs: list):
+        """
+        追加一轮结果。inputs中缺席玩家为NaN，不会被画出。
+        """
+        np = self._np
+        round_ = self._rounds
+        self._rounds += 1
+        values = np.asarray(inputs, dtype=float)
+        self._recent.append((round_, g_value, values[values == values]))
+        if len(self._recent) > self._WINDOW:
+            self._compress(*self._recent.popleft())
+        self._update_artists()
+        if self._rounds > self._x_max:  # 横轴放不下了，翻倍后完整重绘
+            self._x_max *= 2
+            self.ax.set_xlim(-0.5, self._x_max)
+            self.canvas.draw()
+        else:
+            self._blit()
+
+    def _compress(self, round_: int, g_value: float, values):
+        low, high = (values.min(), values.max()) if len(values) else (g_value, g_value)
+        last = self._buckets[-1] if self._buckets else None
+        if last is not None and last[0] // self._bucket_size == round_ // self._bucket_size:
+            last[1], last[2] = min(last[1], g_value), max(last[2], g_value)
+            last[3], last[4] = min(last[3], low), max(last[4], high)
+            return
+        self._buckets.append([round_, g_value, g_value, low, high])
+        if len(self._buckets) > self._MAX_BUCKETS:
+            self._bucket_size *= 2
+            merged = []
+            for bucket in self._buckets:
+                if merged and merged[-1][0] // self._bucket_size == bucket[0] // self._bucket_size:
+                    last = merged[-1]
+                    last[1], last[2] = min(last[1], bucket[1]), max(last[2], bucket[2])
+                    last[3], last[4] = min(last[3], bucket[3]), max(last[4], bucket[4])
+                else:
+                    merged.append(bucket)
+            self._buckets = merged
+
+    def _update_artists(self):
+        np = self._np
+        rounds = [round_ for round_, _, _ in self._recent]
+        g_values = [g_value for _, g_value, _ in self._recent]
+        self._g_line.set_data(rounds, g_values)
+        self._input_points.set_data(
+            np.concatenate([np.full(len(values), round_) for round_, _, values in self._recent]),
+            np.concatenate([values for _, _, values in self._recent]))
+        self._g_text.set_position((rounds[-1], g_values[-1] + 0.2))
+        self._g_text.set_text('%.0f' % g_values[-1])
+        if self._buckets:
+            # 每桶一条竖线：(x, 最小值), (x, 最大值), 然后用NaN断开
+            buckets = np.asarray(self._buckets, dtype=float)
+            x = np.repeat(buckets[:, 0] + (self._bucket_size - 1) / 2, 3)
+            for line, low, high in ((self._g_range, 1, 2), (self._input_range, 3, 4)):
+                y = np.empty(len(x))
+                y[0::3], y[1::3], y[2::3] = buckets[:, low], buckets[:, high], np.nan
+                line.set_data(x, y)
+
+    def _animated_artists(self):
+        return self._input_range, self._g_range, self._input_points, self._g_line, self._g_text
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self._animated_artists():
+            self.ax.draw_artist(artist)
+
+    def _blit(self):
+        if self._background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._background)
+        for artist in self._animated_artists():
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+
+
+class ScoreTable(tk.Frame):
+    """
+    组件：虚拟化的分数表。
+
+    Treeview中只有固定的rows行（另有一行置顶显示本机玩家），这些行只插入一次，滚动或分数变化时改写它们的内容，
+    内容没变的行不调用Tk，因此每轮的Tk调用次数与房间人数无关。点击“名次”表头在按ID和按名次排列之间切换，
+    名次由Statistics.Ranking维护，每轮只重新排位分数有变化的玩家，取第k名是O(log N)。
+    """
+
+    def __init__(self, master=None, rows: int = 15, player_id: int = None, cnf={}, **kw):
+        super().__init__(master=master, cnf=cnf, **kw)
+        self._ROWS = rows
+        self._player_id = player_id
+        self._scores = []
+        self._ranking = None  # type: Statistics.Ranking  # 第一次收到分数、知道玩家数量后创建
+        self._first = 0  # 第一个可见行在当前排列中的位置
+        self._by_rank = False
+        self._shown = {}  # 行iid -> 当前显示的values
+
+        self._table = ttk.Treeview(self, show='headings', columns=('ID', 'score', 'rank'), height=rows + 1,
+                                   selectmode='none')
+        for column, text in (('ID', 'ID'), ('score', '分数'), ('rank', '名次')):
+            self._table.column(column, width=60)
+            self._table.heading(column, text=text)
+        self._table.heading('ID', command=lambda: self.sort_by_rank(False))
+        self._table.heading('rank', command=lambda: self.sort_by_rank(True))
+        self._table.tag_configure('me', background='gold')
+        self._iids = [self._table.insert('', 'end', iid='me', tags=('me',))]
+        self._iids += [self._table.insert('', 'end', iid=f'row{i}') for i in range(rows)]
+        self._table.grid(row=0, column=0)
+        self._scrollbar = ttk.Scrollbar(self, orient='vertical', command=self._on_scrollbar)
+        self._scrollbar.grid(row=0, column=1, sticky='ns')
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):  # Windows/macOS和X11的滚轮事件
+            self._table.bind(sequence, self._on_wheel)
+
+    def set_player_id(self, player_id: int):
+        self._player_id = player_id
+        self._refresh()
+
+    def set_scores(self, scores: list):
+        """
+        显示一轮的累计分数。只有分数变化的玩家在Ranking中重新排位。
+        """
+        if self._ranking is None or len(scores) != len(self._scores):
+            self._ranking = Statistics.Ranking(len(scores))
+            self._scores = [0] * len(scores)
+        ranking = self._ranking
+        for id_, (old, new) in enumerate(zip(self._scores, scores)):
+            if old != new:
+                ranking.update(id_, new)
+        self._scores = list(scores)
+        self._refresh()
+
+    def sort_by_rank(self, by_rank: bool = True):
+        self._by_rank = by_rank
+        self._first = 0
+        self._refresh()
+
+    def scroll_to(self, first: int):
+        self._first = first
+        self._refresh()
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * len(self._scores)))
+        else:  # 'scroll'
+            self.scroll_to(self._first + int(value) * (self._ROWS if unit == 'pages' else 1))
+
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self._first - 3)
+        else:
+            self.scroll_to(self._first + 3)
+        return 'break'  # 不让Treeview自己滚动
+
+    def _row(self, id_: int) -> tuple:
+        return id_, self._scores[id_], self._ranking.rank(id_)
+
+    def _refresh(self):
+        n = len(self._scores)
+        visible = min(self._ROWS, n)
+        self._first = max(0, min(self._first, n - visible))
+        if self._by_rank:
+            ids = [self._ranking.kth(self._first + i) for i in range(visible)]
+        else:
+            ids = range(self._first, self._first + visible)
+        rows = [self._row(self._player_id) if self._player_id is not None and self._player_id < n else ('', '', '')]
+        rows += [self._row(id_) for id_ in ids]
+        rows += [('', '', '')] * (self._ROWS - visible)
+        for iid, values in zip(self._iids, rows):
+            if self._shown.get(iid) != values:
+                self._table.item(iid, values=values)
+                self._shown[iid] = values
+        if n:
+            self._scrollbar.set(self._first / n, (self._first + visible) / n)
+
+
 if __name__ == '__main__':
     root = tk.Tk()
     root.title("测试")
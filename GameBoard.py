@@ -5,23 +5,51 @@
 修改日期：  2020年11月29日
 修改内容：  将数据交流拆分到网络层，将GUI拆分到界面层。
 """
+import time
+import queue
 from threading import Thread
 
 import Network
+import Scoring
+import History
+import MatchLog
+import MatchStore
+import Statistics
 
 SERVER_DEFAULT_PORT = 8721
 
 
 class GameBoard:
-    def __init__(self, player_number: int):
+    def __init__(self, player_number: int, server_class=Network.Server, rounds: int = None,
+                 history_path: str = None, input_deadline: float = None, quorum: int = 1, multicast: bool = False,
+                 match_log_path: str = None, heartbeat_timeout: float = Network.HEARTBEAT_TIMEOUT,
+                 store_path: str = None):
+        """
+        server_class: 网络层服务器实现，Network.Server（每个客户端一个线程）或AsyncNetwork.AsyncServer（事件循环）。
+        rounds: 固定进行的轮数；为None时每轮结束后由房主选择是否继续（需要GUI）。
+        history_path: 对局历史文件，旧轮次写入该文件，游戏结束后完整保存；默认写入匿名的临时文件，游戏结束后不保存。
+        input_deadline, quorum: 每轮第一个输入到达后最多再等input_deadline秒，届时至少有quorum个输入就结束本轮，
+                                未提交的玩家本轮缺席（不参与计分）。input_deadline为None时等待所有玩家。
+        multicast: 在局域网内用UDP组播发送每轮结果，见Network.MulticastSender。
+        match_log_path: 对局日志文件，每轮追加一条记录（含各阶段耗时），可以用Replay.py校验或重新计分。
+        heartbeat_timeout: 发送心跳的客户端沉默多少秒后视为已断开并释放它的ID，之后的轮次不再等待它；None表示不检测。
+        store_path: SQLite数据库，每轮的结果和最终排名由后台线程写入，跨对局累计排行榜，见MatchStore。
+        """
         self._PLAYER_NUMBER = player_number  # 玩家数量
-        self.server = Network.Server(self._PLAYER_NUMBER)
+        self._ROUNDS = rounds
+        self.server = server_class(self._PLAYER_NUMBER, input_deadline, quorum, multicast, heartbeat_timeout)
+        self.metrics = self.server.metrics  # 与网络层共用一份指标，GameBoard记录每轮各阶段耗时
         self._server_started = False
         self._server_addr = None
+        self._T_server = None
 
-        self.g_nums = []  # 存储每轮的G_num
-        self.player_scores_all = [[0 for _ in range(player_number)]]  # [round][player_id]二维数组，存储玩家分数
-        self.player_inputs_all = []  # [round][player_id]二维数组，存储玩家每轮输入
+        self.history = History.RoundHistory(player_number, history_path)  # 每轮的G值、玩家输入、玩家分数
+        self.match_log = None if match_log_path is None else MatchLog.MatchLogWriter(match_log_path, player_number)
+        self.stats = Statistics.PlayerStats(player_number)  # 平均输入、最近/最远次数、排名等，每轮增量更新
+        self.store = None if store_path is None else MatchStore.MatchStore(store_path)
+        self._match = None if self.store is None else self.store.begin_match(
+            player_number, {'ratio': Scoring.G_RATIO, 'win_points': player_number, 'lose_points': Scoring.LOSE_POINTS})
+        self._extremes = ([], [])  # 最近一轮离G最近、最远的玩家ID
 
     def get_server_address(self):
         if not self._server_started:
@@ -29,68 +57,83 @@ class GameBoard:
             self._server_started = True
         return self._server_addr
 
-    def start(self):
-        if not self._server_started:
+    def start(self, listen: bool = True):
+        """
+        listen=False时服务器不监听端口，玩家连接由RoomManager通过server.attach_client转交。
+        """
+        if listen and not self._server_started:
             self.get_server_address()
-        T_server = Thread(target=self._start)
-        T_server.setDaemon(True)
-        T_server.start()
+        self._T_server = Thread(target=self._start)
+        self._T_server.setDaemon(True)
+        self._T_server.start()
+
+    def serve_metrics(self, port: int = 0):
+        """serve_metrics(port) -> (host, port)
+
+        在本机端口上以文本格式提供运行指标，port为0时由系统分配。
+        """
+        return self.metrics.serve(port)
+
+    def wait_exit(self):
+        """
+        阻塞至游戏结束。
+        """
+        self._T_server.join()
 
     def _start(self):
         while True:
+            begin = time.perf_counter()
             # 获取输入
             inputs = self._get_player_input()
+            inputs_ready = time.perf_counter()
             # 计算G值
             g_value = self._calculate_g(inputs)
             # 计算成绩
-            scores = self._calculate_scores(inputs)
+            scores = self._calculate_scores(inputs, g_value)
+            round_ = len(self.history)
+            self.history.append(inputs, g_value, scores)
+            computed = time.perf_counter()
+            self.metrics.observe('round_input_wait_seconds', inputs_ready - begin)
+            self.metrics.observe('round_compute_seconds', computed - inputs_ready)
+            self.metrics.inc('rounds')
             # 是否继续游戏
-            play_again = self._get_play_again_choice()
+            play_again = self._get_play_again_choice() if self._ROUNDS is None else len(self.history) < self._ROUNDS
             # 发送结果
             self.server.send_result(g_value, scores, play_again)
+            if self.match_log is not None:  # 结果发出后再写日志，不增加本轮延迟
+                self.match_log.append(round_, inputs, g_value, scores, inputs_ready - begin, computed - inputs_ready)
+            if self.store is not None:  # 只是放入队列
+                self.store.add_round(self._match, round_, g_value, inputs, scores)
+            self.stats.update(inputs, g_value, scores, *self._extremes)
             if not play_again:
                 self.game_exit()
                 break
 
     def game_exit(self):
-        import time
         time.sleep(5)
+        if self.store is not None:  # 玩家名字要在断开连接之前取
+            names = self.server.player_names()
+            self.store.finish_match(self._match, [dict(self.stats.player(id_), name=names[id_])
+                                                  for id_ in range(self._PLAYER_NUMBER)])
         self.server.server_exit()
-        # todo: 保存self.g_nums self.player_scores_all self.player_inputs_all
+        self.history.close()
+        if self.match_log is not None:
+            self.match_log.close()
+        if self.store is not None:
+            self.store.close()  # 等待写入线程提交完
+        self.metrics.close()
 
     def _get_player_input(self) -> list:
-        inputs = self.server.get_player_inputs()
-        self.player_inputs_all.append(inputs)
-        return inputs
-
-    def _calculate_g(self, inputs: list) -> float:
-        g = sum(inputs) / len(inputs) * 0.618
-        self.g_nums.append(g)
-        return g
-
-    def _calculate_scores(self, inputs: list) -> list:
-        # 计算绝对值阶段
-        t_inputs = dict(zip(range(self._PLAYER_NUMBER), inputs))
-        g_value = self.g_nums[-1]
-        for id_, input_ in t_inputs.items():
-            t_inputs[id_] = abs(input_ - g_value)  # 用户输入与G值的绝对值
-        t_inputs = sorted(t_inputs.items(), key=lambda x: x[1], reverse=False)  # 升序排序，返回[(id,abs),]
-        # 计分阶段
-        t_scores = dict(zip(range(self._PLAYER_NUMBER), self.player_scores_all[-1]))
-        id_, input_ = t_inputs[0]  # 这里的input_其实是绝对值
-        for player in t_inputs:  # player (id,abs)， 遍历查找是否有相同绝对值
-            if input_ != player[1]:
-                break
-            t_scores[player[0]] += self._PLAYER_NUMBER  # 加N分
-        id_, input_ = t_inputs[-1]
-        for player in t_inputs[::-1]:  # 逆序找绝对值最大的
-            if input_ != player[1]:
-                break
-            t_scores[player[0]] += -2  # 加-2分
-        # append
-        t_scores = list(t_scores.values())  # dict转list
-        self.player_scores_all.append(t_scores)
-        return t_scores
+        return self.server.get_player_inputs()
+
+    @staticmethod
+    def _calculate_g(inputs: list) -> float:
+        return Scoring.calculate_g(inputs)
+
+    def _calculate_scores(self, inputs: list, g_value: float) -> list:
+        # 找出离G最近、最远的玩家（含并列），最近的加N分，最远的加-2分；缺席玩家分数不变
+        closest, farthest = self._extremes = Scoring.find_extremes(inputs, g_value)
+        return Scoring.apply_points(self.history.last_scores(), closest, farthest, self._PLAYER_NUMBER)
 
     @staticmethod
     def _get_play_again_choice() -> bool:
@@ -100,17 +143,19 @@ class GameBoard:
 
 
 class Player:
-    def __init__(self):
+    def __init__(self, history_path: str = None):
         self.player_id = None  # int
         self.client = Network.Client()  # 客户端
 
-        self.g_nums = []  # 存储每轮的G_num
-        self.player_scores_all = []  # [round][player_id]二维数组，存储玩家分数
-        self.player_inputs_all = []  # [round][player_id]二维数组，存储玩家每轮输入
+        self._history_path = history_path  # 默认写入匿名的临时文件，不保存
+        self.history = None  # type: History.RoundHistory  # 收到第一轮结果、知道玩家数量后创建
+        self.last_g = None
         self.play_again = True
+        self.results = queue.Queue()  # 每收到一轮结果放入该轮的g_value，界面线程取出后再读取历史
+        self.client.subscribe(self._on_result)
 
-    def connect(self, server_ip: str, server_port: int):
-        self.client.connect(server_ip, server_port)
+    def connect(self, server_ip: str, server_port: int, room=None):
+        self.client.connect(server_ip, server_port, room)
 
     def send_input(self, value: float):
         self.client.send_input(value)
@@ -122,29 +167,41 @@ class Player:
 
     def get_round_result(self):
         """
-        g_value = -1表示出现了异常
+        阻塞至收到下一轮结果，返回g_value，g_value = -1表示出现了异常。界面不应调用本函数，而是每帧检查results。
         """
-        player_inputs, g_value, scores, play_again = self.client.get_round_result()
-        self.player_inputs_all.append(player_inputs)
-        self.g_nums.append(g_value)
-        self.player_scores_all.append(scores)
+        return self.results.get()
+
+    def _on_result(self, player_inputs, g_value, scores, play_again):
+        """
+        在网络层的接收线程中调用：先记入历史，再通知界面。
+        """
+        self.last_g = g_value
         self.play_again = play_again
+        if g_value != -1:  # g_value = -1时本轮结果作废，不记入历史
+            if self.history is None:
+                self.history = History.RoundHistory(len(player_inputs), self._history_path)
+            self.history.append(player_inputs, g_value, scores)
+            if not play_again:
+                self.history.close()
+        self.results.put(g_value)
 
     def get_last_score(self):
-        return self.player_scores_all[-1]
+        return self.history.last_scores() if self.history is not None else []
+
+    def get_last_g(self):
+        return self.last_g
 
     def get_input(self):
-        return self.player_inputs_all
+        return self.history.inputs_rows() if self.history is not None else []
 
     def get_g(self):
-        return self.g_nums
+        return self.history.g_values() if self.history is not None else []
 
     def is_play_again(self):
         return self.play_again
 
 
 if __name__ == '__main__':
-    import time
     while True:
         print('不能从这里运行。')
         time.sleep(1)
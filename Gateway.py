@@ -0,0 +1,273 @@
+"""
+文件名：    Gateway.py
+功  能：    跨进程的分层聚合。一个逻辑房间的玩家分布在多个网关进程中，每个网关只接收自己分片玩家的连接和输入，
+            由协调者汇总出G值和全房间的最近/最远者，房间的规模不再受限于一个进程能接收多少连接。
+
+运行方式：python Gateway.py coordinator --gateways 4 --rounds 10 --port 8720
+          python Gateway.py gateway 192.168.1.2:8720 --players 25000 --port 8721 --engine asyncio
+"""
+import time
+import socket
+import argparse
+from array import array
+from threading import Thread
+
+import Network
+import Scoring
+import Metrics
+import GameBoard
+from Network import CMD
+
+COORDINATOR_DEFAULT_PORT = 8720
+
+
+def _open_link(link: socket.socket):
+    """
+    网关与协调者之间每轮只往返两次几十字节的小消息，关闭Nagle算法，否则每次都要等对方的延迟确认。
+    """
+    link.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def _recv_expected(link: socket.socket, protocol, round_: int = None) -> dict:
+    """
+    接收一条消息并检查类型和轮次，双方不同步时抛出ValueError。
+    """
+    msg = Network._recv_data(link)
+    if msg['CMD'] != protocol or (round_ is not None and msg['DATA']['ROUND'] != round_):
+        raise ValueError(f'Expected message {protocol} of round {round_}, got {msg["CMD"]}.')
+    return msg['DATA']
+
+
+class Coordinator:
+    """
+    房间的协调者，不接收玩家连接，只和各网关通信。G值只需要输入之和与人数，计分只需要|x-G|的最小、最大值，
+    所以每轮分两个阶段：
+
+    1. 各网关收齐本分片的输入后发来G_PARTIAL(输入之和, 到场人数)，协调者按网关顺序相加求出G值，用G_VALUE广播；
+    2. 各网关用G值找出本分片的最近/最远者，只发来G_EXTREMES(最小距离, 最大距离)；协调者求出全房间的最小、最大距离，
+       用G_OUTCOME告诉每个网关它的最近者/最远者是否入选。并列的ID留在网关里，不经过协调者。
+
+    协调者每轮收发的字节数只与网关数量有关，与玩家数量无关。
+
+    只有一个网关时G值与GameBoard逐位一致；多个网关时各分片的和再相加，与整个房间按顺序累加可能在末位不同。
+    """
+
+    def __init__(self, gateway_number: int, rounds: int, ratio: float = Scoring.G_RATIO, win_points: int = None,
+                 lose_points: int = Scoring.LOSE_POINTS):
+        """
+        win_points: 离G最近的玩家得分，默认为整个房间的玩家数量。
+        """
+        self._GATEWAY_NUMBER = gateway_number
+        self._ROUNDS = rounds
+        self._ratio, self._win_points, self._lose_points = ratio, win_points, lose_points
+        self.player_number = 0  # 所有网关到齐后确定
+        self.g_values = array('d')  # 每轮的G值
+        self.metrics = Metrics.Registry()
+        self.server_socket = None
+        self._gateways = []  # 按加入顺序排列的网关连接，也是分片在全局ID中的顺序
+        self._T_coordinate = None
+
+    def listen(self, target_port: int, ip_: str = '0.0.0.0', fallback: bool = False):
+        """listen(target_port, ip_='0.0.0.0', fallback=False) -> (ip, port)
+        """
+        self.server_socket = Network.bind_socket(ip_, target_port, fallback)
+        self.server_socket.listen(self._GATEWAY_NUMBER)
+        print(f'S-INFO: coordinator start listen {ip_}:{self.server_socket.getsockname()[1]}')
+        return self.server_socket.getsockname()
+
+    def start(self):
+        self._T_coordinate = Thread(target=self._run)
+        self._T_coordinate.setDaemon(True)
+        self._T_coordinate.start()
+
+    def wait_exit(self):
+        """
+        阻塞至游戏结束。
+        """
+        self._T_coordinate.join()
+
+    def close(self):
+        for gateway in self._gateways:
+            Network._close_now(gateway)
+        self._gateways = []
+        if self.server_socket is not None:
+            self.server_socket.close()
+            self.server_socket = None
+        self.metrics.close()
+
+    def _run(self):
+        try:
+            self._accept_gateways()
+            for round_ in range(self._ROUNDS):
+                self._play_round(round_, round_ + 1 < self._ROUNDS)
+        except (OSError, ValueError, KeyError) as e:  # 任何一个网关断开，整局游戏都无法继续
+            print(f'S-EXCEPTION: Lost a gateway, the game is aborted: {e!r}')
+        finally:
+            self.close()
+
+    def _accept_gateways(self):
+        sizes = []
+        while len(self._gateways) < self._GATEWAY_NUMBER:
+            gateway, addr = self.server_socket.accept()
+            _open_link(gateway)
+            sizes.append(_recv_expected(gateway, CMD.G_HELLO)['PLAYERS'])
+            self._gateways.append(gateway)
+            print(f'S-INFO: gateway {addr} joined with {sizes[-1]} players')
+        self.server_socket.close()
+        self.server_socket = None
+        self.player_number = sum(sizes)
+        win_points = self.player_number if self._win_points is None else self._win_points
+        offset = 0
+        for gateway, size in zip(self._gateways, sizes):
+            Network._send_data(gateway, CMD.G_WELCOME, OFFSET=offset, PLAYERS=self.player_number, RATIO=self._ratio,
+                               WIN=win_points, LOSE=self._lose_points)
+            offset += size
+        print(f'S-INFO: room of {self.player_number} players on {self._GATEWAY_NUMBER} gateways')
+
+    def _play_round(self, round_: int, play_again: bool):
+        begin = time.perf_counter()
+        # 阶段1：汇总输入之和与人数，广播G值
+        total, count = 0.0, 0
+        for gateway in self._gateways:
+            partial = _recv_expected(gateway, CMD.G_PARTIAL, round_)
+            total += partial['SUM']
+            count += partial['COUNT']
+        collected = time.perf_counter()
+        if not count:
+            raise ValueError(f'No player submitted an input in round {round_}.')
+        g_value = total / count * self._ratio
+        for gateway in self._gateways:
+            Network._send_data(gateway, CMD.G_VALUE, ROUND=round_, G=g_value)
+        # 阶段2：汇总各分片的最小、最大距离，告诉每个网关它的最近者/最远者是否入选
+        extremes = [_recv_expected(gateway, CMD.G_EXTREMES, round_) for gateway in self._gateways]
+        min_d = min(msg['MIN'] for msg in extremes if msg['MIN'] is not None)
+        max_d = max(msg['MAX'] for msg in extremes if msg['MAX'] is not None)
+        for gateway, msg in zip(self._gateways, extremes):
+            Network._send_data(gateway, CMD.G_OUTCOME, ROUND=round_, CLOSEST=msg['MIN'] == min_d,
+                               FARTHEST=msg['MAX'] == max_d, AGAIN=play_again)
+        self.g_values.append(g_value)
+        self.metrics.observe('round_input_wait_seconds', collected - begin)  # 等待最慢的分片收齐输入
+        self.metrics.observe('round_aggregate_seconds', time.perf_counter() - collected)
+        self.metrics.inc('rounds')
+
+
+class GatewayBoard(GameBoard.GameBoard):
+    """
+    网关进程中的GameBoard：照常接收本分片玩家的连接和输入、发送结果，只是G值和计分交给协调者汇总。
+
+    本分片的玩家ID从0开始，在整个房间中的ID为offset + 玩家ID。玩家收到的输入和分数只含本分片，G值和得分规则是全房间的。
+    游戏的轮数由协调者决定。输入截止时间和法定人数按分片计算，每个分片每轮至少要收到一个输入才能结束本轮。
+    """
+
+    def __init__(self, coordinator_addr: tuple, player_number: int, server_class=Network.Server,
+                 history_path: str = None, input_deadline: float = None, quorum: int = 1, multicast: bool = False):
+        """
+        coordinator_addr: 协调者的(ip, port)。其余参数见GameBoard。
+        """
+        super().__init__(player_number, server_class, history_path=history_path, input_deadline=input_deadline,
+                         quorum=quorum, multicast=multicast)
+        self._link = socket.create_connection(coordinator_addr)
+        _open_link(self._link)
+        Network._send_data(self._link, CMD.G_HELLO, PLAYERS=player_number)
+        self.offset = None  # 以下在所有网关到齐、收到G_WELCOME后确定
+        self.room_player_number = None
+        self._ratio = self._win_points = self._lose_points = None
+        self._round = 0
+        self._play_again = True
+
+    def _welcome(self):
+        welcome = _recv_expected(self._link, CMD.G_WELCOME)
+        self.offset, self.room_player_number = welcome['OFFSET'], welcome['PLAYERS']
+        self._ratio, self._win_points, self._lose_points = welcome['RATIO'], welcome['WIN'], welcome['LOSE']
+        print(f'S-INFO: gateway owns players {self.offset}..{self.offset + self._PLAYER_NUMBER - 1} '
+              f'of {self.room_player_number}')
+
+    def _start(self):
+        try:
+            super()._start()
+        except (OSError, ValueError, KeyError) as e:
+            print(f'S-EXCEPTION: Lost the coordinator, the game is aborted: {e!r}')
+            self.server.server_exit()
+            self.history.close()
+            self._link.close()
+
+    def game_exit(self):
+        self._link.close()
+        super().game_exit()
+
+    def _calculate_g(self, inputs: list) -> float:
+        if self.offset is None:  # 第一轮的输入收齐时，其他网关也都已经加入
+            self._welcome()
+        present = [x for x in inputs if x == x]
+        Network._send_data(self._link, CMD.G_PARTIAL, ROUND=self._round,
+                           SUM=Scoring._sequential_sum(present), COUNT=len(present))  # 与calculate_g的累加顺序相同
+        return _recv_expected(self._link, CMD.G_VALUE, self._round)['G']
+
+    def _calculate_scores(self, inputs: list, g_value: float) -> list:
+        if any(x == x for x in inputs):
+            closest, farthest = Scoring.find_extremes(inputs, g_value)
+            min_d, max_d = abs(inputs[closest[0]] - g_value), abs(inputs[farthest[0]] - g_value)
+        else:  # 本分片的玩家全部缺席
+            closest, farthest, min_d, max_d = [], [], None, None
+        Network._send_data(self._link, CMD.G_EXTREMES, ROUND=self._round, MIN=min_d, MAX=max_d)
+        outcome = _recv_expected(self._link, CMD.G_OUTCOME, self._round)
+        self._round += 1
+        self._play_again = outcome['AGAIN']
+        self._extremes = (closest if outcome['CLOSEST'] else [], farthest if outcome['FARTHEST'] else [])
+        return Scoring.apply_points(self.history.last_scores(), *self._extremes, self._win_points, self._lose_points)
+
+    def _get_play_again_choice(self) -> bool:
+        return self._play_again
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='跨进程的大房间：一个协调者和多个网关')
+    roles = parser.add_subparsers(dest='role', required=True)
+    coordinator_parser = roles.add_parser('coordinator', help='汇总各网关的G值和计分')
+    coordinator_parser.add_argument('--gateways', type=int, required=True, help='网关数量')
+    coordinator_parser.add_argument('--rounds', type=int, required=True, help='固定进行的轮数')
+    coordinator_parser.add_argument('--host', default='0.0.0.0')
+    coordinator_parser.add_argument('--port', type=int, default=COORDINATOR_DEFAULT_PORT)
+    coordinator_parser.add_argument('--metrics-port', type=int, default=None)
+    gateway_parser = roles.add_parser('gateway', help='接收一个分片的玩家')
+    gateway_parser.add_argument('coordinator', help='协调者地址，ip:port')
+    gateway_parser.add_argument('--players', type=int, required=True, help='本网关负责的玩家数量')
+    gateway_parser.add_argument('--host', default='0.0.0.0')
+    gateway_parser.add_argument('--port', type=int, default=Network.SERVER_DEFAULT_PORT)
+    gateway_parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread')
+    gateway_parser.add_argument('--deadline', type=float, default=None, help='每轮输入截止时间（秒）')
+    gateway_parser.add_argument('--quorum', type=int, default=1, help='截止时本分片至少需要的输入数')
+    gateway_parser.add_argument('--multicast', action='store_true')
+    gateway_parser.add_argument('--history', default=None)
+    gateway_parser.add_argument('--metrics-port', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.role == 'coordinator':
+        coordinator = Coordinator(args.gateways, args.rounds)
+        ip_, port_ = coordinator.listen(args.port, args.host)
+        if args.metrics_port is not None:
+            coordinator.metrics.serve(args.metrics_port)
+        coordinator.start()
+        print(f'S-INFO: ready on {ip_}:{port_}', flush=True)
+        try:
+            coordinator.wait_exit()
+        except KeyboardInterrupt:
+            coordinator.close()
+    else:
+        if args.engine == 'asyncio':
+            import AsyncNetwork
+            server_class = AsyncNetwork.AsyncServer
+        else:
+            server_class = Network.Server
+        coordinator_ip, _, coordinator_port = args.coordinator.rpartition(':')
+        board = GatewayBoard((coordinator_ip, int(coordinator_port)), args.players, server_class, args.history,
+                             args.deadline, args.quorum, args.multicast)
+        ip_, port_ = board.server.listen(args.port, args.host, fallback=False)
+        if args.metrics_port is not None:
+            board.serve_metrics(args.metrics_port)
+        board.start(listen=False)
+        print(f'S-INFO: ready on {ip_}:{port_}', flush=True)
+        try:
+            board.wait_exit()
+        except KeyboardInterrupt:
+            board.server.server_exit()
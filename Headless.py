@@ -0,0 +1,49 @@
+"""
+文件名：    Headless.py
+功  能：    无界面服务器入口。只导入GameBoard和网络层，不导入tkinter/matplotlib，不查询局域网IP，不逐个探测端口。
+
+运行方式：python Headless.py 4 --rounds 10 --port 0
+"""
+import time
+import argparse
+
+import Network
+import GameBoard
+
+if __name__ == '__main__':
+    begin = time.perf_counter()
+    parser = argparse.ArgumentParser(description='无界面服务器：python Headless.py 玩家数量 --rounds 轮数')
+    parser.add_argument('players', type=int, help='玩家数量')
+    parser.add_argument('--rounds', type=int, required=True, help='固定进行的轮数（没有房主可以选择是否继续）')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址，默认所有网卡')
+    parser.add_argument('--port', type=int, default=Network.SERVER_DEFAULT_PORT, help='监听端口，0表示由系统分配')
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--deadline', type=float, default=None, help='每轮输入截止时间（秒），默认等待所有玩家')
+    parser.add_argument('--quorum', type=int, default=1, help='截止时至少需要的输入数')
+    parser.add_argument('--heartbeat-timeout', type=float, default=Network.HEARTBEAT_TIMEOUT,
+                        help='客户端沉默多少秒后视为已断开（只对发送心跳的客户端有效），0表示不检测')
+    parser.add_argument('--multicast', action='store_true', help='在局域网内用UDP组播发送每轮结果')
+    parser.add_argument('--history', default=None, help='对局历史文件，默认不保存')
+    parser.add_argument('--match-log', default=None, help='对局日志文件，可以用Replay.py回放')
+    parser.add_argument('--store', default=None, help='SQLite数据库，保存每轮结果和跨对局的排行榜，见MatchStore.py')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在本机该端口提供文本指标，0表示由系统分配')
+    args = parser.parse_args()
+
+    if args.engine == 'asyncio':
+        import AsyncNetwork
+        server_class = AsyncNetwork.AsyncServer
+    else:
+        server_class = Network.Server
+    board = GameBoard.GameBoard(args.players, server_class, rounds=args.rounds, history_path=args.history,
+                                input_deadline=args.deadline, quorum=args.quorum, multicast=args.multicast,
+                                match_log_path=args.match_log, heartbeat_timeout=args.heartbeat_timeout or None,
+                                store_path=args.store)
+    ip_, port_ = board.server.listen(args.port, args.host, fallback=False)  # 端口被占用时直接报错，不悄悄换端口
+    if args.metrics_port is not None:
+        board.serve_metrics(args.metrics_port)
+    board.start(listen=False)
+    print(f'S-INFO: ready on {ip_}:{port_} in {(time.perf_counter() - begin) * 1e3:.1f}ms', flush=True)
+    try:
+        board.wait_exit()
+    except KeyboardInterrupt:
+        board.server.server_exit()
@@ -0,0 +1,164 @@
+"""
+文件名：    History.py
+功  能：    对局历史的列式存储。GameBoard和Player共用。
+"""
+import os
+import mmap
+import struct
+import tempfile
+from array import array
+from threading import Lock
+
+_FILE_HEADER = struct.Struct('<4sHI')  # 魔数, 版本, 玩家数量N
+_FILE_MAGIC = b'RHST'
+_FILE_VERSION = 1
+
+
+class RoundHistory:
+    """
+    每轮一行，G值、所有玩家的输入、所有玩家的分数各占一列，存放在连续的array中（float64/float64/int32），
+    不再为每个数字创建Python对象。
+
+    内存中超过memory_rounds的旧轮次会批量写入只追加的文件，读取时通过mmap访问，因此长时间的对局常驻内存不变。
+    指定path时程序退出后完整历史仍保存在文件中，可以用RoundHistory.open(path)读回；
+    不指定path时写入匿名的临时文件，随对象一起删除（进程异常退出时由操作系统删除），不会留在磁盘上。
+
+    网络线程追加、界面线程读取可以同时进行：写入文件会删除内存中的旧轮次并重新映射，所以读写都在锁内完成。
+    """
+
+    def __init__(self, player_number: int, path: str = None, memory_rounds: int = 1024):
+        self._PLAYER_NUMBER = player_number
+        self._MEMORY_ROUNDS = memory_rounds
+        self._record = struct.Struct(f'<d{player_number}d{player_number}i')  # 文件中每轮的记录
+        self._g = array('d')
+        self._inputs = array('d')  # 展平的[round][player_id]
+        self._scores = array('i')
+        self._spilled = 0  # 已写入文件的轮数，这些轮次不在内存中
+        self._path = path
+        self._file = None
+        self._mmap = None
+        self._LOCK = Lock()
+        self._file = open(path, 'wb') if path is not None else tempfile.TemporaryFile()
+        self._file.write(_FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, player_number))
+
+    @classmethod
+    def open(cls, path: str) -> 'RoundHistory':
+        """
+        只读地打开一个已保存的历史文件。
+        """
+        with open(path, 'rb') as f:
+            magic, version, player_number = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+            raise ValueError(f'{path} is not a round history file.')
+        history = cls(player_number)
+        history._file.close()  # 只读，不需要自己的临时文件
+        history._file = None
+        history._path = path
+        history._spilled = (os.path.getsize(path) - _FILE_HEADER.size) // history._record.size
+        return history
+
+    def __len__(self):
+        with self._LOCK:
+            return self._spilled + len(self._g)
+
+    def append(self, inputs: list, g_value: float, scores: list):
+        with self._LOCK:
+            self._g.append(g_value)
+            self._inputs.extend(inputs)
+            self._scores.extend(scores)
+            if self._file is not None and len(self._g) >= 2 * self._MEMORY_ROUNDS:
+                self._spill(len(self._g) - self._MEMORY_ROUNDS)
+
+    def _spill(self, rounds: int):
+        """
+        把内存中最旧的rounds轮写入文件。
+        """
+        n = self._PLAYER_NUMBER
+        chunk = bytearray(self._record.size * rounds)
+        for row in range(rounds):
+            self._record.pack_into(chunk, row * self._record.size, self._g[row],
+                                   *self._inputs[row * n:(row + 1) * n], *self._scores[row * n:(row + 1) * n])
+        self._file.write(chunk)
+        self._file.flush()
+        del self._g[:rounds]
+        del self._inputs[:rounds * n]
+        del self._scores[:rounds * n]
+        self._spilled += rounds
+        if self._mmap is not None:  # 文件变长了，下次读取时重新映射
+            self._mmap.close()
+            self._mmap = None
+
+    def _read_spilled(self, round_: int) -> tuple:
+        if self._mmap is None:
+            if self._path is None:  # 匿名临时文件只能通过已打开的文件对象访问
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                with open(self._path, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._record.unpack_from(self._mmap, _FILE_HEADER.size + round_ * self._record.size)
+
+    def _row(self, round_: int) -> tuple:
+        """
+        _row(round_) -> (g_value, inputs, scores)，调用者持有锁。
+        """
+        length = self._spilled + len(self._g)
+        if round_ < 0:
+            round_ += length
+        if not 0 <= round_ < length:
+            raise IndexError('round out of range')
+        n = self._PLAYER_NUMBER
+        if round_ < self._spilled:
+            record = self._read_spilled(round_)
+            return record[0], list(record[1:n + 1]), list(record[n + 1:])
+        row = round_ - self._spilled
+        return self._g[row], self._inputs[row * n:(row + 1) * n].tolist(), self._scores[row * n:(row + 1) * n].tolist()
+
+    def g(self, round_: int) -> float:
+        with self._LOCK:
+            return self._row(round_)[0]
+
+    def inputs(self, round_: int) -> list:
+        with self._LOCK:
+            return self._row(round_)[1]
+
+    def scores(self, round_: int) -> list:
+        with self._LOCK:
+            return self._row(round_)[2]
+
+    def last_scores(self) -> list:
+        """
+        最近一轮的分数表，还没有任何一轮时所有人都是0分。
+        """
+        with self._LOCK:
+            return self._row(-1)[2] if self._spilled or self._g else [0] * self._PLAYER_NUMBER
+
+    def g_values(self, start: int = 0, stop: int = None) -> list:
+        with self._LOCK:
+            length = self._spilled + len(self._g)
+            stop = length if stop is None else min(stop, length)
+            begin = max(start, self._spilled)
+            values = [self._read_spilled(round_)[0] for round_ in range(start, min(stop, self._spilled))]
+            return values + self._g[begin - self._spilled:max(stop - self._spilled, 0)].tolist()
+
+    def inputs_rows(self, start: int = 0, stop: int = None) -> list:
+        """
+        [round][player_id]二维列表，与原player_inputs_all格式相同。
+        """
+        with self._LOCK:
+            length = self._spilled + len(self._g)
+            stop = length if stop is None else min(stop, length)
+            return [self._row(round_)[1] for round_ in range(start, stop)]
+
+    def close(self):
+        """
+        把内存中剩余的轮次全部写入文件。之后仍然可以读取。匿名的临时文件关闭后就删除了，所以不关闭。
+        """
+        with self._LOCK:
+            if self._file is not None and self._path is not None:
+                if self._g:
+                    self._spill(len(self._g))
+                self._file.close()
+                self._file = None
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
@@ -1,10 +1,11 @@
+import queue
 import tkinter as tk
 import GUIutil as tk2
-from tkinter import messagebox, ttk
-import matplotlib.pyplot as plt
-from threading import Thread, Event
+from tkinter import messagebox
 import GameBoard
 
+_FRAME_MS = 16  # 界面每帧检查一次有没有新的结果
+
 
 class Interface:
     def __init__(self):
@@ -13,7 +14,6 @@ class Interface:
         self._server_addr = None
         self.game_round = 0
 
-        self._RECV_RESULT_FINISHED = Event()
         # GUI布局
         self.root = tk.Tk()
         self.start_frame = None
@@ -36,11 +36,14 @@ class Interface:
         """
         初始化客户端。
         """
+        room = None
         if self._server_addr is None:  # 说明不是房主模式，房主模式在初始化服务器时已获得服务器地址
-            addr_ = self.input_frame.get().split(':')
+            addr_, _, room = self.input_frame.get().partition('/')  # ip:port 或 ip:port/房间ID
+            addr_ = addr_.split(':')
             self._server_addr = (addr_[0], int(addr_[1]))
+            room = room or None
         try:
-            self.player.connect(self._server_addr[0], self._server_addr[1])
+            self.player.connect(self._server_addr[0], self._server_addr[1], room)
         except (ConnectionRefusedError, TimeoutError):
             # todo: messagebox
             messagebox.showerror(title='ConnectionRefusedError', message='Can not connect to server, check again.')
@@ -70,7 +73,7 @@ class Interface:
         else:
             self.root.title("客户端")
             # todo:针对网址的restrict_没有写
-            self.input_frame = tk2.InputFrame(self.root, hint_="请输入房主的地址", type_=str,
+            self.input_frame = tk2.InputFrame(self.root, hint_="请输入房主的地址(ip:port[/房间])", type_=str,
                                               button_handler=self._join_game)
         self.input_frame.grid()
 
@@ -86,79 +89,58 @@ class Interface:
         # 0,1 游戏状态提示
         self._net_state = tk.StringVar(value='---欢迎加入游戏---')
         tk.Label(self.game_frame, textvariable=self._net_state,  font=("微软雅黑", 20, "bold")).grid(row=0, column=1)
-        # 1,0 显示成绩表
-        self._score_table = ttk.Treeview(self.game_frame, show='headings', columns=("ID", "score"))
-        self._score_table.column("ID", width=75)  # 设置列
-        self._score_table.column("score", width=75)
-        self._score_table.heading("ID", text="ID")  # 设置显示的表头名
-        self._score_table.heading("score", text="分数")
+        # 1,0 显示成绩表，只渲染可见的几行和自己的一行
+        self._score_table = tk2.ScoreTable(self.game_frame, player_id=player_id)
         self._score_table.grid(row=1, column=0)
-        # 1,1 matplotlib可视化结果
-        fig = plt.figure(figsize=(4, 4), tight_layout=True)
-        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-        self.canvas = FigureCanvasTkAgg(fig, master=self.game_frame)
-        self.canvas.get_tk_widget().grid(row=1, column=1)
-        self.ax = fig.add_subplot()
-        self.ax.set_title('Result')
-        self.ax.plot([], 'o:y', label='G-num')  # 用于生成第一次图例
-        self.ax.set_xticks((0,))
-        self.ax.set_xticklabels(('R1',))
-        self.ax.legend()  # 图例
-        self.ax.grid()  # 网格线
-        self.canvas.draw()
-        plt.close()
+        # 1,1 matplotlib可视化结果，每轮增量更新
+        self.chart = tk2.ResultChart(self.game_frame)
+        self.chart.grid(row=1, column=1)
 
         self.game_frame.grid()
+        self.root.after(_FRAME_MS, self._recv_result_main)
         self.root.mainloop()
 
     def _send_input(self):
         player_input = self.input_frame.get()
         self.player.send_input(player_input)
         self._net_state.set('---正在等待服务器返回结果---')
-        T_result = Thread(target=self._recv_result_thread)
-        T_result.setDaemon(True)
-        T_result.start()
-        self.root.after(2000, self._recv_result_main)
 
     def _recv_result_main(self):
-        if self._RECV_RESULT_FINISHED.is_set():
-            self._RECV_RESULT_FINISHED.clear()
-            self.game_round += 1
-            # 1.判定g是否非负. _g_value = -1 时表示抛弃本轮结果，异常退出游戏
-            g_value = self.player.get_g()[-1]
-            if g_value == -1:
-                messagebox.showinfo(title="游戏发生异常", message="由于服务器异常退出，程序将在确认后退出。")
-                self.root.after(3000, self.root.destroy)
-                return
-            # 3.利用score更新分数表
-            for _ in self._score_table.get_children():
-                self._score_table.delete(_)
-            for id_, score_ in zip(range(len(self.player.get_last_score())), self.player.get_last_score()):
-                self._score_table.insert('', 'end', values=(id_, score_))
-            # 4.利用g inputs更新分数表
-            for _ in self.ax.get_lines():
-                _.remove()
-            self.ax.plot(self.player.get_g(), 'o:y', label='G-num')
-            self.ax.plot(self.player.get_input(), 'x', linestyle='')
-            self.ax.text(self.game_round-1, g_value + 0.2, '%.0f' % g_value, ha='center', va='bottom')
-            self.ax.set_xticks(list(range(self.game_round+1)))
-            self.ax.set_xticklabels(['R%d' % (1 + _) for _ in range(self.game_round+1)])
-            self.canvas.draw()
-            # 2.判定play_again. False时表示显示本轮结果，正常退出游戏
-            if not self.player.is_play_again():
-                messagebox.showinfo(title="游戏结束", message="游戏结束了，程序将在确认后退出。")
-                self.root.after(3000, self.root.destroy)
-                return
-
-            self._net_state.set(f'---第 {self.game_round} 轮结果如下---')
-            self.input_frame.set_disable(False)
-        else:
-            print('C-DEBUG: def _recv_result_main: result is not ready.')
-            self.root.after(2000, self._recv_result_main)
-
-    def _recv_result_thread(self):
-        self.player.get_round_result()  # 阻塞至成功获取本轮结果
-        self._RECV_RESULT_FINISHED.set()
+        """
+        每帧取出Player收到的所有新结果并显示，结果到达后最多一帧就能显示，不需要为每轮开线程等待。
+        """
+        try:
+            while True:
+                g_value = self.player.results.get_nowait()
+                if not self._show_result(g_value):  # 游戏结束，不再检查
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(_FRAME_MS, self._recv_result_main)
+
+    def _show_result(self, g_value: float) -> bool:
+        """
+        显示一轮结果，游戏结束时返回False。
+        """
+        self.game_round += 1
+        # 1.判定g是否非负. _g_value = -1 时表示抛弃本轮结果，异常退出游戏
+        if g_value == -1:
+            messagebox.showinfo(title="游戏发生异常", message="由于服务器异常退出，程序将在确认后退出。")
+            self.root.after(3000, self.root.destroy)
+            return False
+        # 3.利用score更新分数表。只改写可见行中内容有变化的单元格
+        self._score_table.set_scores(self.player.history.scores(self.game_round - 1))
+        # 4.把本轮的g和inputs追加到图表。界面卡顿时队列里可能积压了几轮，按轮次读取而不是读最新一轮
+        self.chart.add_round(g_value, self.player.history.inputs(self.game_round - 1))
+        # 2.判定play_again. False时表示显示本轮结果，正常退出游戏
+        if not self.player.is_play_again():
+            messagebox.showinfo(title="游戏结束", message="游戏结束了，程序将在确认后退出。")
+            self.root.after(3000, self.root.destroy)
+            return False
+
+        self._net_state.set(f'---第 {self.game_round} 轮结果如下---')
+        self.input_frame.set_disable(False)
+        return True
 
     def launch(self):
         self.root.mainloop()
@@ -0,0 +1,172 @@
+"""
+文件名：    LoadTest.py
+功  能：    无界面压力测试。启动GameBoard服务器和N个脚本bot，统计每轮延迟和各阶段耗时，结果写入json文件。
+
+运行方式：python LoadTest.py --players 200 --rounds 50 --processes 4 --output results/loadtest.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import contextlib
+from threading import Thread, Barrier
+from multiprocessing import Pool
+
+import Network
+import GameBoard
+
+STRATEGIES = {
+    'uniform': lambda rng, last_g: rng.uniform(0.01, 99.99),  # 随机乱猜
+    'half': lambda rng, last_g: 50.0,  # 总是猜中间
+    'follow': lambda rng, last_g: last_g if last_g and 0 < last_g < 100 else 50.0,  # 跟随上一轮的G
+}
+
+
+class _TimedGameBoard(GameBoard.GameBoard):
+    """
+    记录每轮服务器端时间点：收齐输入、计算完成（即将发送结果）。
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.inputs_ready = []
+        self.computed = []
+
+    def _get_player_input(self) -> list:
+        inputs = super()._get_player_input()
+        self.inputs_ready.append(time.perf_counter())
+        return inputs
+
+    def _calculate_scores(self, inputs: list, g_value: float) -> list:
+        scores = super()._calculate_scores(inputs, g_value)
+        self.computed.append(time.perf_counter())
+        return scores
+
+    def game_exit(self):
+        pass  # 不等待5秒，由run()在所有bot收到最后一轮结果后关闭服务器
+
+
+def _run_bots(server_addr, bot_number: int, rounds: int, strategy: str, think_time: float, seed: int,
+              multicast: bool = False):
+    """
+    在当前进程中用线程运行bot_number个bot。返回(加入耗时, 每个bot每轮的(发送时间, 收到结果时间))。
+
+    time.perf_counter在同一台主机的不同进程间可以直接比较（Linux上为CLOCK_MONOTONIC）。
+    """
+    choose = STRATEGIES[strategy]
+    timings = [None] * bot_number
+    joined = Barrier(bot_number + 1)
+
+    def bot(index: int):
+        rng = random.Random(seed + index)
+        client = Network.Client(multicast=multicast)
+        client.connect(*server_addr)
+        joined.wait()
+        rows, last_g = [], None
+        for _ in range(rounds):
+            if think_time:
+                time.sleep(rng.uniform(0, think_time))
+            sent = time.perf_counter()
+            client.send_input(choose(rng, last_g))
+            _, last_g, _, play_again = client.get_round_result()
+            rows.append((sent, time.perf_counter()))
+            if not play_again:
+                break
+        timings[index] = rows
+
+    with contextlib.redirect_stdout(io.StringIO()):  # 客户端的调试输出
+        begin = time.perf_counter()
+        threads = [Thread(target=bot, args=(index,), daemon=True) for index in range(bot_number)]
+        for thread in threads:
+            thread.start()
+        joined.wait()
+        join_time = time.perf_counter() - begin
+        for thread in threads:
+            thread.join()
+    return join_time, timings
+
+
+def _percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    return {'p50': statistics.median(values) * 1e3,
+            'p99': values[min(len(values) - 1, int(len(values) * 0.99))] * 1e3,
+            'max': values[-1] * 1e3}
+
+
+def run(players: int, rounds: int, engine: str = 'thread', processes: int = 0, strategy: str = 'uniform',
+        think_time: float = 0.0, seed: int = 0, multicast: bool = False) -> dict:
+    """
+    进行一场完整的压力测试并返回统计结果。processes为0时所有bot在本进程中运行，否则平均分到processes个进程。
+    multicast为True时结果通过组播发送给所有bot。
+    """
+    if engine == 'asyncio':
+        import AsyncNetwork
+        server_class = AsyncNetwork.AsyncServer
+    else:
+        server_class = Network.Server
+    with contextlib.redirect_stdout(io.StringIO()):  # 服务器的连接日志
+        board = _TimedGameBoard(players, server_class, rounds=rounds, multicast=multicast)
+        server_addr = board.server.listen(0)
+        board.start(listen=False)
+        if processes:
+            shares = [players // processes + (index < players % processes) for index in range(processes)]
+            with Pool(processes) as pool:
+                results = pool.starmap(_run_bots, [(server_addr, share, rounds, strategy, think_time,
+                                                    seed + 100000 * index, multicast)
+                                                   for index, share in enumerate(shares) if share])
+        else:
+            results = [_run_bots(server_addr, players, rounds, strategy, think_time, seed, multicast)]
+        board.wait_exit()
+        board.server.server_exit()
+        board.history.close()
+
+    timings = [rows for _, bot_timings in results for rows in bot_timings]
+    round_start = [min(rows[round_][0] for rows in timings) for round_ in range(rounds)]
+    round_end = [max(rows[round_][1] for rows in timings) for round_ in range(rounds)]
+    latencies = [end - start for start, end in zip(round_start, round_end)]
+    counters = board.metrics.snapshot()['counters']
+    return {
+        'config': {'players': players, 'rounds': rounds, 'engine': engine, 'processes': processes,
+                   'strategy': strategy, 'think_time': think_time, 'seed': seed, 'multicast': multicast},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+        'join_ms': max(join_time for join_time, _ in results) * 1e3,
+        'rounds_per_sec': rounds / (round_end[-1] - round_start[0]),
+        'round_latency_ms': _percentiles(latencies),
+        'phases_ms': {
+            'input_collection': _percentiles([ready - start for start, ready in zip(round_start, board.inputs_ready)]),
+            'compute': _percentiles([done - ready for ready, done in zip(board.inputs_ready, board.computed)]),
+            'broadcast': _percentiles([end - done for done, end in zip(board.computed, round_end)]),
+        },
+        'server_metrics': board.metrics.snapshot()['histograms'],  # 服务器内置的各阶段耗时（秒）
+        'server_bytes_out': sum(counters.get('bytes_out', {}).values()) + counters.get('multicast_bytes_out', 0),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='无界面压力测试')
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--processes', type=int, default=0, help='bot进程数，0表示bot与服务器在同一进程')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='uniform')
+    parser.add_argument('--think-time', type=float, default=0.0, help='每轮提交前随机等待的最长秒数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--multicast', action='store_true', help='结果通过UDP组播发送')
+    parser.add_argument('--output', default=os.path.join('results', 'loadtest.json'), help='报告文件，目录不存在时创建')
+    args = parser.parse_args()
+
+    report = run(args.players, args.rounds, args.engine, args.processes, args.strategy, args.think_time, args.seed,
+                 args.multicast)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
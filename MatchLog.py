@@ -0,0 +1,81 @@
+"""
+文件名：    MatchLog.py
+功  能：    对局日志。只追加的二进制文件，每轮一条定长记录：轮次、G值、各阶段耗时、所有玩家的输入和分数。回放和重新计分见Replay.py。
+"""
+import time
+import struct
+
+import Scoring
+
+# 文件头：魔数, 版本, 玩家数量N, G值系数, 最近者得分(0表示N), 最远者得分, 创建时间
+_FILE_HEADER = struct.Struct('<4sHIdiid')
+_FILE_MAGIC = b'GTNM'
+_FILE_VERSION = 1
+# 记录头：轮次, G值, 等待输入的秒数, 计算的秒数；之后是N个double输入（缺席为NaN）和N个int32累计分数
+_RECORD_HEAD = struct.Struct('<Iddd')
+CHUNK_BYTES = 4 << 20  # 读取时每次读入的字节数，内存占用与日志长度无关
+
+
+def record_size(player_number: int) -> int:
+    return _RECORD_HEAD.size + 12 * player_number
+
+
+class MatchLogWriter:
+    """
+    每轮结束后追加一条记录并立即写入操作系统，进程崩溃时已经结束的轮次不会丢失。文件头记录了计分规则，回放时默认按它校验。
+    """
+
+    def __init__(self, path: str, player_number: int, ratio: float = Scoring.G_RATIO, win_points: int = None,
+                 lose_points: int = Scoring.LOSE_POINTS):
+        self._PLAYER_NUMBER = player_number
+        self._record = struct.Struct(f'<Iddd{player_number}d{player_number}i')
+        self._file = open(path, 'wb')
+        self._file.write(_FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, player_number, ratio,
+                                           player_number if win_points is None else win_points, lose_points,
+                                           time.time()))
+        self._file.flush()
+
+    def append(self, round_: int, inputs: list, g_value: float, scores: list,
+               input_wait: float = 0.0, compute: float = 0.0):
+        self._file.write(self._record.pack(round_, g_value, input_wait, compute, *inputs, *scores))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_header(f) -> dict:
+    """
+    读取并校验文件头，f停在第一条记录处。
+    """
+    raw = f.read(_FILE_HEADER.size)
+    if len(raw) != _FILE_HEADER.size:
+        raise ValueError('Not a match log: file too short.')
+    magic, version, player_number, ratio, win_points, lose_points, created = _FILE_HEADER.unpack(raw)
+    if magic != _FILE_MAGIC or version != _FILE_VERSION:
+        raise ValueError('Not a match log, or written by an unsupported version.')
+    return {'players': player_number, 'ratio': ratio, 'win_points': win_points, 'lose_points': lose_points,
+            'created': created}
+
+
+def iter_chunks(f, player_number: int, chunk_bytes: int = CHUNK_BYTES):
+    """
+    从f的当前位置起逐块读取完整的记录，产出memoryview。所有块共用同一个缓冲区，
+    使用方必须在取下一块之前处理完（或复制）当前块。文件末尾不完整的记录（写入时崩溃）被忽略。
+    """
+    size = record_size(player_number)
+    buf = bytearray(max(size, chunk_bytes // size * size))
+    view = memoryview(buf)
+    filled = 0
+    while True:
+        n = f.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+        usable = filled // size * size
+        if usable:
+            yield view[:usable]
+            view[:filled - usable] = view[usable:filled]  # 把不完整的尾部挪到开头
+            filled -= usable
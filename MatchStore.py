@@ -0,0 +1,280 @@
+"""
+文件名：    MatchStore.py
+功  能：    跨对局的持久化存储（SQLite）。保存每一轮的G值、输入和分数，以及每局的最终排名，
+            提供历史总排行榜和单个玩家的对局记录查询。
+
+运行方式：python MatchStore.py games.db top [-k 10]
+          python MatchStore.py games.db player 名字 [-k 20]
+"""
+import sys
+import json
+import time
+import queue
+import sqlite3
+import argparse
+from array import array
+from threading import Thread, local
+
+BATCH_SIZE = 4096  # 写入线程一次事务最多处理的操作数
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    match_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    players INTEGER NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    rules TEXT
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    match_id INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    g REAL NOT NULL,
+    inputs BLOB NOT NULL,
+    scores BLOB NOT NULL,
+    PRIMARY KEY (match_id, round)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS standings (
+    match_id INTEGER NOT NULL,
+    player_id INTEGER NOT NULL,
+    player TEXT,
+    score INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    played INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    penalties INTEGER NOT NULL,
+    mean_input REAL,
+    PRIMARY KEY (match_id, player_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS standings_player ON standings (player, match_id);
+CREATE TABLE IF NOT EXISTS totals (
+    player TEXT PRIMARY KEY,
+    matches INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    penalties INTEGER NOT NULL,
+    firsts INTEGER NOT NULL,
+    best_rank INTEGER NOT NULL,
+    last_match INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS totals_score ON totals (score DESC, player);
+"""
+
+_UPSERT_TOTALS = """
+INSERT INTO totals (player, matches, score, wins, penalties, firsts, best_rank, last_match)
+VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (player) DO UPDATE SET
+    matches = matches + 1, score = score + excluded.score, wins = wins + excluded.wins,
+    penalties = penalties + excluded.penalties, firsts = firsts + excluded.firsts,
+    best_rank = min(best_rank, excluded.best_rank), last_match = excluded.last_match
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')  # 读者不阻塞写入线程，写入线程也不阻塞读者
+    conn.execute('PRAGMA synchronous=NORMAL')  # WAL模式下只在检查点时fsync，断电最多丢失最近的事务
+    return conn
+
+
+class MatchHandle:
+    """
+    一局对局。match_id由写入线程插入matches表后填入，调用方不必等待。
+    """
+    __slots__ = ('match_id', 'players')
+
+    def __init__(self, players: int):
+        self.match_id = None  # type: int
+        self.players = players
+
+
+class MatchStore:
+    """
+    所有写操作只是放入队列，由一个后台线程按顺序取出，每次把队列中积压的操作（最多BATCH_SIZE个）
+    放在一个事务里执行，连续的轮次用一次executemany写入。游戏线程不会因为磁盘而阻塞。
+
+    查询在调用方的线程中进行，每个线程一个只读连接（WAL模式下与写入互不阻塞）。
+    每轮的输入和分数以array的字节存放在一行中；排行榜由totals表增量维护，按分数的索引取前k名。
+    玩家在不同对局之间以名字识别，没有名字的玩家只记入本局排名，不计入总排行榜。
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        conn = _connect(path)
+        conn.executescript(_SCHEMA)
+        conn.close()
+        self._queue = queue.Queue()
+        self._readers = local()
+        self._closed = False
+        self._T_writer = Thread(target=self._writer)
+        self._T_writer.setDaemon(True)
+        self._T_writer.start()
+
+    # 写入（任何线程，不阻塞）
+    def begin_match(self, players: int, rules: dict = None) -> MatchHandle:
+        match = MatchHandle(players)
+        self._queue.put(('match', match, time.time(), json.dumps(rules) if rules is not None else None))
+        return match
+
+    def add_round(self, match: MatchHandle, round_: int, g_value: float, inputs: list, scores: list):
+        self._queue.put(('round', match, round_, g_value, inputs, scores))
+
+    def finish_match(self, match: MatchHandle, standings: list):
+        """
+        standings: 每个玩家一个dict，键同Statistics.PlayerStats.player，另加'name'（None表示匿名）。
+        """
+        self._queue.put(('finish', match, time.time(), standings))
+
+    def flush(self):
+        """
+        阻塞至队列中已有的操作都已提交。
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._T_writer.join()
+
+    def _writer(self):
+        conn = _connect(self._path)
+        while True:
+            ops = [self._queue.get()]
+            while len(ops) < BATCH_SIZE:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in ops
+            batch = [op for op in ops if op is not None]
+            try:
+                with conn:  # 一批操作一个事务
+                    self._apply(conn, batch)
+            except Exception as e:  # 不只是数据库错误，参数不合法（如分数超出int32）也不能让写入线程退出
+                print('S-EXCEPTION: Failed to write match store, retrying one by one.\n\t\tError reported as ', repr(e))
+                self._retry(conn, batch)
+            for _ in ops:
+                self._queue.task_done()
+            if stop:
+                break
+        conn.close()
+
+    def _retry(self, conn: sqlite3.Connection, ops: list):
+        """
+        整批回滚后逐个操作重试，只丢弃出错的那个。回滚的对局插入分配的match_id已经作废，先清除，
+        否则它会被下一局重新分配，两局的记录混在同一个match_id下。
+        """
+        for op in ops:
+            if op[0] == 'match':
+                op[1].match_id = None
+        for op in ops:
+            try:
+                with conn:
+                    self._apply(conn, [op])
+            except Exception as e:
+                print(f'S-EXCEPTION: Dropped a {op[0]!r} operation of the match store.\n\t\tError reported as ',
+                      repr(e))
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, ops: list):
+        """
+        对局没有插入成功（match_id为None）时，它的轮次和结果被忽略。
+        """
+        rounds = []  # 连续的轮次攒起来一次写入
+        for op in ops:
+            if op[0] != 'match' and op[1].match_id is None:
+                continue
+            if op[0] == 'round':
+                _, match, round_, g_value, inputs, scores = op
+                rounds.append((match.match_id, round_, g_value, array('d', inputs).tobytes(),
+                               array('i', scores).tobytes()))
+                continue
+            if rounds:
+                conn.executemany('INSERT OR REPLACE INTO rounds VALUES (?, ?, ?, ?, ?)', rounds)
+                rounds = []
+            if op[0] == 'match':
+                _, match, started, rules = op
+                match.match_id = conn.execute('INSERT INTO matches (players, started, rules) VALUES (?, ?, ?)',
+                                              (match.players, started, rules)).lastrowid
+            else:
+                _, match, finished, standings = op
+                conn.execute('UPDATE matches SET finished = ?, rounds = '
+                             '(SELECT count(*) FROM rounds WHERE match_id = ?) WHERE match_id = ?',
+                             (finished, match.match_id, match.match_id))
+                conn.executemany('INSERT OR REPLACE INTO standings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 [(match.match_id, p['id'], p.get('name'), p['score'], p['rank'], p['played'],
+                                   p['wins'], p['penalties'], p['mean_input'] if p['played'] else None)
+                                  for p in standings])
+                conn.executemany(_UPSERT_TOTALS,
+                                 [(p['name'], p['score'], p['wins'], p['penalties'], int(p['rank'] == 1),
+                                   p['rank'], match.match_id) for p in standings if p.get('name')])
+        if rounds:
+            conn.executemany('INSERT OR REPLACE INTO rounds VALUES (?, ?, ?, ?, ?)', rounds)
+
+    # 查询（调用方线程）
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(f'file:{self._path}?mode=ro', uri=True, timeout=30)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def leaderboard(self, k: int = 10) -> list:
+        """
+        历史总分前k名：[{'player', 'matches', 'score', 'wins', 'penalties', 'firsts', 'best_rank', 'last_match'}, ...]
+        """
+        rows = self._reader().execute('SELECT * FROM totals ORDER BY score DESC, player LIMIT ?', (k,))
+        return [dict(row) for row in rows]
+
+    def player_total(self, player: str) -> dict:
+        row = self._reader().execute('SELECT * FROM totals WHERE player = ?', (player,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def player_history(self, player: str, k: int = 20) -> list:
+        """
+        该玩家最近k局的成绩，新的在前：[{'match_id', 'finished', 'players', 'rounds', 'player_id', 'score', 'rank', ...}, ...]
+        """
+        rows = self._reader().execute(
+            'SELECT s.match_id, m.finished, m.players, m.rounds, s.player_id, s.score, s.rank, s.played, s.wins, '
+            's.penalties, s.mean_input FROM standings AS s JOIN matches AS m USING (match_id) '
+            'WHERE s.player = ? ORDER BY s.match_id DESC LIMIT ?', (player, k))
+        return [dict(row) for row in rows]
+
+    def match_rounds(self, match_id: int, first: int = 0, last: int = None):
+        """
+        逐轮读出一局的记录：(round, g_value, inputs, scores)，按主键范围扫描。
+        """
+        rows = self._reader().execute(
+            'SELECT round, g, inputs, scores FROM rounds WHERE match_id = ? AND round >= ? AND round <= ? '
+            'ORDER BY round', (match_id, first, (1 << 62) if last is None else last))
+        for round_, g_value, inputs, scores in rows:
+            yield round_, g_value, array('d', inputs).tolist(), array('i', scores).tolist()
+
+    def player_inputs(self, match_id: int, player_id: int) -> list:
+        """
+        某局中一个玩家每轮的输入（缺席为NaN）。
+        """
+        return [inputs[player_id] for _, _, inputs, _ in self.match_rounds(match_id)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='查询对局数据库')
+    parser.add_argument('path', help='GameBoard的store_path')
+    sub = parser.add_subparsers(dest='command', required=True)
+    top_parser = sub.add_parser('top', help='历史总排行榜')
+    top_parser.add_argument('-k', type=int, default=10)
+    player_parser = sub.add_parser('player', help='一个玩家最近的对局')
+    player_parser.add_argument('name')
+    player_parser.add_argument('-k', type=int, default=20)
+    args = parser.parse_args()
+
+    store = MatchStore(args.path)
+    if args.command == 'top':
+        result = store.leaderboard(args.k)
+    else:
+        result = {'total': store.player_total(args.name), 'matches': store.player_history(args.name, args.k)}
+    store.close()
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
@@ -0,0 +1,179 @@
+"""
+文件名：    Metrics.py
+功  能：    运行指标。计数器、最新值和耗时直方图，可以通过snapshot()查询，也可以开一个本机的文本指标端口。
+"""
+import math
+from bisect import bisect_left
+from threading import Thread, Lock
+
+# 直方图桶的上界（秒）：1us到约134s，每档翻倍。桶是固定的，记录一次只需一次二分查找和两次加法
+_BUCKET_BOUNDS = tuple(1e-6 * 2 ** i for i in range(28))
+
+
+class Histogram:
+    """
+    固定桶的耗时直方图。分位数按桶上界估计，误差不超过一倍。
+    """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)  # 最后一个桶收集超出上界的值
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(_BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_BUCKET_BOUNDS[index], self.max) if index < len(_BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class Registry:
+    """
+    一个服务器（房间）的全部指标。每个指标由(名称, 标签)确定，标签通常是客户端ID，不需要时为None。
+
+    enabled=False时所有记录操作直接返回，用于测量插桩本身的开销。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._LOCK = Lock()  # 多个客户端线程会同时累加同一个计数器
+        self._counters = {}  # (name, label) -> int
+        self._gauges = {}  # (name, label) -> 最新值
+        self._histograms = {}  # name -> Histogram
+        self._http_server = None
+
+    def inc(self, name: str, value: int = 1, label=None):
+        if not self.enabled:
+            return
+        key = (name, label)
+        with self._LOCK:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value, label=None):
+        if not self.enabled:
+            return
+        self._gauges[(name, label)] = value
+
+    def observe(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._LOCK:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def counter(self, name: str, label=None) -> int:
+        return self._counters.get((name, label), 0)
+
+    def gauge(self, name: str, label=None):
+        return self._gauges.get((name, label))
+
+    def histogram(self, name: str) -> Histogram:
+        return self._histograms.get(name)
+
+    def snapshot(self) -> dict:
+        """
+        当前全部指标的副本：{'counters': {name: 值或{label: 值}}, 'gauges': 同上, 'histograms': {name: 摘要}}。
+        """
+        with self._LOCK:
+            counters, gauges = dict(self._counters), dict(self._gauges)
+            histograms = {name: histogram.summary() for name, histogram in self._histograms.items()}
+        return {'counters': _group(counters), 'gauges': _group(gauges), 'histograms': histograms}
+
+    def render_text(self, prefix: str = 'gtn_') -> str:
+        """
+        Prometheus文本格式：每行一个样本，直方图输出累计的_bucket、_sum和_count。
+        """
+        with self._LOCK:
+            counters = sorted(self._counters.items(), key=_sort_key)
+            gauges = sorted(self._gauges.items(), key=_sort_key)
+            histograms = {name: (list(h.counts), h.sum, h.count) for name, h in self._histograms.items()}
+        lines = []
+        for kind, samples in (('counter', counters), ('gauge', gauges)):
+            declared = set()
+            for (name, label), value in samples:
+                if name not in declared:
+                    lines.append(f'# TYPE {prefix}{name} {kind}')
+                    declared.add(name)
+                labels = '' if label is None else f'{{client="{label}"}}'
+                lines.append(f'{prefix}{name}{labels} {value}')
+        for name in sorted(histograms):
+            counts, total, count = histograms[name]
+            lines.append(f'# TYPE {prefix}{name} histogram')
+            cumulative = 0
+            for bound, n in zip(_BUCKET_BOUNDS, counts):
+                cumulative += n
+                lines.append(f'{prefix}{name}_bucket{{le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{prefix}{name}_bucket{{le="+Inf"}} {count}')
+            lines.append(f'{prefix}{name}_sum {total}')
+            lines.append(f'{prefix}{name}_count {count}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 0, host: str = '127.0.0.1'):
+        """serve(port) -> (host, port)
+
+        在后台线程开一个HTTP端口，GET任意路径都返回render_text()。默认只监听本机。
+        """
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # 不开端口时不导入，加快启动
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不在控制台打印每次请求
+
+        self.close()
+        self._http_server = ThreadingHTTPServer((host, port), _Handler)
+        self._http_server.daemon_threads = True
+        T_serve_metrics = Thread(target=self._http_server.serve_forever)
+        T_serve_metrics.setDaemon(True)
+        T_serve_metrics.start()
+        print(f'S-INFO: metrics available at http://{host}:{self._http_server.server_port}/metrics')
+        return host, self._http_server.server_port
+
+    def close(self):
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+
+def _group(samples: dict) -> dict:
+    grouped = {}
+    for (name, label), value in samples.items():
+        if label is None:
+            grouped[name] = value
+        else:
+            grouped.setdefault(name, {})[label] = value
+    return grouped
+
+
+def _sort_key(item):
+    (name, label), _ = item
+    return name, label is not None, str(label)
@@ -5,12 +5,53 @@
 修改日期：  2020年11月28日
 修改内容：  初版。
 """
+import errno
 import socket
+import struct
 import json
-from threading import Thread, Semaphore, Event, RLock
+import time
+import zlib
+from collections import deque
+from threading import Thread, Event, Lock, RLock, Condition
+
+import Metrics
+import ConnectionTable
+import RoundBarrier
+import Spectators
+import TimingWheel
 
 SERVER_DEFAULT_PORT = 8721
 
+# 帧格式：8字节负载长度 + 1字节编码方式，之后是负载。长度字段为uint64，消息大小不设上限。
+_FRAME_HEADER = struct.Struct('!QB')
+CODEC_JSON = 0  # 负载为utf-8编码的json，所有消息都可以使用
+CODEC_BINARY = 1  # 负载为定长二进制，仅CMD.C_INPUT/CMD.S_INPUT可以使用，其余消息自动回退到json
+SUPPORTED_CODECS = (CODEC_BINARY, CODEC_JSON)  # 按优先级排列，C_JOIN握手时协商
+# 压缩：编码字节的最高位表示负载经过压缩，可以与任一编码组合，如CODEC_BINARY | COMPRESS_ZLIB。
+# 握手时协商，之后服务器只压缩不小于COMPRESS_THRESHOLD字节、且压缩后确实变小的负载
+COMPRESS_ZLIB = 0x80
+SUPPORTED_COMPRESSIONS = {'zlib': COMPRESS_ZLIB}  # 按优先级排列
+COMPRESS_THRESHOLD = 1024  # 字节，更小的消息压缩收益抵不上CPU开销
+COMPRESS_LEVEL = 1  # zlib最快的一档，大房间每轮只压缩一次，但是要在发送前完成
+MAX_FRAME_SIZE = 64 << 20  # 字节，接收的帧负载和解压后的负载都不能超过，10万人房间的一轮结果约3MB
+
+RECONNECT_GRACE = 30  # 秒，连接断开后为玩家保留ID的时间，期间可以凭会话令牌重连
+RECONNECT_TIMEOUT = 10  # 秒，客户端断线后尝试重连的总时长
+# 心跳：合上笔记本、切换Wi-Fi时TCP连接不会报错，服务器只能靠客户端定期发来的消息判断它是否还在
+HEARTBEAT_TIMEOUT = 15  # 秒，发送心跳的客户端沉默这么久就视为已断开，释放它的ID
+HEARTBEAT_MISSES = 3  # 超时前允许丢失的心跳数，客户端每HEARTBEAT_TIMEOUT / HEARTBEAT_MISSES秒至少发送一条消息
+DEADLINE_TICK = 0.25  # 秒，检查心跳超时和重连保留期的时间轮每格的长度，也是检测的精度
+LISTEN_BACKLOG = 1024  # 一次性涌入大量玩家时，backlog太小会让连接请求被内核丢弃后重试
+MAX_NAME_LENGTH = 32  # C_JOIN中玩家名字的最大长度，更长的或者不是字符串的名字视为匿名
+
+MULTICAST_GROUP = '239.255.43.21'  # 本地管理范围的组播地址，TTL为1，不出局域网
+MULTICAST_HEARTBEAT = 0.2  # 秒，组播最新轮次的间隔，客户端据此发现丢失的结果
+RESEND_WINDOW = 256  # 服务器保留最近多少轮结果供客户端补发
+_MAX_DATAGRAM = 65507  # UDP负载上限，超过的结果帧无法组播
+RECV_BUFFER_SIZE = 64 << 10  # FrameReader的初始缓冲区大小，更大的帧到来时翻倍
+GATHER_THRESHOLD = 32 << 10  # 负载不小于此字节数时帧头和负载用sendmsg聚集写，更小的负载拼接的复制比sendmsg的开销小
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # Windows没有sendmsg，总是拼接后sendall
+
 
 def get_lan_ip() -> str:
     """
@@ -38,25 +79,432 @@ def port_is_occupied(ip_: str, port_: int) -> bool:
     return occupied
 
 
-def _send_data(target_socket: socket.socket, protocol, **kw):
+def bind_socket(ip_: str, target_port: int, fallback: bool = True) -> socket.socket:
+    """
+    创建并绑定TCP socket。直接尝试bind，端口被占用时才换下一个端口，不再逐个connect探测。
+    """
+    while True:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind((ip_, target_port))
+            return s
+        except OSError as e:
+            s.close()
+            if not fallback or target_port == 0 or e.errno != errno.EADDRINUSE:
+                raise
+            target_port += 1  # 如果端口被占用，就换一个端口
+
+
+def _close_now(target_socket: socket.socket):
+    """
+    关闭socket，并唤醒阻塞在该socket上的其他线程（只调用close时，阻塞在recv上的线程不一定会返回）。
+    """
+    try:
+        target_socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    target_socket.close()
+
+
+def _send_data(target_socket: socket.socket, protocol, codec: int = CODEC_JSON, **kw):
     """
     向target_socket发送消息。协议规范参考CMD.protocol。
+
+    codec为握手时协商好的编码方式（可以带有压缩位），消息不支持该编码时使用json。
+    大的负载与帧头聚集写出，不拼接。
     """
     data = CMD.protocol[protocol].copy()
     data.update(kw)
-    msg = {'CMD': protocol, 'DATA': data}
-    msg = json.dumps(msg)
-    target_socket.sendall(msg.encode())
+    payload, codec = _encode_payload(protocol, data, codec)
+    _send_parts(target_socket, _FRAME_HEADER.pack(len(payload), codec), payload)
+
+
+def _send_parts(target_socket: socket.socket, header: bytes, payload: bytes):
+    """
+    负载较大时把帧头和负载作为两段缓冲区用sendmsg发出（聚集写），只发出一部分时用memoryview继续发送剩余部分。
+    """
+    if len(payload) < GATHER_THRESHOLD or not _HAS_SENDMSG:
+        target_socket.sendall(header + payload)
+        return
+    sent = target_socket.sendmsg((header, payload))
+    total = len(header) + len(payload)
+    if sent < total:  # 发送缓冲区满了，很少发生
+        if sent < len(header):
+            target_socket.sendall(header[sent:])
+            sent = len(header)
+        target_socket.sendall(memoryview(payload)[sent - len(header):])
+
+
+def _send_input(target_socket: socket.socket, codec: int, client_id: int, value: float, round_):
+    """
+    发送C_INPUT，每个玩家每轮一条，最频繁的客户端消息。二进制编码不经过dict、协议模板和_encode_frame，
+    帧头和负载用一个Struct打包成一个bytes；C_INPUT远小于COMPRESS_THRESHOLD，压缩位不影响结果。其他编码同_send_data。
+    """
+    if codec & ~COMPRESS_ZLIB == CODEC_BINARY:
+        target_socket.sendall(_BIN_C_INPUT_FRAME.pack(_BIN_C_INPUT.size, CODEC_BINARY, CMD.C_INPUT,
+                                                      _BIN_NO_ROUND if round_ is None else round_, client_id, value))
+    else:
+        _send_data(target_socket, CMD.C_INPUT, codec, ID=client_id, VALUE=value, ROUND=round_)
+
+
+_FIXED_FRAMES = {}  # (protocol, codec) -> 没有参数的消息（如C_HEARTBEAT）的完整帧
+
+
+def _send_fixed(target_socket: socket.socket, protocol, codec: int = CODEC_JSON):
+    """
+    发送内容固定的消息：帧只在第一次发送时编码，之后直接发送同一个bytes。
+    """
+    frame = _FIXED_FRAMES.get((protocol, codec))
+    if frame is None:
+        frame = _FIXED_FRAMES[protocol, codec] = _encode_frame(protocol, CMD.protocol[protocol], codec)
+    target_socket.sendall(frame)
+
+
+def _recv_data(target_socket: socket.socket, compressed: bool = True):
+    """
+    从target_socket接收一帧消息 -> 可能出现ValueError(json.decoder.JSONDecodeError)、struct.error
+
+    对方关闭连接时抛出ConnectionResetError。compressed为False时对方发来压缩的帧也是ValueError，
+    服务器接收客户端的消息时使用：压缩只在服务器到客户端的方向上协商。
+    """
+    return _recv_frame(target_socket, compressed)[0]
+
+
+def _recv_frame(target_socket: socket.socket, compressed: bool = True):
+    """_recv_frame(target_socket) -> (消息, 帧的总字节数)
+    """
+    length, codec = _FRAME_HEADER.unpack(_recv_exactly(target_socket, _FRAME_HEADER.size))
+    _check_frame_size(length)
+    payload = _recv_exactly(target_socket, length)
+    return _decode_payload(payload, codec, compressed), _FRAME_HEADER.size + length
+
+
+def _check_frame_size(length: int):
+    """
+    帧头中的长度来自对方，先检查再按它分配缓冲区。
+    """
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f'Frame of {length} bytes exceeds MAX_FRAME_SIZE.')
+
+
+class FrameReader:
+    """
+    一个连接的接收缓冲区。预先分配的bytearray用recv_into填充，一次系统调用可能读入多帧，
+    帧头和负载都在缓冲区上用memoryview切片解析，接收时不再为每条消息分配bytes。
+
+    read_frame返回的负载视图在下一次读取前有效；recv返回解码后的消息（二进制编码直接从视图中解包）。
+    会预读之后的数据，所以创建后同一个socket上不能再用_recv_data/_recv_frame读取。
+    compressed的含义同_recv_data。
+    """
+    __slots__ = ('sock', 'compressed', '_buf', '_view', '_start', '_end')
+
+    def __init__(self, sock: socket.socket, size: int = RECV_BUFFER_SIZE, compressed: bool = True):
+        self.sock = sock
+        self.compressed = compressed
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # 未解析数据的开始
+        self._end = 0  # 已接收数据的结束
+
+    def read_frame(self):
+        """read_frame() -> (负载视图, 编码, 帧的总字节数)
+        """
+        header = _FRAME_HEADER.size
+        if self._end - self._start < header:
+            self._fill(header)
+        length, codec = _FRAME_HEADER.unpack_from(self._buf, self._start)
+        _check_frame_size(length)
+        if self._end - self._start < header + length:
+            self._fill(header + length)
+        begin = self._start + header
+        self._start = begin + length
+        return self._view[begin:self._start], codec, header + length
+
+    def recv(self):
+        """recv() -> (消息, 帧的总字节数)，与_recv_frame相同。
+        """
+        payload, codec, size = self.read_frame()
+        return _decode_payload(payload, codec, self.compressed), size
+
+    def _fill(self, size: int):
+        """
+        接收至缓冲区中至少有size字节未解析的数据。剩余空间不够时把未解析的数据移到开头，帧比缓冲区还大时换一个更大的缓冲区。
+        """
+        pending = self._end - self._start
+        if self._start + size > len(self._buf):
+            if size > len(self._buf):
+                buf = bytearray(max(size, 2 * len(self._buf)))
+                buf[:pending] = self._view[self._start:self._end]
+                self._buf, self._view = buf, memoryview(buf)  # 之前返回的视图仍然引用旧缓冲区
+            elif pending:
+                self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        while self._end - self._start < size:
+            n = self.sock.recv_into(self._view[self._end:])
+            if n == 0:
+                raise ConnectionResetError('Connection closed by peer.')
+            self._end += n
+
+
+def _recv_exactly(target_socket: socket.socket, size: int) -> bytes:
+    """
+    接收恰好size字节。TCP是字节流，一条消息可能被拆分成多次到达。
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = target_socket.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionResetError('Connection closed by peer.')
+        received += n
+    return bytes(buf)
+
+
+def _encode_frame(protocol, data: dict, codec: int = CODEC_JSON) -> bytes:
+    """
+    把一条消息编码成完整的帧（含帧头）。codec带有压缩位时，负载足够大才压缩，帧头中的压缩位表示实际是否压缩。
+    """
+    payload, codec = _encode_payload(protocol, data, codec)
+    return _FRAME_HEADER.pack(len(payload), codec) + payload
+
+
+def _encode_payload(protocol, data: dict, codec: int = CODEC_JSON):
+    """_encode_payload(protocol, data, codec) -> (负载, 帧头中的编码)
+    """
+    compress = codec & COMPRESS_ZLIB
+    codec &= ~COMPRESS_ZLIB
+    if codec == CODEC_BINARY and protocol in _BINARY_ENCODERS:
+        payload = _BINARY_ENCODERS[protocol](data)
+    else:
+        codec = CODEC_JSON
+        payload = json.dumps({'CMD': protocol, 'DATA': data}).encode()
+    if compress and len(payload) >= COMPRESS_THRESHOLD:
+        packed = zlib.compress(payload, COMPRESS_LEVEL)
+        if len(packed) < len(payload):
+            payload, codec = packed, codec | COMPRESS_ZLIB
+    return payload, codec
+
+
+def _decode_payload(payload, codec: int, compressed: bool = True) -> dict:
+    """
+    payload可以是bytes或memoryview（FrameReader的缓冲区视图），解码结果不引用payload。
+    compressed为False时不接受压缩的负载；解压后超过MAX_FRAME_SIZE的负载抛出ValueError，几KB的zlib数据可以展开成几GB。
+    """
+    if codec & COMPRESS_ZLIB:
+        if not compressed:
+            raise ValueError('Compressed frame was not negotiated.')
+        inflater = zlib.decompressobj()
+        payload, codec = inflater.decompress(payload, MAX_FRAME_SIZE), codec & ~COMPRESS_ZLIB
+        if inflater.unconsumed_tail:
+            raise ValueError('Decompressed frame exceeds MAX_FRAME_SIZE.')
+    if codec == CODEC_JSON:
+        return json.loads(str(payload, 'utf-8'))  # type: dict  # 如果Error可以使用 , strict=False 参数
+    if codec == CODEC_BINARY:
+        protocol, = _BIN_CMD.unpack_from(payload)
+        return {'CMD': protocol, 'DATA': _BINARY_DECODERS[protocol](payload)}
+    raise ValueError(f'Unknown codec {codec}.')
+
+
+def negotiate_codec(client_codecs) -> int:
+    """
+    服务器从客户端支持的编码列表中选取第一个自己也支持的编码。旧客户端没有该字段，使用json。
+    """
+    for codec in client_codecs or ():
+        if codec in SUPPORTED_CODECS:
+            return codec
+    return CODEC_JSON
 
 
-def _recv_data(target_socket: socket.socket):
+def negotiate_compression(client_compressions) -> int:
+    """
+    服务器从客户端支持的压缩算法中选取第一个自己也支持的，返回要与编码组合的压缩位；都不支持（或旧客户端）时返回0。
     """
-    从target_socket接收消息 -> 可能出现json.decoder.JSONDecodeError
+    for name in client_compressions or ():
+        if name in SUPPORTED_COMPRESSIONS:
+            return SUPPORTED_COMPRESSIONS[name]
+    return 0
+
+
+def player_name(name):
     """
-    msg = target_socket.recv(1024)  # type: bytes
-    msg = msg.decode()  # type: str  # json str
-    msg = json.loads(msg)  # type: dict  # 如果Error可以使用 , strict=False 参数
-    return msg
+    C_JOIN中报上的名字，来自客户端、不可信：只接受非空且不超过MAX_NAME_LENGTH的字符串，否则为None（匿名）。
+    """
+    if isinstance(name, str) and 0 < len(name) <= MAX_NAME_LENGTH:
+        return name
+    return None
+
+
+def compression_name(codec: int):
+    """
+    codec中压缩位对应的算法名称，S_JOIN/S_SPECTATE中告知客户端；没有压缩时为None。
+    """
+    for name, flag in SUPPORTED_COMPRESSIONS.items():
+        if codec & flag:
+            return name
+    return None
+
+
+# 二进制编码。所有消息以2字节CMD开头，整数和浮点数都是网络字节序的定长字段。
+_BIN_CMD = struct.Struct('!H')
+_BIN_C_INPUT = struct.Struct('!HIid')  # CMD, ROUND, ID, VALUE
+_BIN_S_INPUT = struct.Struct('!HId?I')  # CMD, ROUND, G, AGAIN, 玩家数量N；之后是N个double输入和N个int32分数
+_BIN_S_DELTA = struct.Struct('!HId?II')  # CMD, ROUND, G, AGAIN, 玩家数量N, 变化的分数个数M；之后是N个double输入，M个uint32下标，M个int32分数
+_BIN_NO_ROUND = 0xFFFFFFFF  # C_INPUT未指定轮次（ROUND为None），由服务器推断
+_BIN_C_INPUT_FRAME = struct.Struct(_FRAME_HEADER.format + _BIN_C_INPUT.format[1:])  # 帧头和C_INPUT负载，见_send_input
+
+
+def _encode_c_input(data: dict) -> bytes:
+    round_ = _BIN_NO_ROUND if data['ROUND'] is None else data['ROUND']
+    return _BIN_C_INPUT.pack(CMD.C_INPUT, round_, data['ID'], data['VALUE'])
+
+
+def _decode_c_input(payload: bytes) -> dict:
+    _, round_, id_, value = _BIN_C_INPUT.unpack(payload)
+    return {'ID': id_, 'VALUE': value, 'ROUND': None if round_ == _BIN_NO_ROUND else round_}
+
+
+def _encode_s_input(data: dict) -> bytes:
+    inputs, scores = data['INPUTS'], data['SCORE']
+    n = len(inputs)
+    return b''.join((_BIN_S_INPUT.pack(CMD.S_INPUT, data['ROUND'], data['G'], data['AGAIN'], n),
+                     struct.pack(f'!{n}d', *inputs),
+                     struct.pack(f'!{len(scores)}i', *scores)))
+
+
+def _decode_s_input(payload: bytes) -> dict:
+    _, round_, g_value, play_again, n = _BIN_S_INPUT.unpack_from(payload)
+    offset = _BIN_S_INPUT.size
+    inputs = list(struct.unpack_from(f'!{n}d', payload, offset))
+    offset += 8 * n
+    m = (len(payload) - offset) // 4  # 第一轮之前分数表可能为空
+    scores = list(struct.unpack_from(f'!{m}i', payload, offset))
+    return {'ROUND': round_, 'INPUTS': inputs, 'G': g_value, 'SCORE': scores, 'AGAIN': play_again}
+
+
+def _encode_s_delta(data: dict) -> bytes:
+    inputs, index, scores = data['INPUTS'], data['IDX'], data['SCORE']
+    n, m = len(inputs), len(index)
+    return b''.join((_BIN_S_DELTA.pack(CMD.S_DELTA, data['ROUND'], data['G'], data['AGAIN'], n, m),
+                     struct.pack(f'!{n}d', *inputs),
+                     struct.pack(f'!{m}I', *index),
+                     struct.pack(f'!{m}i', *scores)))
+
+
+def _decode_s_delta(payload: bytes) -> dict:
+    _, round_, g_value, play_again, n, m = _BIN_S_DELTA.unpack_from(payload)
+    offset = _BIN_S_DELTA.size
+    inputs = list(struct.unpack_from(f'!{n}d', payload, offset))
+    offset += 8 * n
+    index = list(struct.unpack_from(f'!{m}I', payload, offset))
+    scores = list(struct.unpack_from(f'!{m}i', payload, offset + 4 * m))
+    return {'ROUND': round_, 'INPUTS': inputs, 'G': g_value, 'IDX': index, 'SCORE': scores, 'AGAIN': play_again}
+
+
+class RoundResult:
+    """
+    一轮游戏结果。每种(编码, 是否增量)组合只序列化一次，得到的bytes不可变，由所有客户端共享发送。
+    编码带有压缩位时同样只压缩一次，所以压缩是按消息进行的，不为每个连接保留压缩器的状态。
+
+    增量帧(S_DELTA)只携带与上一轮相比发生变化的分数，只能发给已经收到上一轮结果的客户端。
+    """
+
+    def __init__(self, inputs: list, g_value: float, scores: list, play_again: bool, last_scores: list = None,
+                 round_: int = 0):
+        self.round = round_
+        self.inputs = list(inputs)  # 服务器会在下一轮复用输入列表，这里保存一份
+        self.g_value = g_value
+        self.scores = scores
+        self.play_again = play_again
+        self._last_scores = last_scores if last_scores is not None and len(last_scores) == len(scores) else None
+        self._frames = {}
+        self._LOCK = RLock()
+
+    def frame(self, codec: int = CODEC_JSON, delta: bool = False) -> bytes:
+        key = (codec, delta and self._last_scores is not None)
+        frame = self._frames.get(key)
+        if frame is None:
+            with self._LOCK:
+                frame = self._frames.get(key)
+                if frame is None:
+                    frame = self._frames[key] = self._encode(*key)
+        return frame
+
+    def _encode(self, codec: int, delta: bool) -> bytes:
+        if not delta:
+            return _encode_frame(CMD.S_INPUT, {'ROUND': self.round, 'INPUTS': self.inputs, 'G': self.g_value,
+                                               'SCORE': self.scores, 'AGAIN': self.play_again}, codec)
+        index = [id_ for id_, (old, new) in enumerate(zip(self._last_scores, self.scores)) if old != new]
+        return _encode_frame(CMD.S_DELTA, {'ROUND': self.round, 'INPUTS': self.inputs, 'G': self.g_value, 'IDX': index,
+                                           'SCORE': [self.scores[id_] for id_ in index],
+                                           'AGAIN': self.play_again}, codec)
+
+
+class MulticastSender:
+    """
+    把每轮结果用UDP组播发送一次，主机的发送开销与玩家数量无关。结果帧就是二进制编码的S_INPUT，其中的ROUND即序号。
+
+    组播不可靠：客户端发现序号不连续，或者心跳(S_LATEST)中的最新轮次比自己收到的新，就通过TCP用C_RESEND补要，
+    服务器从最近RESEND_WINDOW轮的结果中补发。目的端口就是发送socket自己的端口，客户端按源端口过滤其他服务器的组播。
+    """
+
+    def __init__(self, group: str = MULTICAST_GROUP):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        # 同一台主机上的客户端要绑定同一个端口接收组播，所有绑定该端口的socket都必须设置SO_REUSEADDR
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('', 0))
+        self.address = (group, self.socket.getsockname()[1])
+        self._LOCK = Lock()
+        self._recent = deque(maxlen=RESEND_WINDOW)  # 最近几轮的RoundResult，轮次连续递增
+        self._EXIT = Event()
+
+    @staticmethod
+    def fits(client_number: int) -> bool:
+        """
+        client_number个玩家的结果帧能否放进一个UDP报文。
+        """
+        return _FRAME_HEADER.size + _BIN_S_INPUT.size + 12 * client_number <= _MAX_DATAGRAM
+
+    def start(self):
+        T_multicast_heartbeat = Thread(target=self._heartbeat)
+        T_multicast_heartbeat.setDaemon(True)
+        T_multicast_heartbeat.start()
+
+    def send(self, result: 'RoundResult') -> int:
+        """
+        组播一轮结果，返回发送的字节数。
+        """
+        with self._LOCK:
+            self._recent.append(result)
+        frame = result.frame(CODEC_BINARY)
+        self.socket.sendto(frame, self.address)
+        return len(frame)
+
+    def lookup(self, round_: int) -> 'RoundResult':
+        """
+        查找round_轮的结果，已经不在补发窗口中时返回None。
+        """
+        with self._LOCK:
+            if not self._recent:
+                return None
+            index = round_ - self._recent[0].round
+            return self._recent[index] if 0 <= index < len(self._recent) else None
+
+    def _heartbeat(self):
+        while not self._EXIT.wait(MULTICAST_HEARTBEAT):
+            with self._LOCK:
+                latest = self._recent[-1].round if self._recent else None
+            if latest is None:
+                continue
+            try:
+                self.socket.sendto(_encode_frame(CMD.S_LATEST, {'ROUND': latest}), self.address)
+            except OSError:
+                break
+
+    def close(self):
+        self._EXIT.set()
+        self.socket.close()
 
 
 def _handle_message(data: dict, target_socket: socket.socket = None):
@@ -75,39 +523,69 @@ class Server:
     启动方式：server.listen(target_port)
     """
 
-    def __init__(self, client_number: int):
+    def __init__(self, client_number: int, input_deadline: float = None, quorum: int = 1, multicast: bool = False,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT):
+        """
+        input_deadline, quorum: 每轮的输入截止时间（秒）和法定人数，见RoundBarrier。input_deadline为None时等待所有玩家。
+        multicast: 向支持组播的客户端用UDP组播发送结果（见MulticastSender），其余客户端仍然走TCP。
+        heartbeat_timeout: 发送心跳的客户端沉默多少秒后被清理，None表示不检测（不要求客户端发送心跳）。
+        """
         self._CLIENT_NUMBER = client_number
-        self._processed_client_number = 0
-        self._CLIENT_CONNECTION_SEMAPHORE = Semaphore(self._CLIENT_NUMBER)  # 限流
-        self._ip = get_lan_ip()  # type: str
+        self._ip = None  # type: str  # listen时确定
         self._port = None
         self.server_socket = None
-        self._conn_pool = dict.fromkeys(range(self._CLIENT_NUMBER))
+        # 连接表：每个玩家ID的连接、会话令牌和状态。断线后在RECONNECT_GRACE秒内凭令牌重连可以拿回原来的ID
+        self._SESSION_LOCK = RLock()
+        self.connections = ConnectionTable.ConnectionTable(self._CLIENT_NUMBER)
+        # 每个玩家ID的截止时刻（心跳超时或重连保留期结束）都放在同一个时间轮中，在_SESSION_LOCK内访问
+        self._HEARTBEAT_TIMEOUT = heartbeat_timeout
+        self._deadlines = TimingWheel.TimingWheel(DEADLINE_TICK)
+        self._SERVER_CLOSED = Event()
+        T_check_deadlines = Thread(target=self._deadline_checker)
+        T_check_deadlines.setDaemon(True)
+        T_check_deadlines.start()
 
         self._CLIENT_WRITE_LOCK = RLock()
-        self._GAME_READ_INPUTS_EVENT = Event()
-        self._SERVER_READ_RESULT_EVENT = Event()
+        self.barrier = RoundBarrier.RoundBarrier(client_number, input_deadline, quorum)  # 按轮次收集玩家输入
+        self._ROUND_RESULT_CONDITION = Condition(self._CLIENT_WRITE_LOCK)
+        self._result_round = 0  # 已经发出结果的轮数。按轮次等待结果，快客户端的下一轮输入不会读到本轮的旧结果
+        self._result_time = None  # 本轮结果交给各客户端线程发送的时刻
+        self._sent_client_number = 0  # 本轮已经发完结果的客户端数
+        self._present_client_number = client_number  # 本轮按时提交了输入、需要通过TCP发送结果的客户端数
+        self._absent_ids = []
+        # 运行指标，只统计C_INPUT/S_INPUT/S_DELTA，不含握手
+        self.metrics = Metrics.Registry()
         # 缓存的临时数据
-        self._player_inputs = list(range(self._CLIENT_NUMBER))
-        self._t_g_value = -50.0
-        self._t_scores = []
+        self._closed_round = None  # GameBoard正在计算的轮次
+        self._player_inputs = None
+        self._t_result = None  # type: RoundResult
         self._t_play_again = True
+        # 组播
+        self._multicast = None  # type: MulticastSender
+        self._multicast_ids = set()  # 通过组播接收结果的玩家ID
+        self._spectators = None  # type: Spectators.SpectatorHub  # 第一个观战者到来时创建
+        if multicast:
+            if MulticastSender.fits(client_number):
+                self._multicast = MulticastSender()
+                self._multicast.start()
+            else:
+                print(f'S-INFO: Results of {client_number} players do not fit in one datagram, multicast disabled.')
 
-    def listen(self, target_port: int):
-        """listen(target_port) -> (server_ip, listened_port)
+    def listen(self, target_port: int, ip_: str = None, fallback: bool = True):
+        """listen(target_port, ip_=None, fallback=True) -> (server_ip, listened_port)
 
         该函数用于启动服务器。
 
-        输入想要服务器监听的端口；返回服务器局域网ip和服务器最终监听的端口。
+        输入想要服务器监听的端口；返回服务器ip和服务器最终监听的端口。target_port为0时由系统分配端口。
+        ip_为None时监听局域网IP（需要查询一次路由），无界面服务器可以直接指定，如'0.0.0.0'。
+        fallback为True时端口被占用就换下一个端口，否则抛出OSError。
         """
-        self._port = target_port
-        while port_is_occupied(self._ip, self._port):
-            self._port += 1  # 如果端口被占用，就换一个端口
+        self._ip = get_lan_ip() if ip_ is None else ip_
         if self.server_socket is not None:
             self.server_socket.close()
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind((self._ip, self._port))
-        self.server_socket.listen(3)  # 最大等待数（有很多人理解为最大连接数，其实是错误的）
+        self.server_socket = bind_socket(self._ip, target_port, fallback)
+        self._port = self.server_socket.getsockname()[1]
+        self.server_socket.listen(LISTEN_BACKLOG)  # 最大等待数（有很多人理解为最大连接数，其实是错误的）
         T_accept_client = Thread(target=self._client_acceptor)
         T_accept_client.setDaemon(True)
         T_accept_client.start()
@@ -123,92 +601,343 @@ class Server:
                 client, addr = self.server_socket.accept()  # 阻塞，等待客户端连接
             except OSError:
                 break
-            self._CLIENT_CONNECTION_SEMAPHORE.acquire()
-            client_id = None
-            # todo: self.conn_pool是关键资源！理论上不会出现找不到 None的情况，但实际上可能会有。
-            for available_id, _ in self._conn_pool.items():  # 查找连接池中有无可用ID
-                if _ is None:
-                    self._conn_pool[available_id] = client
-                    client_id = available_id
-                    break
-            print(f'S-INFO: Accept a new client ID{client_id}-{addr[0]}:{addr[1]}')
-            # 给每个客户端创建一个独立的线程进行管理
-            T_handle_client = Thread(target=self._client_handler, args=(client, client_id))
-            T_handle_client.setDaemon(True)
-            T_handle_client.start()
+            self._register_client(client, addr)
+
+    def attach_client(self, client: socket.socket, join_msg: dict, addr=None):
+        """
+        接管一个已经发送过C_JOIN的连接（由RoomManager转交），不需要本服务器监听端口。
+        addr为客户端地址，不给出时从连接读取（客户端已断开时抛出OSError）。
+
+        房间已满时（且不是重连）回复ID=-1并关闭连接。
+        """
+        self._register_client(client, client.getpeername() if addr is None else addr, join_msg)
+
+    def _register_client(self, client: socket.socket, addr, join_msg: dict = None):
+        print(f'S-INFO: Accept a new client {addr[0]}:{addr[1]}')
+        # 给每个客户端创建一个独立的线程进行管理，握手后才分配ID（重连的客户端拿回原来的ID）
+        T_handle_client = Thread(target=self._client_handler, args=(client, join_msg))
+        T_handle_client.setDaemon(True)
+        T_handle_client.start()
+
+    def _claim_session(self, client: socket.socket, token):
+        """_claim_session(client, token) -> (client_id, token, resumed)
+
+        令牌有效时拿回原来的ID，否则分配一个新ID和新令牌；房间已满时client_id为None。
+        """
+        with self._SESSION_LOCK:
+            client_id = self.connections.lookup(token)
+            if client_id is not None:
+                old_client = self.connections.conns[client_id]  # 服务器可能还没发现旧连接已经断了
+                self.connections.conns[client_id] = client
+                self.connections.last_seen[client_id] = time.monotonic()
+                if old_client is not None:  # 旧连接的线程会读到错误并退出
+                    _close_now(old_client)
+                return client_id, token, True
+            client_id, token = self.connections.allocate(client)  # 从空闲栈中取，O(1)
+            if client_id is not None:
+                self.barrier.join(client_id)
+            return client_id, token, False
+
+    def player_names(self) -> list:
+        """
+        每个玩家ID当前的名字，匿名或空闲的ID为None。
+        """
+        with self._SESSION_LOCK:
+            return list(self.connections.names)
+
+    def _client_dropped(self, client_id: int, client: socket.socket):
+        """
+        游戏进行中连接断开：保留玩家ID和令牌RECONNECT_GRACE秒，到期后才释放。
+        """
+        client.close()
+        with self._SESSION_LOCK:
+            if self.connections.conns[client_id] is not client:  # 已经重连了，这是旧连接
+                return
+            self.connections.conns[client_id] = None
+            self.connections.last_seen[client_id] = time.monotonic()
+            self._watch(client_id)
+        print(f'S-INFO: Client {client_id} disconnected, waiting {RECONNECT_GRACE}s for reconnect.')
+
+    def _deadline_of(self, client_id: int):
+        """
+        玩家ID当前的截止时刻：等待重连的到保留期结束，发送心跳的到心跳超时，其余没有截止时刻（None）。
+        处理线程在等待本轮结果时读不到心跳，视为在线，截止时刻从现在顺延，等待结束后从那时重新计时。
+        在_SESSION_LOCK内调用。
+        """
+        table = self.connections
+        if client_id not in table:
+            return None
+        if table.conns[client_id] is None:
+            return table.last_seen[client_id] + RECONNECT_GRACE
+        if table.heartbeat[client_id] and self._HEARTBEAT_TIMEOUT is not None:
+            if table.waiting[client_id]:
+                return time.monotonic() + self._HEARTBEAT_TIMEOUT
+            return table.last_seen[client_id] + self._HEARTBEAT_TIMEOUT
+        return None
+
+    def _watch(self, client_id: int):
+        """
+        按玩家当前的状态把它放进时间轮（或移出）。在_SESSION_LOCK内调用。
+        """
+        deadline = self._deadline_of(client_id)
+        if deadline is None:
+            self._deadlines.cancel(client_id)
+        else:
+            self._deadlines.schedule(client_id, deadline)
+
+    def _deadline_checker(self):
+        """
+        每DEADLINE_TICK秒推进一次时间轮。收到消息时只更新ConnectionTable.last_seen，不移动时间轮中的位置；
+        到期时重新计算截止时刻，期间有过消息的顺延，真正到期的通过_client_cleaner清理。
+        """
+        while not self._SERVER_CLOSED.wait(DEADLINE_TICK):
+            now = time.monotonic()
+            with self._SESSION_LOCK:
+                for client_id in self._deadlines.advance(now):
+                    deadline = self._deadline_of(client_id)
+                    if deadline is None:
+                        continue
+                    if deadline > now:
+                        self._deadlines.schedule(client_id, deadline)
+                        continue
+                    client = self.connections.conns[client_id]
+                    if client is not None:  # 阻塞在recv上的客户端线程会读到错误并退出
+                        print(f'S-INFO: Client {client_id} sent nothing for {self._HEARTBEAT_TIMEOUT}s, '
+                              f'considered dead.')
+                        self.metrics.inc('heartbeat_timeouts', 1, client_id)
+                        _close_now(client)
+                    self._client_cleaner(client_id)
 
     def _client_cleaner(self, client_id: int):
-        # todo: 可能会有KeyError
-        client = self._conn_pool[client_id]
+        with self._SESSION_LOCK:
+            client, token = self.connections.release(client_id)
+            self._multicast_ids.discard(client_id)
+            self._deadlines.cancel(client_id)
         if client is not None:
             client.close()
-            self._conn_pool[client_id] = None
+        if token is not None:
+            self.barrier.leave(client_id)  # 之后的轮次不再等待该玩家
             print(f"S-INFO: Client {client_id} offline.")
-            self._CLIENT_CONNECTION_SEMAPHORE.release()
 
     def server_exit(self):
-        for _ in self._conn_pool:
-            self._client_cleaner(_)
-        self.server_socket.close()
+        self._SERVER_CLOSED.set()
+        with self._SESSION_LOCK:
+            occupied = self.connections.ids()  # 只遍历占用的ID
+        for client_id in occupied:
+            self._client_cleaner(client_id)
+        if self.server_socket is not None:
+            self.server_socket.close()
+        if self._multicast is not None:
+            self._multicast.close()
+        if self._spectators is not None:
+            self._spectators.close()
+
+    def _add_spectator(self, client: socket.socket, msg: dict):
+        """
+        观战者不占用玩家ID，交给SpectatorHub统一发送结果。
+        """
+        codec = negotiate_codec(msg['DATA'].get('CODECS'))
+        compress = negotiate_compression(msg['DATA'].get('COMPRESS'))
+        greeting = _encode_frame(CMD.S_SPECTATE, {'OK': True, 'CODEC': codec, 'ROUND': self.barrier.round,
+                                                  'COMPRESS': compression_name(compress)})
+        codec |= compress
+        with self._ROUND_RESULT_CONDITION:  # 与send_result互斥，新建的hub不会漏掉最新一轮
+            if self._spectators is None:
+                self._spectators = Spectators.SpectatorHub(self.metrics)
+                if self._t_result is not None:
+                    self._spectators.publish(self._t_result)
+            self._spectators.add(client, codec, greeting)
 
-    def _client_handler(self, client: socket.socket, client_id: int):
+    def _snapshot(self) -> dict:
         """
-        处理客户端消息。
+        重连时发给客户端的快照：下一轮的轮次和最近一轮的结果（输入、G值、累计分数），不含更早的历史。
+        """
+        with self._ROUND_RESULT_CONDITION:
+            result = self._t_result
+        if result is None:
+            return {'ROUND': self.barrier.round}
+        return {'ROUND': self.barrier.round, 'RESULT_ROUND': result.round, 'INPUTS': result.inputs,
+                'G': result.g_value, 'SCORE': result.scores, 'AGAIN': result.play_again}
+
+    def _client_handler(self, client: socket.socket, join_msg: dict = None):
+        """
+        处理客户端消息。join_msg不为None时说明C_JOIN已经被RoomManager读取过了。
         """
         # 第一次握手
+        client_id = None
         try:
-            msg = _recv_data(client)
+            msg = _recv_data(client, compressed=False) if join_msg is None else join_msg
+            if CMD.C_SPECTATE == msg['CMD']:
+                self._add_spectator(client, msg)
+                return
             assert CMD.C_JOIN == msg['CMD']
-            # 向客户端返回注册的ID
-            _send_data(client, CMD.S_JOIN, ID=client_id)
-        except (json.decoder.JSONDecodeError, KeyError, AssertionError) as e:  # 不是从合法客户端发来的消息
+            codec = negotiate_codec(msg['DATA'].get('CODECS'))
+            compress = negotiate_compression(msg['DATA'].get('COMPRESS'))
+            delta = bool(msg['DATA'].get('DELTA'))
+            client_id, token, resumed = self._claim_session(client, msg['DATA'].get('TOKEN'))
+            if client_id is None:  # 房间已满
+                _send_data(client, CMD.S_JOIN)
+                client.close()
+                return
+            next_round = self.barrier.round  # 该客户端的第一个输入属于哪一轮
+            multicast = self._multicast is not None and bool(msg['DATA'].get('MULTICAST'))
+            heartbeat = self._HEARTBEAT_TIMEOUT is not None and bool(msg['DATA'].get('HEARTBEAT'))
+            with self._SESSION_LOCK:
+                if multicast:
+                    self._multicast_ids.add(client_id)
+                else:
+                    self._multicast_ids.discard(client_id)
+                self.connections.heartbeat[client_id] = heartbeat
+                self.connections.names[client_id] = player_name(msg['DATA'].get('NAME'))
+                self._watch(client_id)
+            # 向客户端返回注册的ID、协商好的编码、当前轮次和会话令牌
+            _send_data(client, CMD.S_JOIN, ID=client_id, CODEC=codec, DELTA=delta, ROUND=next_round, TOKEN=token,
+                       MULTICAST=list(self._multicast.address) if multicast else None,
+                       COMPRESS=compression_name(compress),
+                       HEARTBEAT=self._HEARTBEAT_TIMEOUT / HEARTBEAT_MISSES if heartbeat else None)
+            codec |= compress  # 之后发给该客户端的结果和快照都可以压缩
+            delivered = None  # 最近一次发给该客户端的结果轮次。客户端持有上一轮的分数表时可以只发送变化的分数
+            if resumed:
+                snapshot = self._snapshot()
+                _send_data(client, CMD.S_SNAPSHOT, codec, **snapshot)
+                delivered = snapshot.get('RESULT_ROUND')
+                print(f'S-INFO: Client {client_id} reconnected at round {next_round}.')
+        except (ValueError, struct.error, KeyError, AssertionError, OSError) as e:  # 不是从合法客户端发来的消息
             print(f'S-INFO: First handshake with Client {client_id} failed. \n\t\tError reported as ', repr(e))
-            self._client_cleaner(client_id)
+            if client_id is None:
+                client.close()
+            else:
+                self._client_dropped(client_id, client)
             return
         # 后续通讯
+        reader = FrameReader(client, compressed=False)
         while True:
             try:
                 if not self._t_play_again:
                     break
-                msg = _recv_data(client)
+                msg, size = reader.recv()
+                self.connections.touch(client_id, size)
+                self.metrics.inc('bytes_in', size, client_id)
+                self.metrics.inc('messages_in', 1, client_id)
+                if CMD.C_HEARTBEAT == msg['CMD']:  # 只需要更新last_seen
+                    continue
+                if CMD.C_RESEND == msg['CMD']:
+                    self._resend_results(client, client_id, codec, msg['DATA']['ROUNDS'])
+                    continue
                 assert CMD.C_INPUT == msg['CMD']
-                self._handle_client_input(msg['DATA'], client)
+                round_ = msg['DATA'].get('ROUND')
+                if round_ is None:  # 旧客户端不带轮次，视为它应该提交的那一轮
+                    round_ = next_round
+                status = self._handle_client_input(msg['DATA'], client_id, round_)
+                if multicast or status == RoundBarrier.EARLY:
+                    continue  # 结果通过组播发送；错误的输入直接丢弃
+                # 迟到的输入也要回复，客户端正在等待结果，它收到的结果中自己的输入为缺席；
+                # 重复的输入通常是重连后重发的，之前的连接已经断了，同样要回复
+                self.connections.waiting[client_id] = 1
+                try:
+                    result = self._wait_result(round_)
+                finally:
+                    self.connections.last_seen[client_id] = time.monotonic()  # 心跳超时从结果到达时重新计算
+                    self.connections.waiting[client_id] = 0
+                frame = result.frame(codec, delta and delivered == result.round - 1)
+                client.sendall(frame)  # 向客户端返回本轮游戏结果，所有客户端共享同一份编码
+                self.connections.sent(client_id, len(frame))
+                self.metrics.inc('bytes_out', len(frame), client_id)
+                self.metrics.inc('messages_out', 1, client_id)
+                if status == RoundBarrier.ACCEPTED and result.round == round_:
+                    self._result_sent(result)
+                delivered = result.round
+                next_round = delivered + 1
             except AssertionError:  # 客户端发来的命令未在CMD中枚举
                 print(f'S-EXCEPTION: Unable to parse command "{msg["CMD"]}" from Client {client_id}.')
-            except ConnectionResetError:  # 客户端主动断开链接
-                # todo: 怎样实现客户端重连？
+            except (ValueError, struct.error, KeyError) as e:  # 无法解码的帧，之后的字节流已经不可信
+                print(f'S-EXCEPTION: Malformed frame from Client {client_id}.\n\t\tError reported as ', repr(e))
+                self._client_dropped(client_id, client)
+                break
+            except OSError:  # 客户端断开链接（包括ConnectionResetError），保留ID等待重连
                 print(f'S-EXCEPTION: Client {client_id} forcibly closed an existing connection.')
-                self._client_cleaner(client_id)
+                self._client_dropped(client_id, client)
                 break
 
     def get_player_inputs(self):
-        self._GAME_READ_INPUTS_EVENT.wait()  # GameBoard等待所有玩家都上传输入。
-        self._GAME_READ_INPUTS_EVENT.clear()  # GameBoard已完成读玩家输入。
+        """
+        阻塞至本轮结束（所有玩家都上传了输入，或者到了截止时间），缺席玩家的输入为Scoring.ABSENT。
+        """
+        self._closed_round, self._player_inputs, absent = self.barrier.wait_inputs()
+        self._absent_ids = absent
+        self.metrics.set('last_arrival', self.barrier.last_arrival)  # 本轮最后一个提交输入的客户端
+        self.metrics.inc('last_arrivals', 1, self.barrier.last_arrival)
+        if absent:
+            self.metrics.inc('absent_inputs', len(absent))
+            print(f'S-INFO: Round {self._closed_round} closed without Client {absent}.')
         return self._player_inputs
 
     def send_result(self, g_value: float, scores: list, play_again: bool):
-        self._t_g_value = g_value
-        self._t_scores = scores
-        self._t_play_again = play_again
-        self._SERVER_READ_RESULT_EVENT.set()  # Server可以开始发送本轮结果了
+        begin = time.perf_counter()
+        last_scores = self._t_result.scores if self._t_result is not None else None
+        result = RoundResult(self._player_inputs, g_value, scores, play_again, last_scores, self._closed_round)
+        if self._multicast is not None:  # 先组播，TCP客户端随后由各自的线程发送
+            self.metrics.inc('multicast_bytes_out', self._multicast.send(result))
+            self.metrics.inc('multicast_messages_out')
+        with self._ROUND_RESULT_CONDITION:
+            self._t_result = result
+            if self._spectators is not None:  # 只是放进环形缓冲区，不会被观战者阻塞
+                self._spectators.publish(result)
+            self._t_play_again = play_again
+            self._result_time = begin
+            self._sent_client_number = 0
+            with self._SESSION_LOCK:
+                multicast_present = len(self._multicast_ids.difference(self._absent_ids))
+            self._present_client_number = self._CLIENT_NUMBER - len(self._absent_ids) - multicast_present
+            if not self._present_client_number:  # 所有人都通过组播接收
+                self.metrics.observe('round_broadcast_seconds', time.perf_counter() - begin)
+            self._result_round = self._closed_round + 1
+            self._ROUND_RESULT_CONDITION.notify_all()  # Server可以开始发送本轮结果了
+
+    def _resend_results(self, client: socket.socket, client_id: int, codec: int, rounds: list):
+        """
+        补发组播中丢失的结果。已经不在补发窗口中的轮次被忽略，客户端会跳过它们。
+        """
+        for round_ in rounds:
+            result = self._multicast.lookup(round_) if self._multicast is not None else None
+            if result is None:
+                continue
+            frame = result.frame(codec)
+            client.sendall(frame)
+            self.connections.sent(client_id, len(frame))
+            self.metrics.inc('bytes_out', len(frame), client_id)
+            self.metrics.inc('messages_out', 1, client_id)
+            self.metrics.inc('resent_results', 1, client_id)
 
-    def _handle_client_input(self, data, client):
-        client_id = data['ID']  # type: int
-        player_input = data['VALUE']  # type: float
-        with self._CLIENT_WRITE_LOCK:
-            self._player_inputs[client_id] = player_input
-            self._processed_client_number += 1
-            if self._processed_client_number == self._CLIENT_NUMBER:  # 判断是否处理完了所有客户端
-                self._GAME_READ_INPUTS_EVENT.set()  # GameBoard可以开始读玩家输入了
+    def _handle_client_input(self, data, client_id: int, round_: int) -> str:
+        """
+        把输入交给RoundBarrier，返回RoundBarrier.ACCEPTED/LATE/DUPLICATE/EARLY。
+        玩家ID以连接为准，不信任消息中的ID。
+        """
+        status = self.barrier.submit(round_, client_id, data['VALUE'])
+        if status == RoundBarrier.ACCEPTED:
+            self.connections.submitted(client_id, round_)
+        else:
+            print(f'S-EXCEPTION: Reject {status} input of round {round_} from Client {client_id}.')
+            self.metrics.inc(f'{status}_inputs', 1, client_id)
+        return status
 
-        self._SERVER_READ_RESULT_EVENT.wait()  # 等待GameBoard计算结果，调用server_can_read_result(g_value, scores):
-        _send_data(client, CMD.S_INPUT, INPUTS=self._player_inputs, G=self._t_g_value,
-                   SCORE=self._t_scores, AGAIN=self._t_play_again)  # 向客户端返回本轮游戏结果
+    def _wait_result(self, round_: int) -> RoundResult:
+        """
+        等待GameBoard算出round_轮的结果，返回最新的结果（迟到很久的客户端直接拿到最新一轮）。
+        """
+        with self._ROUND_RESULT_CONDITION:
+            while self._result_round <= round_:
+                self._ROUND_RESULT_CONDITION.wait()
+            return self._t_result
 
-        with self._CLIENT_WRITE_LOCK:
-            self._processed_client_number -= 1
-            if self._processed_client_number == 0:  # 判断是否处理完了所有客户端
-                self._SERVER_READ_RESULT_EVENT.clear()  # Server已完成结果发送工作
+    def _result_sent(self, result: RoundResult):
+        with self._ROUND_RESULT_CONDITION:
+            if result is not self._t_result:
+                return
+            self._sent_client_number += 1
+            if self._sent_client_number == self._present_client_number:  # 最后一个到场的客户端也发完了
+                self.metrics.observe('round_broadcast_seconds', time.perf_counter() - self._result_time)
 
 
 class Client:
@@ -218,30 +947,61 @@ class Client:
     启动方式：Client.connect(server_ip, server_port)
     """
 
-    def __init__(self):
+    def __init__(self, delta: bool = True, reconnect: bool = True, multicast: bool = False, compress: bool = True,
+                 name: str = None):
+        """
+        delta: 是否请求增量结果（只接收变化的分数）。
+        reconnect: 连接断开时是否凭会话令牌自动重连。
+        multicast: 服务器开启组播时通过组播接收结果。需要所在网络允许组播。
+        compress: 是否接受压缩的结果。局域网带宽充足、玩家很少时可以关闭，省去解压的开销。
+        name: 玩家名字，服务器保存战绩时用来跨对局识别玩家；None表示匿名。
+        """
         self.server_socket = None
         self.client_id = None
+        self._codec = CODEC_JSON
+        self._delta = delta
+        self._compressions = list(SUPPORTED_COMPRESSIONS) if compress else []
+        self._name = name
+        self._reconnect_enabled = reconnect
+        self._round = 0  # 下一个输入属于哪一轮
+        self._server_addr = None
+        self._room = None
+        self._token = None  # S_JOIN返回的会话令牌
+        self._pending = None  # 已发送、还没收到结果的输入(轮次, 值)，重连后重发
+        self._SEND_LOCK = Lock()  # 重连时会替换server_socket
+        self._multicast_wanted = multicast
+        self._multicast_socket = None
+        self._multicast_port = None  # 服务器组播的源端口，用于过滤其他服务器的组播
+        self._RESULT_LOCK = RLock()  # 组播和TCP（补发）两个线程都会交付结果
+        self._reorder = {}  # 轮次 -> 提前到达的结果，等缺失的轮次补齐后按顺序交付
+        self._heartbeat_interval = None  # S_JOIN要求的心跳间隔（秒），None表示服务器不检测
+        self._last_sent = time.monotonic()  # 最近一次发送消息的时刻，沉默超过心跳间隔才发送心跳
 
         self._GAME_READ_PLAYER_ID = Event()
         self._GAME_READ_RESULT = Event()
+        self._subscribers = []  # 每收到一轮结果都会调用的回调
 
         self._player_inputs = None
         self._t_g_value = None
         self._t_scores = None
         self._t_play_again = True
 
-    def connect(self, server_ip: str, server_port: int):
+    def connect(self, server_ip: str, server_port: int, room=None):
+        """
+        room: RoomManager托管的房间ID；直接连接GameBoard的服务器时为None。
+        """
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # 第一次握手
         try:
             self.server_socket.connect((server_ip, server_port))  # 尝试连接server
-            _send_data(self.server_socket, CMD.C_JOIN)
-            msg = _recv_data(self.server_socket)
-            assert CMD.S_JOIN == msg['CMD']
-            self.client_id = msg['DATA']['ID']
+            msg = self._join(self.server_socket, room)
+            self.client_id = msg['DATA'].get('ID')  # 观战者没有ID
+            self._round = msg['DATA'].get('ROUND', 0)
+            self._server_addr = (server_ip, server_port)
+            self._room = room
             self._GAME_READ_PLAYER_ID.set()
-        except (socket.gaierror, TypeError, ConnectionRefusedError,  # 连接时出错
-                json.decoder.JSONDecodeError, KeyError, AssertionError) as e:  # 通信时出错，连上了错误的主机
+        except (socket.gaierror, TypeError, ConnectionRefusedError, ConnectionResetError,  # 连接时出错
+                ValueError, struct.error, KeyError, AssertionError) as e:  # 通信时出错，连上了错误的主机
             # todo: delete this
             print('\t\tError reported as ', repr(e))
             self.server_socket.close()
@@ -249,33 +1009,236 @@ class Client:
         T_handle_server = Thread(target=self._server_handler)
         T_handle_server.setDaemon(True)
         T_handle_server.start()
+        if self._heartbeat_interval:
+            T_heartbeat = Thread(target=self._heartbeat)
+            T_heartbeat.setDaemon(True)
+            T_heartbeat.start()
+
+    def _join(self, server_socket: socket.socket, room, token: str = None) -> dict:
+        """
+        发送C_JOIN并读取S_JOIN，返回S_JOIN消息。
+        """
+        _send_data(server_socket, CMD.C_JOIN, CODECS=list(SUPPORTED_CODECS), DELTA=self._delta, ROOM=room,
+                   TOKEN=token, MULTICAST=self._multicast_wanted, COMPRESS=self._compressions, HEARTBEAT=True,
+                   NAME=self._name)
+        msg = _recv_data(server_socket)
+        assert CMD.S_JOIN == msg['CMD']
+        assert msg['DATA']['ID'] >= 0  # 房间不存在或已满
+        self._codec = msg['DATA'].get('CODEC', CODEC_JSON)  # 旧服务器不返回CODEC
+        self._token = msg['DATA'].get('TOKEN')  # 旧服务器不支持重连
+        self._heartbeat_interval = msg['DATA'].get('HEARTBEAT')  # 旧服务器不检测心跳
+        if msg['DATA'].get('MULTICAST') and self._multicast_socket is None:
+            self._join_multicast(*msg['DATA']['MULTICAST'])
+        return msg
+
+    def _join_multicast(self, group: str, port: int):
+        self._multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # 同一台主机上的多个客户端
+        self._multicast_socket.bind(('', port))
+        self._multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                          socket.inet_aton(group) + socket.inet_aton('0.0.0.0'))
+        self._multicast_socket.settimeout(1)  # 游戏结束后不再有组播，定期检查是否该退出
+        self._multicast_port = port
+        T_handle_multicast = Thread(target=self._multicast_handler)
+        T_handle_multicast.setDaemon(True)
+        T_handle_multicast.start()
+
+    def _reconnect(self) -> bool:
+        """
+        凭会话令牌重连，RECONNECT_TIMEOUT秒内不断重试。成功后按快照恢复状态，并重发还没有收到结果的输入。
+        """
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        delay = 0.05
+        while time.monotonic() < deadline:
+            new_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            new_socket.settimeout(1)  # 服务器没有响应时尽快重试
+            try:
+                new_socket.connect(self._server_addr)
+                msg = self._join(new_socket, self._room, self._token)
+                assert msg['DATA']['ID'] == self.client_id
+                snapshot = _recv_data(new_socket)
+                assert CMD.S_SNAPSHOT == snapshot['CMD']
+                new_socket.settimeout(None)
+            except (OSError, ValueError, struct.error, KeyError, AssertionError):
+                new_socket.close()
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                continue
+            snapshot = snapshot['DATA']
+            result_round = snapshot.get('RESULT_ROUND')
+            with self._SEND_LOCK, self._RESULT_LOCK:
+                self.server_socket.close()
+                self.server_socket = new_socket
+                if result_round is not None:  # 之后的增量结果以快照中的分数为基础
+                    self._t_scores = snapshot['SCORE']
+                    self._t_g_value = snapshot['G']
+                    self._t_play_again = snapshot['AGAIN']
+                if self._pending is None:
+                    self._round = snapshot['ROUND']
+                elif result_round is not None and self._pending[0] <= result_round:
+                    # 等待的结果在断线期间已经发出，快照中就是该轮（或之后最新一轮）的结果
+                    self._pending = None
+                    self._round = result_round + 1
+                    self._reorder = {round_: msg for round_, msg in self._reorder.items() if round_ > result_round}
+                    self._player_inputs = snapshot['INPUTS']
+                    self._GAME_READ_RESULT.set()
+                    self._notify_subscribers()
+                else:  # 该轮还没结束，重发输入（服务器已收到时按重复输入处理，结果照常发送）
+                    round_, value = self._pending
+                    _send_input(new_socket, self._codec, self.client_id, value, round_)
+            print(f'C-INFO: Reconnected to server at round {snapshot["ROUND"]}.')
+            return True
+        return False
 
     def _server_handler(self):
         # 后续通讯
+        reader = None  # type: FrameReader
         while True:
             try:
                 if not self._t_play_again:  # server发来消息，正常退出
                     self.server_socket.close()
                     break
-                msg = _recv_data(self.server_socket)
-                assert CMD.S_INPUT == msg['CMD']
-                self._player_inputs = msg['DATA']['INPUTS']
-                self._t_g_value = msg['DATA']['G']
-                self._t_scores = msg['DATA']['SCORE']
-                self._t_play_again = msg['DATA']['AGAIN']
-                self._GAME_READ_RESULT.set()
+                if reader is None or reader.sock is not self.server_socket:  # 重连后换了socket
+                    reader = FrameReader(self.server_socket)
+                msg, _ = reader.recv()
+                if self._multicast_port is not None:  # TCP上只会收到补发的结果
+                    self._accept_result(msg)
+                else:
+                    self._apply_result(msg)
             except AssertionError:  # 发来的命令未在CMD.exec中枚举
                 print('C-EXCEPTION: Unable to parse command "{msg["CMD"]}".')
-            except ConnectionResetError:  # 服务器异常退出，主线程无法感知
+            except (OSError, ValueError, struct.error):  # 连接断开（包括ConnectionResetError）或帧无法解码，主线程无法感知
+                if not self._t_play_again:  # 最后一轮的结果已经从组播收到了
+                    self.server_socket.close()
+                    break
                 print('C-EXCEPTION: Server forcibly closed an existing connection.')
+                if self._reconnect_enabled and self._token is not None and self._reconnect():
+                    continue
                 self._t_play_again = False
                 self._t_g_value = -1  # 表示一个异常
                 self._GAME_READ_RESULT.set()
+                self._notify_subscribers()
                 self.server_socket.close()
                 break
 
+    def _apply_result(self, msg: dict):
+        """
+        交付一轮结果：更新状态，唤醒get_round_result，通知订阅者。
+        """
+        if CMD.S_DELTA == msg['CMD']:  # 在上一轮分数表的基础上更新变化的分数
+            scores = list(self._t_scores)
+            for id_, score in zip(msg['DATA']['IDX'], msg['DATA']['SCORE']):
+                scores[id_] = score
+        else:
+            assert CMD.S_INPUT == msg['CMD']
+            scores = msg['DATA']['SCORE']
+        self._round = msg['DATA'].get('ROUND', self._round - 1) + 1
+        self._pending = None
+        self._player_inputs = msg['DATA']['INPUTS']
+        self._t_g_value = msg['DATA']['G']
+        self._t_scores = scores
+        self._t_play_again = msg['DATA']['AGAIN']
+        self._GAME_READ_RESULT.set()
+        self._notify_subscribers()
+
+    def _accept_result(self, msg: dict):
+        """
+        组播模式下按轮次顺序交付结果：重复的丢弃，提前到达的暂存，发现缺失的轮次就向服务器补要。
+        """
+        assert CMD.S_INPUT == msg['CMD']
+        with self._RESULT_LOCK:
+            round_ = msg['DATA']['ROUND']
+            if round_ < self._round or round_ in self._reorder:
+                return
+            self._reorder[round_] = msg
+            while self._round in self._reorder:
+                self._apply_result(self._reorder.pop(self._round))
+            missing = [r for r in range(self._round, max(self._reorder, default=self._round)) if r not in self._reorder]
+        if missing:
+            self._request_resend(missing)
+
+    def _on_latest(self, latest: int):
+        """
+        收到组播心跳：服务器已经发出了latest轮的结果。
+        """
+        with self._RESULT_LOCK:
+            if latest - self._round >= RESEND_WINDOW:  # 落后太多，更早的轮次服务器已经不保留了，直接跳过
+                self._round = latest - RESEND_WINDOW + 1
+                self._reorder = {round_: msg for round_, msg in self._reorder.items() if round_ >= self._round}
+                while self._round in self._reorder:
+                    self._apply_result(self._reorder.pop(self._round))
+            missing = [r for r in range(self._round, latest + 1) if r not in self._reorder]
+        if missing:
+            self._request_resend(missing)
+
+    def _request_resend(self, rounds: list):
+        with self._SEND_LOCK:
+            self._last_sent = time.monotonic()
+            try:
+                _send_data(self.server_socket, CMD.C_RESEND, ROUNDS=rounds)
+            except OSError:  # 连接断了，重连后由组播心跳再次发现缺失的轮次
+                pass
+
+    def _heartbeat(self):
+        """
+        沉默超过心跳间隔时发送C_HEARTBEAT，让服务器知道客户端还在（例如玩家迟迟没有输入时）。
+        """
+        while self._t_play_again:
+            idle = time.monotonic() - self._last_sent
+            if idle < self._heartbeat_interval:
+                time.sleep(self._heartbeat_interval - idle)
+                continue
+            with self._SEND_LOCK:
+                self._last_sent = time.monotonic()
+                try:
+                    _send_fixed(self.server_socket, CMD.C_HEARTBEAT)
+                except OSError:  # 连接断了，接收线程负责重连
+                    pass
+
+    def _multicast_handler(self):
+        buf = bytearray(_MAX_DATAGRAM)  # 每个报文都接收到同一个缓冲区
+        view = memoryview(buf)
+        while self._t_play_again:
+            try:
+                size, addr = self._multicast_socket.recvfrom_into(buf)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if addr[1] != self._multicast_port:  # 其他服务器的组播
+                continue
+            try:
+                length, codec = _FRAME_HEADER.unpack_from(buf)
+                if _FRAME_HEADER.size + length > size:
+                    raise ValueError('Truncated datagram.')
+                msg = _decode_payload(view[_FRAME_HEADER.size:_FRAME_HEADER.size + length], codec)
+                if CMD.S_LATEST == msg['CMD']:
+                    self._on_latest(msg['DATA']['ROUND'])
+                else:
+                    self._accept_result(msg)
+            except (ValueError, struct.error, KeyError, AssertionError):  # 不完整或无法识别的报文
+                continue
+        self._multicast_socket.close()
+
+    def subscribe(self, callback):
+        """
+        callback(inputs, g_value, scores, play_again)在接收线程中调用，每收到一轮结果调用一次，g_value=-1表示连接异常断开。
+        应在connect之前订阅。回调中不要做耗时操作，也不要直接操作Tk控件（可以放入队列，由界面线程取出）。
+        """
+        self._subscribers.append(callback)
+
+    def _notify_subscribers(self):
+        for callback in self._subscribers:
+            callback(self._player_inputs, self._t_g_value, self._t_scores, self._t_play_again)
+
     def send_input(self, value: float):
-        _send_data(self.server_socket, CMD.C_INPUT, ID=self.client_id, VALUE=value)
+        with self._SEND_LOCK:
+            self._pending = (self._round, value)
+            self._last_sent = time.monotonic()
+            try:
+                _send_input(self.server_socket, self._codec, self.client_id, value, self._round)
+            except OSError:  # 连接断了，接收线程重连后会重发
+                pass
 
     def get_player_id(self):
         self._GAME_READ_PLAYER_ID.wait()
@@ -298,6 +1261,30 @@ class Client:
             _send_data(self.server_socket, CMD.MESSAGE, MESSAGE=msg)
 
 
+class Spectator(Client):
+    """
+    网络层-观战者模块。只读地接收每轮结果，不能提交输入，不占用玩家名额。
+    跟不上的观战者会直接收到最新一轮的结果（分数是累计的），中间的轮次被跳过。
+
+    启动方式：Spectator.connect(server_ip, server_port)
+    """
+
+    def __init__(self, compress: bool = True):
+        super().__init__(delta=False, reconnect=False, compress=compress)
+
+    def _join(self, server_socket: socket.socket, room, token: str = None) -> dict:
+        _send_data(server_socket, CMD.C_SPECTATE, CODECS=list(SUPPORTED_CODECS), ROOM=room,
+                   COMPRESS=self._compressions)
+        msg = _recv_data(server_socket)
+        assert CMD.S_SPECTATE == msg['CMD']
+        assert msg['DATA']['OK']  # 房间不存在
+        self._codec = msg['DATA']['CODEC']
+        return msg
+
+    def send_input(self, value: float):
+        raise RuntimeError('Spectators cannot submit inputs.')
+
+
 class CMD:
     """
     通信协议类。
@@ -306,35 +1293,141 @@ class CMD:
     """
     C_JOIN = 1000
     S_JOIN = 1010
+    S_SNAPSHOT = 1020
+    C_SPECTATE = 1100
+    S_SPECTATE = 1110
     C_INPUT = 2000
     S_INPUT = 2010
+    S_DELTA = 2020
+    S_LATEST = 2030
+    C_RESEND = 2100
+    C_HEARTBEAT = 2200
     MESSAGE = 3000
+    G_HELLO = 4000
+    G_WELCOME = 4010
+    G_PARTIAL = 4100
+    G_VALUE = 4110
+    G_EXTREMES = 4200
+    G_OUTCOME = 4210
     # 协议定义
     protocol = {
         C_JOIN: {
-            'SEED': 12345  # 加密使用随机种子
+            'SEED': 12345,  # 加密使用随机种子
+            'CODECS': [CODEC_JSON],  # 客户端支持的编码，按优先级排列
+            'DELTA': False,  # 客户端能否处理S_DELTA
+            'ROOM': None,  # 要加入的房间ID，只有RoomManager使用
+            'TOKEN': None,  # 重连时带上S_JOIN返回的会话令牌，拿回原来的ID
+            'MULTICAST': False,  # 客户端能否通过组播接收结果
+            'COMPRESS': [],  # 客户端能解压的算法，按优先级排列，如['zlib']
+            'HEARTBEAT': False,  # 客户端能否按S_JOIN的要求定期发送C_HEARTBEAT
+            'NAME': None  # 玩家名字，None表示匿名
         },
         S_JOIN: {
-            'ID': -1  # 服务器分配给客户端的ID，-1表示失败
+            'ID': -1,  # 服务器分配给客户端的ID，-1表示失败
+            'CODEC': CODEC_JSON,  # 协商后双方使用的编码
+            'DELTA': False,  # 服务器是否会发送S_DELTA
+            'ROUND': 0,  # 客户端的第一个输入属于哪一轮
+            'TOKEN': None,  # 会话令牌
+            'MULTICAST': None,  # [组播地址, 端口]，结果通过组播发送；None表示通过TCP发送
+            'COMPRESS': None,  # 协商后的压缩算法，较大的消息会压缩（帧头编码字节带有COMPRESS_ZLIB位）；None表示不压缩
+            'HEARTBEAT': None  # 客户端至少每隔多少秒发送一条消息（没有其他消息时发送C_HEARTBEAT）；None表示不需要
+        },
+        S_SNAPSHOT: {  # 重连成功后紧接着S_JOIN发送
+            'ROUND': 0,  # 下一个输入属于哪一轮
+            'RESULT_ROUND': None,  # 以下结果属于哪一轮，还没有结果时为None
+            'INPUTS': [],  # 该轮所有玩家的输入
+            'G': -1,  # 该轮的G值
+            'SCORE': [],  # 累计分数
+            'AGAIN': True  # 是否继续游戏
+        },
+        C_SPECTATE: {  # 代替C_JOIN，以观战者身份加入
+            'CODECS': [CODEC_JSON],  # 同C_JOIN
+            'ROOM': None,  # 同C_JOIN
+            'COMPRESS': []  # 同C_JOIN
+        },
+        S_SPECTATE: {  # 之后服务器会先发送最新一轮的结果（如果有），再发送之后每轮的结果(S_INPUT)
+            'OK': False,  # 是否成功，房间不存在时为False
+            'CODEC': CODEC_JSON,  # 协商后的编码
+            'ROUND': 0,  # 正在进行的轮次
+            'COMPRESS': None  # 同S_JOIN
         },
         C_INPUT: {
             'ID': -1,  # 客户端的ID，注意不是玩家ID
-            'VALUE': 50.0  # type: float  # 玩家的输入
+            'VALUE': 50.0,  # type: float  # 玩家的输入
+            'ROUND': None  # 输入属于哪一轮；None时服务器按该客户端收到的结果推断
         },
         S_INPUT: {
-            'INPUTS': [],  # 所有玩家的输入
+            'ROUND': 0,  # 结果属于哪一轮
+            'INPUTS': [],  # 所有玩家的输入，缺席玩家为NaN
             'G': -1,  # 当前轮的G值
             'SCORE': [],  # 所有玩家的分数
             'AGAIN': True  # 是否继续游戏
         },
+        S_DELTA: {
+            'ROUND': 0,  # 结果属于哪一轮
+            'INPUTS': [],  # 所有玩家的输入
+            'G': -1,  # 当前轮的G值
+            'IDX': [],  # 分数发生变化的玩家ID
+            'SCORE': [],  # 这些玩家的新分数，其余玩家分数与上一轮相同
+            'AGAIN': True  # 是否继续游戏
+        },
+        S_LATEST: {  # 组播心跳
+            'ROUND': 0  # 最新一轮已发出结果的轮次
+        },
+        C_RESEND: {
+            'ROUNDS': []  # 组播中丢失的结果轮次
+        },
+        C_HEARTBEAT: {},  # 客户端还在线。服务器不回复
         MESSAGE: {
             'MESSAGE': 'Null Message.'  # message，虽然不知道有啥用
+        },
+        # 网关与协调者之间的协议，见Gateway.py
+        G_HELLO: {
+            'PLAYERS': 0  # 该网关负责的玩家数量
+        },
+        G_WELCOME: {  # 所有网关到齐后发送
+            'OFFSET': 0,  # 该网关第一个玩家的全局ID
+            'PLAYERS': 0,  # 整个房间的玩家数量
+            'RATIO': 0.618,  # G值系数
+            'WIN': 0,  # 离G最近的玩家得分
+            'LOSE': -2  # 离G最远的玩家得分
+        },
+        G_PARTIAL: {
+            'ROUND': 0,
+            'SUM': 0.0,  # 本分片到场玩家输入之和
+            'COUNT': 0  # 本分片到场玩家数
+        },
+        G_VALUE: {
+            'ROUND': 0,
+            'G': -1
+        },
+        G_EXTREMES: {
+            'ROUND': 0,
+            'MIN': None,  # 本分片到场玩家与G的最小距离，没有人到场时为None
+            'MAX': None  # 最大距离
+        },
+        G_OUTCOME: {
+            'ROUND': 0,
+            'CLOSEST': False,  # 本分片的最近者是否为全房间的最近者
+            'FARTHEST': False,  # 本分片的最远者是否为全房间的最远者
+            'AGAIN': True
         }
     }
 
 
+_BINARY_ENCODERS = {
+    CMD.C_INPUT: _encode_c_input,
+    CMD.S_INPUT: _encode_s_input,
+    CMD.S_DELTA: _encode_s_delta,
+}
+_BINARY_DECODERS = {
+    CMD.C_INPUT: _decode_c_input,
+    CMD.S_INPUT: _decode_s_input,
+    CMD.S_DELTA: _decode_s_delta,
+}
+
+
 if __name__ == '__main__':
-    import time
     while True:
         print('不能从这里运行。')
         time.sleep(1)
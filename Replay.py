@@ -0,0 +1,140 @@
+"""
+文件名：    Replay.py
+功  能：    对局日志的流式回放。用与GameBoard相同的G值和计分规则重新计算每一轮，校验日志中的分数，
+            或者换一套规则（G值系数、得分）重新计分。
+
+运行方式：python Replay.py match.log [--ratio 0.5] [--win 10] [--lose -1]
+"""
+import sys
+import json
+import time
+import struct
+import argparse
+
+import MatchLog
+import Scoring
+
+
+def replay(path: str, ratio: float = None, win_points: int = None, lose_points: int = None,
+           chunk_bytes: int = MatchLog.CHUNK_BYTES, use_numpy: bool = True) -> dict:
+    """
+    回放path并返回报告。ratio/win_points/lose_points为None时使用日志记录的规则，此时报告中的差异就是校验失败的轮次。
+
+    日志按块读入同一个缓冲区，内存占用与日志长度无关。装有NumPy时整块一起计算（每块数万轮），否则逐轮计算。
+    报告：rounds、rules、g_diffs/score_diffs（G值/本轮得分与记录不同的轮数）、first_diff（第一个不同的轮次）、
+    final_scores（按回放规则的累计分数）、recorded_final_scores、input_wait_seconds/compute_seconds（记录的耗时合计）、
+    seconds、rounds_per_sec。
+    """
+    begin = time.perf_counter()
+    with open(path, 'rb') as f:
+        header = MatchLog.read_header(f)
+        rules = {'ratio': header['ratio'] if ratio is None else ratio,
+                 'win_points': header['win_points'] if win_points is None else win_points,
+                 'lose_points': header['lose_points'] if lose_points is None else lose_points}
+        np = Scoring._load_numpy() if use_numpy else None
+        engine = _NumpyEngine(header['players'], np, **rules) if np is not None \
+            else _PythonEngine(header['players'], **rules)
+        for chunk in MatchLog.iter_chunks(f, header['players'], chunk_bytes):
+            engine.feed(chunk)
+    seconds = time.perf_counter() - begin
+    report = engine.report()
+    report.update(path=path, players=header['players'], rules=rules, recorded_rules=
+                  {key: header[key] for key in ('ratio', 'win_points', 'lose_points')},
+                  seconds=seconds, rounds_per_sec=report['rounds'] / seconds if seconds else 0.0)
+    return report
+
+
+class _PythonEngine:
+    """
+    逐轮调用Scoring中的函数，没有NumPy时使用。
+    """
+
+    def __init__(self, player_number: int, ratio: float, win_points: int, lose_points: int):
+        self._record = struct.Struct(f'<Iddd{player_number}d{player_number}i')
+        self._N = player_number
+        self._ratio, self._win, self._lose = ratio, win_points, lose_points
+        self.rounds = self.g_diffs = self.score_diffs = 0
+        self.first_diff = None
+        self.input_wait = self.compute = 0.0
+        self.scores = [0] * player_number
+        self.recorded = [0] * player_number
+
+    def feed(self, chunk: memoryview):
+        n = self._N
+        for record in self._record.iter_unpack(chunk):
+            round_, g_recorded, input_wait, compute = record[:4]
+            inputs, recorded = record[4:4 + n], record[4 + n:]
+            g_value = Scoring.calculate_g(inputs, self._ratio)
+            closest, farthest = Scoring.find_extremes(inputs, g_value)
+            delta = Scoring.apply_points([0] * n, closest, farthest, self._win, self._lose)
+            score_diff = any(d != new - old for d, new, old in zip(delta, recorded, self.recorded))
+            if g_value != g_recorded or score_diff:
+                if self.first_diff is None:
+                    self.first_diff = round_
+                self.g_diffs += g_value != g_recorded
+                self.score_diffs += score_diff
+            self.scores = [s + d for s, d in zip(self.scores, delta)]
+            self.recorded = list(recorded)
+            self.input_wait += input_wait
+            self.compute += compute
+            self.rounds += 1
+
+    def report(self) -> dict:
+        return {'rounds': self.rounds, 'g_diffs': self.g_diffs, 'score_diffs': self.score_diffs,
+                'first_diff': self.first_diff, 'final_scores': self.scores, 'recorded_final_scores': self.recorded,
+                'input_wait_seconds': self.input_wait, 'compute_seconds': self.compute}
+
+
+class _NumpyEngine(_PythonEngine):
+    """
+    把一块记录看作(轮数, N)的矩阵，用Scoring.batch_extremes整体计算，结果与逐轮计算逐位一致。
+    """
+
+    def __init__(self, player_number: int, np, ratio: float, win_points: int, lose_points: int):
+        super().__init__(player_number, ratio, win_points, lose_points)
+        self._np = np
+        self._dtype = np.dtype([('round', '<u4'), ('g', '<f8'), ('wait', '<f8'), ('compute', '<f8'),
+                                ('inputs', '<f8', (player_number,)), ('scores', '<i4', (player_number,))])
+        self.scores = np.zeros(player_number, dtype=np.int64)
+        self.recorded = np.zeros(player_number, dtype=np.int64)
+
+    def feed(self, chunk: memoryview):
+        np = self._np
+        records = np.frombuffer(chunk, dtype=self._dtype)
+        g_values, closest, farthest = Scoring.batch_extremes(records['inputs'], self._ratio)
+        delta = closest * self._win + farthest * self._lose
+        recorded = records['scores'].astype(np.int64)
+        recorded_delta = np.diff(recorded, axis=0, prepend=self.recorded[None, :])
+        g_diff = g_values != records['g']
+        score_diff = (delta != recorded_delta).any(axis=1)
+        diff = g_diff | score_diff
+        if self.first_diff is None and diff.any():
+            self.first_diff = int(records['round'][diff.argmax()])
+        self.g_diffs += int(g_diff.sum())
+        self.score_diffs += int(score_diff.sum())
+        self.scores = self.scores + delta.sum(axis=0)
+        self.recorded = recorded[-1]
+        self.input_wait += float(records['wait'].sum())
+        self.compute += float(records['compute'].sum())
+        self.rounds += len(records)
+
+    def report(self) -> dict:
+        report = super().report()
+        report.update(final_scores=self.scores.tolist(), recorded_final_scores=self.recorded.tolist())
+        return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='回放对局日志：校验分数，或按新的规则重新计分')
+    parser.add_argument('path', help='GameBoard写出的对局日志')
+    parser.add_argument('--ratio', type=float, default=None, help='G值系数，默认使用日志记录的规则')
+    parser.add_argument('--win', type=int, default=None, help='离G最近的玩家得分')
+    parser.add_argument('--lose', type=int, default=None, help='离G最远的玩家得分')
+    parser.add_argument('--no-numpy', action='store_true', help='逐轮计算（用于对照）')
+    args = parser.parse_args()
+
+    report = replay(args.path, args.ratio, args.win, args.lose, use_numpy=not args.no_numpy)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.ratio is None and args.win is None and args.lose is None and (report['g_diffs'] or report['score_diffs']):
+        sys.exit(1)  # 按记录的规则校验失败
@@ -0,0 +1,219 @@
+"""
+文件名：    RoomManager.py
+功  能：    多房间服务器。一个端口承载多个GameBoard房间，房间分布在多个工作进程中。
+"""
+import os
+import socket
+import struct
+import argparse
+from threading import Thread, Lock, Event
+from multiprocessing import Process, Pipe
+from multiprocessing.reduction import send_handle, recv_handle
+
+import Network
+import GameBoard
+from Network import CMD
+
+_HANDSHAKE_TIMEOUT = 5  # 秒，连接后迟迟不发送C_JOIN的客户端会被断开，避免阻塞其他玩家加入
+_REJECT = {CMD.C_JOIN: CMD.S_JOIN, CMD.C_SPECTATE: CMD.S_SPECTATE}  # 房间不存在时用哪条消息回复
+
+
+class RoomManager:
+    """
+    多房间服务器。主进程只负责监听端口、读取C_JOIN，再根据其中的ROOM字段把连接转交给房间所在的工作进程；
+    房间的计分和结果发送都在工作进程中完成，因此能利用多个CPU核心。
+
+    启动方式：manager.listen(target_port)，再用manager.create_room(room_id, player_number, rounds)开房间。
+    """
+
+    def __init__(self, worker_number: int = None):
+        self._WORKER_NUMBER = worker_number or os.cpu_count()
+        self._ip = None  # type: str  # listen时确定
+        self._port = None
+        self.server_socket = None
+
+        self._ROOMS_LOCK = Lock()
+        self._rooms = {}  # room_id -> 工作进程序号
+        self._room_counts = [0] * self._WORKER_NUMBER  # 每个工作进程托管的房间数
+        self._workers = []  # [(Process, Connection, 发送锁)]
+        # 先创建全部工作进程再启动线程，避免fork时复制正在运行的线程状态
+        for _ in range(self._WORKER_NUMBER):
+            parent_conn, child_conn = Pipe()
+            worker = Process(target=_room_worker, args=(child_conn,), daemon=True)
+            worker.start()
+            child_conn.close()
+            self._workers.append((worker, parent_conn, Lock()))
+        for index in range(self._WORKER_NUMBER):
+            T_watch_worker = Thread(target=self._worker_watcher, args=(index,))
+            T_watch_worker.setDaemon(True)
+            T_watch_worker.start()
+
+    def listen(self, target_port: int, ip_: str = None, fallback: bool = True):
+        """listen(target_port, ip_=None, fallback=True) -> (server_ip, listened_port)
+
+        输入想要服务器监听的端口；返回服务器ip和服务器最终监听的端口。所有房间共用这一个端口。
+        其余参数含义见Network.Server.listen。
+        """
+        self._ip = Network.get_lan_ip() if ip_ is None else ip_
+        if self.server_socket is not None:
+            self.server_socket.close()
+        self.server_socket = Network.bind_socket(self._ip, target_port, fallback)
+        self.server_socket.listen(128)
+        T_accept_client = Thread(target=self._client_acceptor)
+        T_accept_client.setDaemon(True)
+        T_accept_client.start()
+        self._ip, self._port = self.server_socket.getsockname()
+        print(f"S-INFO: room manager start listen {self._ip}:{self._port} with {self._WORKER_NUMBER} workers")
+        return self._ip, self._port
+
+    def create_room(self, room_id, player_number: int, rounds: int, input_deadline: float = None, quorum: int = 1):
+        """
+        在托管房间最少的工作进程中创建房间。工作进程没有GUI，房间必须指定轮数。
+        input_deadline, quorum见GameBoard。
+        """
+        with self._ROOMS_LOCK:
+            if room_id in self._rooms:
+                raise ValueError(f'Room {room_id!r} already exists.')
+            index = min(range(self._WORKER_NUMBER), key=self._room_counts.__getitem__)
+            self._rooms[room_id] = index
+            self._room_counts[index] += 1
+        _, conn, send_lock = self._workers[index]
+        with send_lock:
+            conn.send(('CREATE', room_id, player_number, rounds, input_deadline, quorum))
+        print(f'S-INFO: room {room_id!r} created on worker {index}.')
+
+    def get_rooms(self) -> list:
+        with self._ROOMS_LOCK:
+            return list(self._rooms)
+
+    def server_exit(self):
+        if self.server_socket is not None:
+            self.server_socket.close()
+        for worker, conn, send_lock in self._workers:
+            with send_lock:
+                conn.send(('EXIT',))
+        for worker, _, _ in self._workers:
+            worker.join(timeout=10)
+
+    def _client_acceptor(self):
+        """
+        接受连接，每个连接的握手交给一个短时的线程，不发消息或者慢慢发的客户端不会挡住其他房间的玩家。
+        """
+        while True:
+            try:
+                client, addr = self.server_socket.accept()  # 阻塞，等待客户端连接
+            except OSError:
+                break
+            T_handshake = Thread(target=self._client_handshake, args=(client, addr))
+            T_handshake.setDaemon(True)
+            T_handshake.start()
+
+    def _client_handshake(self, client: socket.socket, addr):
+        """
+        读取C_JOIN并把连接转交给房间所在的工作进程。
+        """
+        try:
+            client.settimeout(_HANDSHAKE_TIMEOUT)
+            msg = Network._recv_data(client, compressed=False)
+            assert msg['CMD'] in (CMD.C_JOIN, CMD.C_SPECTATE)  # 玩家或观战者
+            room_id = msg['DATA'].get('ROOM')
+            with self._ROOMS_LOCK:
+                index = self._rooms.get(room_id)
+            if index is None:
+                print(f'S-INFO: {addr[0]}:{addr[1]} asked for unknown room {room_id!r}.')
+                Network._send_data(client, _REJECT[msg['CMD']])  # ID=-1或OK=False表示失败
+                client.close()
+                return
+            client.settimeout(None)
+            worker, conn, send_lock = self._workers[index]
+            with send_lock:  # 消息和文件描述符必须成对、按顺序到达工作进程
+                conn.send(('CLIENT', room_id, msg, addr))
+                send_handle(conn, client.fileno(), worker.pid)
+            client.close()  # 工作进程已经持有该连接的副本
+        except (OSError, ValueError, struct.error, KeyError, AssertionError) as e:  # 不是从合法客户端发来的消息
+            print(f'S-INFO: First handshake with {addr[0]}:{addr[1]} failed. \n\t\tError reported as ', repr(e))
+            client.close()
+
+    def _worker_watcher(self, index: int):
+        """
+        接收工作进程发来的房间结束通知。
+        """
+        _, conn, _ = self._workers[index]
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == 'CLOSED':
+                with self._ROOMS_LOCK:
+                    if self._rooms.pop(msg[1], None) is not None:
+                        self._room_counts[index] -= 1
+                print(f'S-INFO: room {msg[1]!r} closed.')
+
+
+def _room_worker(conn):
+    """
+    工作进程：托管若干房间，接收主进程转交的玩家连接。
+    """
+    rooms = {}  # room_id -> GameBoard
+    send_lock = Lock()
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if msg[0] == 'CREATE':
+            _, room_id, player_number, rounds, input_deadline, quorum = msg
+            board = GameBoard.GameBoard(player_number, rounds=rounds, input_deadline=input_deadline, quorum=quorum)
+            board.start(listen=False)
+            rooms[room_id] = board
+            T_watch_room = Thread(target=_room_watcher, args=(rooms, room_id, conn, send_lock))
+            T_watch_room.setDaemon(True)
+            T_watch_room.start()
+        elif msg[0] == 'CLIENT':
+            _, room_id, join_msg, addr = msg
+            client = socket.socket(fileno=recv_handle(conn))
+            board = rooms.get(room_id)
+            try:
+                if board is None:  # 房间在转交途中结束了
+                    Network._send_data(client, _REJECT[join_msg['CMD']])
+                    client.close()
+                else:
+                    board.server.attach_client(client, join_msg, addr)
+            except OSError as e:  # 客户端在转交途中断开
+                print(f'S-INFO: Client {addr[0]}:{addr[1]} left before joining room {room_id!r}. ', repr(e))
+                client.close()
+        elif msg[0] == 'EXIT':
+            for board in list(rooms.values()):
+                board.server.server_exit()
+            break
+
+
+def _room_watcher(rooms: dict, room_id, conn, send_lock: Lock):
+    board = rooms[room_id]
+    board.wait_exit()
+    rooms.pop(room_id, None)
+    with send_lock:
+        conn.send(('CLOSED', room_id))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='多房间服务器：python RoomManager.py room1:4 room2:6 --rounds 10')
+    parser.add_argument('rooms', nargs='+', help='房间ID:玩家数量')
+    parser.add_argument('--port', type=int, default=Network.SERVER_DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数量，默认等于CPU核心数')
+    parser.add_argument('--rounds', type=int, default=10, help='每个房间进行的轮数')
+    parser.add_argument('--deadline', type=float, default=None, help='每轮输入截止时间（秒），默认等待所有玩家')
+    parser.add_argument('--quorum', type=int, default=1, help='截止时至少需要的输入数')
+    args = parser.parse_args()
+
+    manager = RoomManager(args.workers)
+    ip_, port_ = manager.listen(args.port)
+    for room in args.rooms:
+        room_id, _, player_number = room.rpartition(':')
+        manager.create_room(room_id, int(player_number), args.rounds, args.deadline, args.quorum)
+        print(f'S-INFO: players join with {ip_}:{port_}/{room_id}')
+    try:
+        Event().wait()
+    except KeyboardInterrupt:
+        manager.server_exit()
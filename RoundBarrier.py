@@ -0,0 +1,116 @@
+"""
+文件名：    RoundBarrier.py
+功  能：    按轮次收集玩家输入的屏障。支持输入截止时间和法定人数，拒绝迟到和重复的输入。
+"""
+import time
+from threading import Condition
+
+from Scoring import ABSENT
+
+# submit的返回值
+ACCEPTED = 'accepted'
+LATE = 'late'  # 该轮已经结束
+DUPLICATE = 'duplicate'  # 该玩家本轮已经提交过
+EARLY = 'early'  # 该轮还没有开始，客户端的轮次不可能超前，说明消息有误
+
+
+class RoundBarrier:
+    """
+    round是当前正在收集输入的轮次（代数），每结束一轮加1。每个输入都带有轮次，只有本轮的第一次输入会被接受。
+
+    deadline为None时等待所有玩家（原规则）。否则本轮第一个输入到达后开始计时，deadline秒后只要已有quorum个输入
+    就结束本轮，未提交的玩家记为缺席（输入为Scoring.ABSENT）；不足quorum时继续等，凑够后立即结束。
+    这样一个掉线或很慢的玩家最多让每轮多等deadline秒，而不是让整个房间停下来。
+
+    玩家的ID被释放（离开房间、心跳超时）后调用leave，之后的轮次不再等待该玩家，直到有人重新占用该ID（join）。
+    所有人都离开时不会空转，仍然等待至少一个输入。
+    """
+
+    def __init__(self, player_number: int, deadline: float = None, quorum: int = 1):
+        self._PLAYER_NUMBER = player_number
+        self._DEADLINE = deadline
+        self._QUORUM = max(1, min(quorum, player_number))
+        self._CONDITION = Condition()
+        self.round = 0
+        self.last_arrival = None  # 上一轮最后一个被接受的玩家ID
+        self._inputs = [ABSENT] * player_number
+        self._submitted = bytearray(player_number)
+        self._count = 0
+        self._active = bytearray(b'\x01') * player_number  # 需要等待的玩家，开局时等待所有人
+        self._waiting = player_number  # 本轮还没有提交输入的需要等待的玩家数
+        self._first_arrival = None  # 本轮第一个输入到达的时刻
+        self._last_arrival = None
+
+    def submit(self, round_: int, player_id: int, value: float) -> str:
+        """
+        提交player_id在round_轮的输入，返回ACCEPTED/LATE/DUPLICATE/EARLY。round_为None时视为当前轮。
+        """
+        with self._CONDITION:
+            if round_ is None:
+                round_ = self.round
+            if round_ < self.round:
+                return LATE
+            if round_ > self.round:
+                return EARLY
+            if self._submitted[player_id]:
+                return DUPLICATE
+            self._submitted[player_id] = 1
+            self._inputs[player_id] = value
+            self._count += 1
+            self._waiting -= self._active[player_id]
+            self._last_arrival = player_id
+            if self._first_arrival is None:
+                self._first_arrival = time.monotonic()
+            if not self._waiting or self._count == self._QUORUM:
+                self._CONDITION.notify_all()  # 所有人都到了，或者截止时间可能已经过了
+            return ACCEPTED
+
+    def leave(self, player_id: int):
+        """
+        不再等待player_id的输入。本轮已经提交的输入仍然有效。
+        """
+        with self._CONDITION:
+            if not self._active[player_id]:
+                return
+            self._active[player_id] = 0
+            if not self._submitted[player_id]:
+                self._waiting -= 1
+                if not self._waiting:
+                    self._CONDITION.notify_all()
+
+    def join(self, player_id: int):
+        """
+        重新等待player_id的输入（从本轮开始）。
+        """
+        with self._CONDITION:
+            if self._active[player_id]:
+                return
+            self._active[player_id] = 1
+            if not self._submitted[player_id]:
+                self._waiting += 1
+
+    def wait_inputs(self):
+        """wait_inputs() -> (round, inputs, absent_ids)
+
+        阻塞至本轮可以结束，然后结束本轮并开启下一轮。inputs中缺席玩家的输入为Scoring.ABSENT。
+        """
+        with self._CONDITION:
+            while self._waiting or not self._count:
+                if self._DEADLINE is None or self._count < self._QUORUM:
+                    self._CONDITION.wait()
+                    continue
+                remaining = self._first_arrival + self._DEADLINE - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._CONDITION.wait(remaining)
+            round_, inputs = self.round, self._inputs
+            absent = [id_ for id_, submitted in enumerate(self._submitted) if not submitted]
+            self.last_arrival = self._last_arrival
+            self.round += 1
+            self._inputs = [ABSENT] * self._PLAYER_NUMBER
+            self._submitted = bytearray(self._PLAYER_NUMBER)
+            self._count = 0
+            self._waiting = sum(self._active)
+            self._first_arrival = None
+            self._last_arrival = None
+        return round_, inputs, absent
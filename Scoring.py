@@ -0,0 +1,133 @@
+"""
+文件名：    Scoring.py
+功  能：    计分内核。计算G值、离G最近/最远的玩家（含并列）和新的分数表，均为O(N)；装有NumPy时向量化计算。
+"""
+import math
+
+np = None  # NumPy是可选依赖，第一次需要向量化时才导入（约0.1秒），不拖慢服务器启动；没有时使用纯Python实现
+_numpy_checked = False
+
+G_RATIO = 0.618  # G = 平均值 * 0.618
+LOSE_POINTS = -2  # 离G最远的玩家加-2分；离G最近的玩家加N分（N为玩家数量）
+NUMPY_MIN_PLAYERS = 64  # 玩家较少时NumPy的调用开销比纯Python循环还大
+ABSENT = math.nan  # 缺席玩家的输入。缺席者不参与G值计算，也不会成为最近或最远的玩家
+
+
+def calculate_g(inputs: list, ratio: float = G_RATIO) -> float:
+    """
+    按玩家顺序逐个累加（见_sequential_sum），与batch_extremes逐位一致。有缺席玩家时只对到场玩家求平均。
+    """
+    total = _sequential_sum(inputs)
+    if total == total:  # 不含NaN，即没有缺席玩家
+        return total / len(inputs) * ratio
+    present = [x for x in inputs if x == x]
+    return _sequential_sum(present) / len(present) * ratio
+
+
+def _sequential_sum(values) -> float:
+    """
+    从第一个数开始逐个相加的普通浮点累加。不用内置sum：Python 3.12起它对浮点数做补偿求和，结果随版本变化；
+    也不用np.sum（成对累加）。batch_extremes的逐列累加和np.cumsum都是同样的顺序，GameBoard、Replay和Simulator的G值因此逐位相同。
+    """
+    total = 0.0
+    for value in values:
+        total += value
+    return total
+
+
+def find_extremes(inputs: list, g_value: float):
+    """find_extremes(inputs, g_value) -> (closest_ids, farthest_ids)
+
+    一次遍历找出|x-G|最小和最大的所有玩家ID，并列的玩家全部返回，ID升序。缺席玩家（NaN）被跳过。
+    """
+    if len(inputs) >= NUMPY_MIN_PLAYERS and _load_numpy() is not None:
+        return _find_extremes_numpy(inputs, g_value)
+    return _find_extremes_python(inputs, g_value)
+
+
+def _load_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+
+def _find_extremes_python(inputs, g_value: float):
+    first = 0
+    while inputs[first] != inputs[first]:  # 从第一个到场的玩家开始；与NaN的比较总是False，之后不用再特判
+        first += 1
+    min_d = max_d = abs(inputs[first] - g_value)
+    closest, farthest = [first], [first]
+    for id_ in range(first + 1, len(inputs)):
+        d = abs(inputs[id_] - g_value)
+        if d < min_d:
+            min_d, closest = d, [id_]
+        elif d == min_d:
+            closest.append(id_)
+        if d > max_d:
+            max_d, farthest = d, [id_]
+        elif d == max_d:
+            farthest.append(id_)
+    return closest, farthest
+
+
+def _find_extremes_numpy(inputs, g_value: float):
+    d = np.abs(np.asarray(inputs, dtype=np.float64) - g_value)
+    closest = np.flatnonzero(d == np.nanmin(d))
+    farthest = np.flatnonzero(d == np.nanmax(d))
+    return closest.tolist(), farthest.tolist()
+
+
+def apply_points(last_scores: list, closest: list, farthest: list,
+                 win_points: int, lose_points: int = LOSE_POINTS) -> list:
+    """
+    返回新的分数表，不修改last_scores。所有人距离相同时，每个人既是最近也是最远，两项都要加。
+    """
+    scores = list(last_scores)
+    for id_ in closest:
+        scores[id_] += win_points
+    for id_ in farthest:
+        scores[id_] += lose_points
+    return scores
+
+
+def batch_extremes(inputs, ratio: float = G_RATIO):
+    """batch_extremes(inputs) -> (g_values, closest, farthest)
+
+    一次计算多轮互相独立的结果，需要NumPy。inputs为(轮数, N)的float64矩阵，缺席为NaN；
+    返回每轮的G值(轮数,)，以及离G最近、最远的玩家(轮数, N)的布尔矩阵，并列的玩家都为True。
+    G值按玩家顺序逐列累加（np.sum是成对累加，末位可能不同），与calculate_g（_sequential_sum）、find_extremes逐位一致。
+    """
+    _load_numpy()
+    present = inputs == inputs
+    all_present = present.all()
+    filled = inputs if all_present else np.where(present, inputs, 0.0)  # 缺席玩家按0累加、不计人数
+    if len(filled) >= filled.shape[1]:  # 轮数多于玩家数时逐列累加更快
+        total = filled[:, 0].copy()
+        for column in filled.T[1:]:
+            total += column
+    else:
+        total = np.cumsum(filled, axis=1)[:, -1]
+    g_values = total / (filled.shape[1] if all_present else present.sum(axis=1)) * ratio
+    distance = np.abs(inputs - g_values[:, None])
+    closest = distance == np.fmin.reduce(distance, axis=1)[:, None]  # fmin/fmax跳过NaN
+    farthest = distance == np.fmax.reduce(distance, axis=1)[:, None]
+    return g_values, closest, farthest
+
+
+def score_round(inputs: list, last_scores: list, ratio: float = G_RATIO,
+                win_points: int = None, lose_points: int = LOSE_POINTS):
+    """score_round(inputs, last_scores) -> (g_value, scores, closest_ids, farthest_ids)
+
+    计算一轮的全部结果。win_points默认为玩家数量。
+    """
+    g_value = calculate_g(inputs, ratio)
+    closest, farthest = find_extremes(inputs, g_value)
+    if win_points is None:
+        win_points = len(inputs)
+    return g_value, apply_points(last_scores, closest, farthest, win_points, lose_points), closest, farthest
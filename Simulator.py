@@ -0,0 +1,166 @@
+"""
+文件名：    Simulator.py
+功  能：    离线的策略模拟器。按给定的策略组合进行大量对局，每一步用矩阵同时推进成千上万局，
+            用Scoring.batch_extremes计算G值和最近/最远者，累加顺序与GameBoard的calculate_g相同，结果逐位一致；
+            统计每种策略的期望得分和最终名次分布。需要NumPy。
+
+运行方式：python Simulator.py uniform=50 follow=30 normal:30,10=20 --rounds 100 --games 10000
+"""
+import sys
+import json
+import time
+import argparse
+
+import Scoring
+
+BATCH_ELEMENTS = 1 << 20  # 每批同时推进的局数 x 玩家数，约8MB一个矩阵
+_LOW, _HIGH = 0.01, 99.99  # 界面只接受0 < x < 100
+
+
+# 策略：strategy(rng, last_g, games, players, *参数) -> (games, players)的输入矩阵。
+# last_g为每局上一轮的G值(games,)，第一轮为NaN。名称与LoadTest.STRATEGIES一致的策略行为也相同
+def _uniform(rng, last_g, games: int, players: int, low: float = _LOW, high: float = _HIGH):
+    return rng.uniform(low, high, (games, players))
+
+
+def _constant(rng, last_g, games: int, players: int, value: float = 50.0):
+    return Scoring.np.full((games, players), value)
+
+
+def _normal(rng, last_g, games: int, players: int, mean: float = 50.0, sigma: float = 15.0):
+    return Scoring.np.clip(rng.normal(mean, sigma, (games, players)), _LOW, _HIGH)
+
+
+def _follow(rng, last_g, games: int, players: int, sigma: float = 0.0):
+    """
+    猜上一轮的G值（第一轮猜50），sigma不为0时加上正态噪声。
+    """
+    np = Scoring.np
+    guess = np.where((last_g > 0) & (last_g < 100), last_g, 50.0)[:, None]
+    if not sigma:
+        return np.broadcast_to(guess, (games, players))
+    return np.clip(guess + rng.normal(0.0, sigma, (games, players)), _LOW, _HIGH)
+
+
+STRATEGIES = {
+    'uniform': _uniform,  # uniform:low,high
+    'half': _constant,  # 总是猜50
+    'const': _constant,  # const:value
+    'normal': _normal,  # normal:mean,sigma
+    'follow': _follow,  # follow:sigma
+}
+
+
+def parse_strategy(spec: str):
+    """parse_strategy('normal:30,10') -> (函数, (30.0, 10.0))
+    """
+    name, _, params = spec.partition(':')
+    if name not in STRATEGIES:
+        raise ValueError(f'Unknown strategy {name!r}, choose from {sorted(STRATEGIES)}.')
+    return STRATEGIES[name], tuple(float(x) for x in params.split(',')) if params else ()
+
+
+def simulate(mix: dict, rounds: int = 100, games: int = 10000, seed: int = 0, ratio: float = Scoring.G_RATIO,
+             win_points: int = None, lose_points: int = Scoring.LOSE_POINTS) -> dict:
+    """
+    mix: {策略: 玩家数}，如{'uniform': 50, 'normal:30,10': 50}。每局所有策略的玩家同场，按mix的顺序排列。
+    rounds: 每局的轮数；games: 局数。共模拟rounds * games轮，每轮所有玩家都到场。
+    win_points默认为玩家总数，与GameBoard相同。
+
+    按批进行：每批同时推进若干局（局数 x 玩家数不超过BATCH_ELEMENTS），一步推进一轮，所以依赖上一轮G值的策略也能向量化。
+    报告每种策略的：每轮期望得分、成为最近/最远者的概率、最终分数的均值和标准差、最终名次（同分名次相同）的
+    均值/分位数和第一名的概率。
+    """
+    np = Scoring._load_numpy()
+    if np is None:
+        raise RuntimeError('Simulator requires NumPy.')
+    strategies = [(spec, count) + parse_strategy(spec) for spec, count in mix.items() if count > 0]
+    n = sum(count for _, count, _, _ in strategies)
+    if win_points is None:
+        win_points = n
+    columns, first = [], 0  # 每种策略占用的列
+    for _, count, _, _ in strategies:
+        columns.append(slice(first, first + count))
+        first += count
+    rng = np.random.default_rng(seed)
+    batch = max(1, min(games, BATCH_ELEMENTS // n))
+    wins = np.zeros(n)
+    penalties = np.zeros(n)
+    final_sum = np.zeros(n)  # 各玩家最终分数（即所有轮得分）之和与平方和，内存占用与局数无关
+    final_square_sum = np.zeros(n)
+    rank_counts = np.zeros((n, n + 1), dtype=np.int64)  # [玩家, 名次] -> 次数
+    begin = time.perf_counter()
+    inputs = np.empty((batch, n))
+    for done in range(0, games, batch):
+        size = min(batch, games - done)
+        scores = np.zeros((size, n), dtype=np.int64)
+        last_g = np.full(size, np.nan)
+        for _ in range(rounds):
+            view = inputs[:size]
+            for (_, count, strategy, params), column in zip(strategies, columns):
+                view[:, column] = strategy(rng, last_g, size, count, *params)
+            last_g, closest, farthest = Scoring.batch_extremes(view, ratio)
+            scores += closest * win_points
+            scores += farthest * lose_points
+            wins += closest.sum(axis=0)
+            penalties += farthest.sum(axis=0)
+        final_sum += scores.sum(axis=0)
+        final_square_sum += (scores.astype(np.float64) ** 2).sum(axis=0)
+        ranks = _competition_ranks(np, scores) + np.arange(n) * (n + 1)  # 展平成[玩家, 名次]的下标
+        rank_counts += np.bincount(ranks.ravel(), minlength=n * (n + 1)).reshape(n, n + 1)
+    seconds = time.perf_counter() - begin
+
+    report = {'players': n, 'rounds': rounds, 'games': games, 'seed': seed,
+              'rules': {'ratio': ratio, 'win_points': win_points, 'lose_points': lose_points},
+              'seconds': seconds, 'rounds_per_sec': rounds * games / seconds if seconds else 0.0, 'strategies': {}}
+    total_rounds = rounds * games
+    for (spec, count, _, _), column in zip(strategies, columns):
+        rank_hist = rank_counts[column].sum(axis=0)
+        cumulative = np.cumsum(rank_hist) / rank_hist.sum()
+        final_mean = final_sum[column].sum() / count / games
+        final_var = max(final_square_sum[column].sum() / count / games - final_mean ** 2, 0.0)
+        report['strategies'][spec] = {
+            'players': count,
+            'points_per_round': float(final_sum[column].sum() / count / total_rounds),
+            'closest_rate': float(wins[column].sum() / count / total_rounds),
+            'farthest_rate': float(penalties[column].sum() / count / total_rounds),
+            'final_score': {'mean': float(final_mean), 'std': float(final_var ** 0.5)},
+            'rank': {'mean': float((rank_hist * np.arange(n + 1)).sum() / rank_hist.sum()),
+                     'p10': int(np.searchsorted(cumulative, 0.1)), 'p50': int(np.searchsorted(cumulative, 0.5)),
+                     'p90': int(np.searchsorted(cumulative, 0.9)), 'first': float(rank_hist[1] / rank_hist.sum())},
+        }
+    return report
+
+
+def _competition_ranks(np, scores):
+    """
+    每行（一局）的名次，从1开始，同分的玩家名次相同（1 + 分数严格更高的人数），与Statistics.Ranking.rank相同。
+    """
+    order = np.argsort(-scores, axis=1, kind='stable')
+    ordered = np.take_along_axis(scores, order, axis=1)
+    position = np.arange(scores.shape[1])
+    new_value = np.ones(ordered.shape, dtype=bool)
+    new_value[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    first_position = np.maximum.accumulate(np.where(new_value, position, 0), axis=1)  # 同分的第一个位置
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, first_position + 1, axis=1)
+    return ranks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线策略模拟：python Simulator.py 策略=人数 ...')
+    parser.add_argument('mix', nargs='+', help=f'策略=人数，策略可带参数，如normal:30,10=20。可选：{sorted(STRATEGIES)}')
+    parser.add_argument('--rounds', type=int, default=100, help='每局轮数')
+    parser.add_argument('--games', type=int, default=10000, help='局数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ratio', type=float, default=Scoring.G_RATIO)
+    parser.add_argument('--win', type=int, default=None, help='离G最近的玩家得分，默认为玩家总数')
+    parser.add_argument('--lose', type=int, default=Scoring.LOSE_POINTS)
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix:
+        spec, _, count = item.rpartition('=')
+        mix[spec] = int(count)
+    json.dump(simulate(mix, args.rounds, args.games, args.seed, args.ratio, args.win, args.lose), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,215 @@
+"""
+文件名：    Spectators.py
+功  能：    观战者的结果分发。所有观战者共享一个环形缓冲区，每人一个游标，由一个线程用非阻塞socket发送。
+"""
+import time
+import socket
+import selectors
+from collections import deque
+from threading import Thread, Lock
+
+RING_CAPACITY = 64  # 环形缓冲区保留的轮数，游标落后更多的观战者直接跳到最新一轮
+STALL_TIMEOUT = 10  # 秒，发送缓冲区一直写不进去的观战者会被断开
+
+
+class ResultRing:
+    """
+    固定容量的环形缓冲区。只有一个写者（每轮结果发出时追加一次），读者各自持有游标，即下一个要读的序号。
+
+    结果中的分数是累计的，所以落后太多（游标所指的结果已被覆盖）的读者不必补齐，直接读最新一条即可。
+    """
+
+    def __init__(self, capacity: int = RING_CAPACITY):
+        self._CAPACITY = capacity
+        self._slots = [None] * capacity
+        self.head = 0  # 下一条写入的序号
+
+    def append(self, item):
+        self._slots[self.head % self._CAPACITY] = item
+        self.head += 1
+
+    def read(self, cursor: int):
+        """read(cursor) -> (从cursor到最新的所有条目, 新游标, 跳过的条数)
+        """
+        head = self.head
+        skipped = 0
+        if cursor < head - self._CAPACITY:
+            skipped = head - 1 - cursor
+            cursor = head - 1
+        return [self._slots[seq % self._CAPACITY] for seq in range(cursor, head)], head, skipped
+
+
+class _Subscriber:
+    __slots__ = ('sock', 'codec', 'cursor', 'pending', 'stalled_since')
+
+    def __init__(self, sock: socket.socket, codec: int, cursor: int):
+        self.sock = sock
+        self.codec = codec
+        self.cursor = cursor
+        self.pending = None  # 还没写进发送缓冲区的字节（memoryview）
+        self.stalled_since = None  # 发送缓冲区满的时刻
+
+
+class SpectatorHub:
+    """
+    观战者只读地接收每轮结果，不占用玩家ID、连接池和限流信号量。
+
+    publish()只是把结果放进环形缓冲区并唤醒分发线程，不做任何网络操作，所以观战者再多、再慢也不会拖慢玩家的回合。
+    分发线程用selectors管理所有观战者的非阻塞socket：一个观战者同一时刻最多只有一批未写完的数据，
+    写不进去时它的游标停住；等它恢复时游标已被覆盖就跳到最新一轮；STALL_TIMEOUT秒毫无进展就断开。
+    """
+
+    def __init__(self, metrics, capacity: int = RING_CAPACITY):
+        self.metrics = metrics
+        self.ring = ResultRing(capacity)
+        self._LOCK = Lock()  # 保护ring和_joining，publish和add在其他线程调用
+        self._joining = deque()  # 等待分发线程接收的(socket, codec, greeting)
+        self._subscribers = {}  # socket -> _Subscriber
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._closed = False
+        T_spectator_fanout = Thread(target=self._run)
+        T_spectator_fanout.setDaemon(True)
+        T_spectator_fanout.start()
+
+    def add(self, sock: socket.socket, codec: int, greeting: bytes = b''):
+        """
+        接收一个观战者。它会先收到greeting（握手回复），再收到最新一轮的结果（如果有）。
+        """
+        with self._LOCK:
+            self._joining.append((sock, codec, greeting))
+        self._wakeup()
+
+    def publish(self, result):
+        """
+        发布一轮结果（Network.RoundResult）。
+        """
+        with self._LOCK:
+            self.ring.append(result)
+        self._wakeup()
+
+    def close(self):
+        self._closed = True
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, OSError):  # 缓冲区里已经有未处理的唤醒，或者已经关闭
+            pass
+
+    def _run(self):
+        seen_head = 0  # 上次为空闲观战者取数据时缓冲区的head
+        last_check = time.monotonic()
+        while not self._closed:
+            for key, events in self._selector.select(timeout=1):
+                if key.fileobj is self._wakeup_recv:
+                    try:
+                        while self._wakeup_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                subscriber = key.data
+                if events & selectors.EVENT_READ and not self._check_alive(subscriber):
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    self._flush(subscriber)
+                    if subscriber.pending is None:  # 写完了，接着发积压期间到达的结果
+                        self._fill(subscriber)
+                        self._flush(subscriber)
+            self._accept_joining()
+            if self.ring.head != seen_head:  # 有新结果，只给空闲的观战者取数据，积压的观战者游标停住
+                seen_head = self.ring.head
+                for subscriber in list(self._subscribers.values()):
+                    if subscriber.pending is None:
+                        self._fill(subscriber)
+                        self._flush(subscriber)
+            now = time.monotonic()
+            if now - last_check >= 1:
+                last_check = now
+                for subscriber in list(self._subscribers.values()):
+                    if subscriber.pending is not None and now - subscriber.stalled_since > STALL_TIMEOUT:
+                        self._drop(subscriber, stalled=True)
+        for subscriber in list(self._subscribers.values()):
+            self._drop(subscriber)
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def _accept_joining(self):
+        with self._LOCK:
+            joining, self._joining = self._joining, deque()
+            head = self.ring.head
+        for sock, codec, greeting in joining:
+            sock.setblocking(False)
+            subscriber = _Subscriber(sock, codec, max(head - 1, 0))  # 握手后先发最新一轮的结果
+            self._subscribers[sock] = subscriber
+            self._selector.register(sock, selectors.EVENT_READ, subscriber)
+            subscriber.pending = memoryview(greeting) if greeting else None
+            self._flush(subscriber)
+            if subscriber.pending is None:
+                self._fill(subscriber)
+                self._flush(subscriber)
+        if joining:
+            self.metrics.set('spectators', len(self._subscribers))
+
+    def _fill(self, subscriber: _Subscriber):
+        with self._LOCK:
+            results, subscriber.cursor, skipped = self.ring.read(subscriber.cursor)
+        if skipped:
+            self.metrics.inc('spectator_skipped_rounds', skipped)
+        if results:
+            subscriber.pending = memoryview(b''.join(result.frame(subscriber.codec) for result in results))
+
+    def _flush(self, subscriber: _Subscriber):
+        """
+        把pending尽量写进发送缓冲区，写不完就等待可写事件。
+        """
+        if subscriber.pending is None:
+            return
+        try:
+            sent = subscriber.sock.send(subscriber.pending)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(subscriber)
+            return
+        self.metrics.inc('spectator_bytes_out', sent)
+        if sent == len(subscriber.pending):
+            subscriber.pending = None
+            if subscriber.stalled_since is not None:  # 只有积压时才关注可写事件
+                subscriber.stalled_since = None
+                self._selector.modify(subscriber.sock, selectors.EVENT_READ, subscriber)
+            return
+        subscriber.pending = subscriber.pending[sent:]
+        if subscriber.stalled_since is None:
+            self._selector.modify(subscriber.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, subscriber)
+        if sent or subscriber.stalled_since is None:  # 有进展就重新计时
+            subscriber.stalled_since = time.monotonic()
+
+    def _check_alive(self, subscriber: _Subscriber) -> bool:
+        """
+        观战者不会发送任何消息，可读只意味着它断开了（或者发来了无效数据，一并断开）。
+        """
+        try:
+            subscriber.sock.recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self._drop(subscriber)
+        return False
+
+    def _drop(self, subscriber: _Subscriber, stalled: bool = False):
+        if self._subscribers.pop(subscriber.sock, None) is None:
+            return
+        self._selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+        self.metrics.set('spectators', len(self._subscribers))
+        if stalled:
+            self.metrics.inc('spectator_drops')
+            print(f'S-INFO: Drop a spectator that made no progress in {STALL_TIMEOUT}s.')
@@ -0,0 +1,249 @@
+"""
+文件名：    Statistics.py
+功  能：    增量维护的对局统计。每轮由GameBoard更新一次，查询不再需要重新扫描历史：
+            每个玩家的平均输入、与G的平均距离、最近（得分）和最远（扣分）的次数，以及按分数的排名。
+"""
+import random
+from array import array
+
+import Scoring
+
+
+class Ranking:
+    """
+    按分数从高到低排列所有玩家的顺序统计树（treap），同分时ID小的在前。每个玩家固定占一个节点，
+    节点的左右孩子、优先级和子树大小存放在以玩家ID为下标的并列数组中，更新时不创建对象。
+
+    修改一个玩家的分数、查询某个玩家的名次、取第k名都是期望O(log N)，取前k名是O(k + log N)。
+    """
+
+    def __init__(self, player_number: int, seed=None):
+        self._PLAYER_NUMBER = player_number
+        rng = random.Random(seed)
+        self._score = [0] * player_number
+        self._priority = [rng.random() for _ in range(player_number)]
+        self._left = [-1] * player_number
+        self._right = [-1] * player_number
+        self._size = [1] * player_number
+        self._root = self._build()
+
+    def _build(self) -> int:
+        """
+        所有人都是0分时顺序就是ID顺序，用栈在O(N)内按优先级建成笛卡尔树，不必逐个插入。
+        """
+        stack = []
+        for x in range(self._PLAYER_NUMBER):
+            last = -1
+            while stack and self._priority[stack[-1]] < self._priority[x]:
+                last = stack.pop()
+            self._left[x] = last
+            if stack:
+                self._right[stack[-1]] = x
+            stack.append(x)
+        for x in sorted(range(self._PLAYER_NUMBER), key=self._priority.__getitem__):  # 孩子的优先级总是更低，先算
+            self._pull(x)
+        return stack[0] if stack else -1
+
+    def __len__(self):
+        return self._PLAYER_NUMBER
+
+    def score(self, player_id: int) -> int:
+        return self._score[player_id]
+
+    def update(self, player_id: int, score: int):
+        """
+        修改一个玩家的分数：按旧分数摘下节点，再按新分数插回。
+        """
+        if self._score[player_id] == score:
+            return
+        self._root = self._erase(self._root, player_id)
+        self._score[player_id] = score
+        self._left[player_id] = self._right[player_id] = -1
+        self._size[player_id] = 1
+        self._root = self._insert(self._root, player_id)
+
+    def rank(self, player_id: int) -> int:
+        """
+        名次，从1开始。同分的玩家名次相同（1 + 分数严格更高的人数）。
+        """
+        score = self._score[player_id]
+        higher = 0
+        node = self._root
+        while node >= 0:
+            if self._score[node] > score:
+                left = self._left[node]
+                higher += (self._size[left] if left >= 0 else 0) + 1
+                node = self._right[node]
+            else:
+                node = self._left[node]
+        return higher + 1
+
+    def kth(self, k: int) -> int:
+        """
+        排在第k位（从0开始，同分按ID）的玩家ID。
+        """
+        if not 0 <= k < self._PLAYER_NUMBER:
+            raise IndexError('rank out of range')
+        node = self._root
+        while True:
+            left = self._left[node]
+            left_size = self._size[left] if left >= 0 else 0
+            if k < left_size:
+                node = left
+            elif k == left_size:
+                return node
+            else:
+                k -= left_size + 1
+                node = self._right[node]
+
+    def top(self, k: int) -> list:
+        """
+        前k名：[(player_id, score), ...]，按名次排列。中序遍历到第k个节点就停止。
+        """
+        result = []
+        stack = []
+        node = self._root
+        while len(result) < k and (stack or node >= 0):
+            while node >= 0:
+                stack.append(node)
+                node = self._left[node]
+            node = stack.pop()
+            result.append((node, self._score[node]))
+            node = self._right[node]
+        return result
+
+    def _before(self, a: int, b: int) -> bool:
+        score_a, score_b = self._score[a], self._score[b]
+        return score_a > score_b or (score_a == score_b and a < b)
+
+    def _pull(self, node: int):
+        left, right = self._left[node], self._right[node]
+        self._size[node] = 1 + (self._size[left] if left >= 0 else 0) + (self._size[right] if right >= 0 else 0)
+
+    def _split(self, node: int, pivot: int) -> tuple:
+        """
+        把子树分成排在pivot之前和之后的两棵。
+        """
+        if node < 0:
+            return -1, -1
+        if self._before(node, pivot):
+            self._right[node], after = self._split(self._right[node], pivot)
+            self._pull(node)
+            return node, after
+        before, self._left[node] = self._split(self._left[node], pivot)
+        self._pull(node)
+        return before, node
+
+    def _merge(self, a: int, b: int) -> int:
+        """
+        a中的节点都排在b之前。
+        """
+        if a < 0:
+            return b
+        if b < 0:
+            return a
+        if self._priority[a] > self._priority[b]:
+            self._right[a] = self._merge(self._right[a], b)
+            self._pull(a)
+            return a
+        self._left[b] = self._merge(a, self._left[b])
+        self._pull(b)
+        return b
+
+    def _insert(self, node: int, x: int) -> int:
+        if node < 0:
+            return x
+        if self._priority[x] > self._priority[node]:
+            self._left[x], self._right[x] = self._split(node, x)
+            self._pull(x)
+            return x
+        if self._before(x, node):
+            self._left[node] = self._insert(self._left[node], x)
+        else:
+            self._right[node] = self._insert(self._right[node], x)
+        self._size[node] += 1
+        return node
+
+    def _erase(self, node: int, x: int) -> int:
+        if node == x:
+            return self._merge(self._left[x], self._right[x])
+        if self._before(x, node):
+            self._left[node] = self._erase(self._left[node], x)
+        else:
+            self._right[node] = self._erase(self._right[node], x)
+        self._size[node] -= 1
+        return node
+
+
+class PlayerStats:
+    """
+    每个玩家的累计量（到场轮数、输入之和、与G的距离之和、最近次数、最远次数）存放在并列的array中，
+    每轮每个玩家O(1)更新；分数有变化的玩家（每轮只有最近和最远的几个人）在Ranking中重新排位。
+    """
+
+    def __init__(self, player_number: int):
+        self._PLAYER_NUMBER = player_number
+        self.rounds = 0
+        self._played = array('i', bytes(4 * player_number))
+        self._input_sum = array('d', bytes(8 * player_number))
+        self._distance_sum = array('d', bytes(8 * player_number))
+        self._wins = array('i', bytes(4 * player_number))
+        self._penalties = array('i', bytes(4 * player_number))
+        self.ranking = Ranking(player_number)
+        self.changed = []  # 最近一轮分数有变化的玩家ID
+
+    def update(self, inputs: list, g_value: float, scores: list, closest: list = None, farthest: list = None):
+        """
+        记入一轮结果。closest/farthest为本轮离G最近/最远的玩家，调用方已经算过时传入，省去一次遍历。
+        """
+        if closest is None or farthest is None:
+            closest, farthest = Scoring.find_extremes(inputs, g_value)
+        played, input_sum, distance_sum = self._played, self._input_sum, self._distance_sum
+        for id_, x in enumerate(inputs):
+            if x == x:  # 缺席玩家（NaN）不计入平均值
+                played[id_] += 1
+                input_sum[id_] += x
+                distance_sum[id_] += abs(x - g_value)
+        for id_ in closest:
+            self._wins[id_] += 1
+        for id_ in farthest:
+            self._penalties[id_] += 1
+        changed = []
+        for id_ in set(closest).union(farthest):  # 只有这些人的分数可能变化
+            if scores[id_] != self.ranking.score(id_):
+                self.ranking.update(id_, scores[id_])
+                changed.append(id_)
+        self.changed = sorted(changed)
+        self.rounds += 1
+
+    def score(self, player_id: int) -> int:
+        return self.ranking.score(player_id)
+
+    def mean_input(self, player_id: int) -> float:
+        played = self._played[player_id]
+        return self._input_sum[player_id] / played if played else Scoring.ABSENT
+
+    def mean_distance(self, player_id: int) -> float:
+        """
+        与G的平均距离。
+        """
+        played = self._played[player_id]
+        return self._distance_sum[player_id] / played if played else Scoring.ABSENT
+
+    def wins(self, player_id: int) -> int:
+        return self._wins[player_id]
+
+    def penalties(self, player_id: int) -> int:
+        return self._penalties[player_id]
+
+    def rank(self, player_id: int) -> int:
+        return self.ranking.rank(player_id)
+
+    def top(self, k: int) -> list:
+        return self.ranking.top(k)
+
+    def player(self, player_id: int) -> dict:
+        return {'id': player_id, 'score': self.score(player_id), 'rank': self.rank(player_id),
+                'played': self._played[player_id], 'mean_input': self.mean_input(player_id),
+                'mean_distance': self.mean_distance(player_id), 'wins': self._wins[player_id],
+                'penalties': self._penalties[player_id]}
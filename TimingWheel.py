@@ -0,0 +1,74 @@
+"""
+文件名：    TimingWheel.py
+功  能：    哈希时间轮。大量连接各有一个截止时刻（心跳超时、重连保留期），全部放在一个轮子里，
+            由一个线程（或事件循环的一个回调）每个tick推进一格，不再为每个连接创建Timer。
+"""
+import time
+
+
+class TimingWheel:
+    """
+    轮子有slot_number格，每格tick秒。截止时刻为t的键放在第int(t / tick) % slot_number格，
+    推进时只检查走过的格子：超过一圈的键留在原处等下一圈，到期的键被取出交给调用方。
+
+    schedule/cancel是O(1)；推进一格的开销与该格中的键数成正比，与键的总数无关。截止时刻的精度为一个tick。
+    键可以是任何可哈希的对象，同一个键只有一个截止时刻，重复schedule会把它移到新的格子。
+
+    本类不加锁，由调用方保证同一时间只有一个线程访问。
+    """
+    __slots__ = ('tick', '_slots', '_where', '_deadline', '_next_tick')
+
+    def __init__(self, tick: float, slot_number: int = 512, now: float = None):
+        self.tick = tick
+        self._slots = [set() for _ in range(slot_number)]
+        self._where = {}  # 键 -> 所在格子
+        self._deadline = {}  # 键 -> 截止时刻
+        self._next_tick = int((time.monotonic() if now is None else now) / tick)  # 下一个要检查的tick
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key) -> bool:
+        return key in self._where
+
+    def deadline(self, key) -> float:
+        return self._deadline.get(key)
+
+    def schedule(self, key, when: float):
+        """
+        设置key的截止时刻（time.monotonic()），已经过去的时刻在下一次advance时到期。
+        """
+        slot = self._slots[max(int(when / self.tick), self._next_tick) % len(self._slots)]
+        old = self._where.get(key)
+        if old is not slot:
+            if old is not None:
+                old.discard(key)
+            slot.add(key)
+            self._where[key] = slot
+        self._deadline[key] = when
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            slot.discard(key)
+            del self._deadline[key]
+
+    def advance(self, now: float = None) -> list:
+        """
+        推进到now，返回截止时刻不晚于now的键（已经从轮子中移除）。
+        落后超过一圈时每格只检查一次，不会重复遍历。
+        """
+        if now is None:
+            now = time.monotonic()
+        last_tick = int(now / self.tick)
+        first_tick = max(self._next_tick, last_tick - len(self._slots) + 1)
+        expired = []
+        for tick in range(first_tick, last_tick + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for key in [key for key in slot if self._deadline[key] <= now]:
+                slot.discard(key)
+                del self._where[key]
+                del self._deadline[key]
+                expired.append(key)
+        self._next_tick = last_tick
+        return expired
@@ -0,0 +1,49 @@
+"""
+心跳超时的回归测试：提交输入后等待较慢玩家的客户端不能被当作已断开。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import os
+import time
+import tempfile
+import unittest
+
+import AsyncNetwork
+import GameBoard
+import Network
+
+
+class SlowPlayerTest(unittest.TestCase):
+
+    def _play_one_round(self, server_class):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        board = GameBoard.GameBoard(2, server_class, rounds=1, heartbeat_timeout=1.0,
+                                    history_path=os.path.join(directory.name, 'server.rhst'))
+        board.game_exit = lambda: None
+        address = board.server.listen(0, '127.0.0.1')
+        board.start(listen=False)
+        clients = [Network.Client(reconnect=False) for _ in range(2)]
+        try:
+            for client in clients:
+                client.connect(*address)
+            clients[0].send_input(30)
+            time.sleep(2.5)  # 第二个玩家思考的时间超过心跳超时，第一个玩家的处理线程一直在等待结果
+            clients[1].send_input(60)
+            for client in clients:
+                self.assertIsNotNone(client.get_round_result())
+            board.wait_exit()
+            self.assertNotIn('heartbeat_timeouts', board.metrics.snapshot()['counters'])
+            self.assertEqual(len(board.server.connections), 2)
+        finally:
+            board.server.server_exit()
+
+    def test_thread_server(self):
+        self._play_one_round(Network.Server)
+
+    def test_async_server(self):
+        self._play_one_round(AsyncNetwork.AsyncServer)
+
+
+if __name__ == '__main__':
+    unittest.main()
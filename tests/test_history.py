@@ -0,0 +1,92 @@
+"""
+RoundHistory的回归测试：写入文件的旧轮次能原样读回，追加与读取可以在不同线程同时进行。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import os
+import sys
+import random
+import tempfile
+import unittest
+from threading import Thread
+
+import History
+
+
+def _rounds(number: int, players: int, seed: int = 6) -> list:
+    rng = random.Random(seed)
+    return [([rng.uniform(0.01, 99.99) for _ in range(players)], rng.uniform(0.0, 70.0),
+             [rng.randint(-100, 1000) for _ in range(players)]) for _ in range(number)]
+
+
+class RoundHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, 'match.rhst')
+
+    def _check(self, history, rounds: list):
+        self.assertEqual(len(history), len(rounds))
+        self.assertEqual(history.g_values(), [g_value for _, g_value, _ in rounds])
+        self.assertEqual(history.inputs_rows(), [inputs for inputs, _, _ in rounds])
+        for round_, (inputs, g_value, scores) in enumerate(rounds):
+            self.assertEqual(history.g(round_), g_value)
+            self.assertEqual(history.scores(round_), scores)
+        self.assertEqual(history.last_scores(), rounds[-1][2])
+
+    def test_spill_and_reopen(self):
+        rounds = _rounds(100, 7)
+        history = History.RoundHistory(7, self.path, memory_rounds=8)
+        for inputs, g_value, scores in rounds:
+            history.append(inputs, g_value, scores)
+        self.assertLessEqual(len(history._g), 16)  # 旧轮次已经写入文件
+        self._check(history, rounds)
+        history.close()
+        self._check(history, rounds)  # 关闭后仍然可以读取
+        reopened = History.RoundHistory.open(self.path)
+        self._check(reopened, rounds)
+        reopened.close()
+
+    def test_anonymous_file(self):
+        rounds = _rounds(50, 3)
+        history = History.RoundHistory(3, memory_rounds=4)
+        for inputs, g_value, scores in rounds:
+            history.append(inputs, g_value, scores)
+        history.close()
+        self._check(history, rounds)
+        self.assertEqual(History.RoundHistory(3).last_scores(), [0, 0, 0])
+
+    def test_concurrent_reader(self):
+        rounds = _rounds(3000, 5)
+        history = History.RoundHistory(5, self.path, memory_rounds=2)
+        errors = []
+
+        def reader():
+            # 像界面线程一样读取最近一轮；追加线程同时在写入文件、删除内存中的旧轮次
+            try:
+                while True:
+                    length = len(history)
+                    if length:
+                        round_ = random.randrange(length)
+                        self.assertEqual(history.scores(round_), rounds[round_][2])
+                        self.assertEqual(history.inputs(round_), rounds[round_][0])
+                    if length == len(rounds):
+                        break
+            except Exception as e:
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # 频繁切换线程，让读取更容易落在写入文件的中途
+        self.addCleanup(sys.setswitchinterval, interval)
+        T_reader = Thread(target=reader)
+        T_reader.start()
+        for inputs, g_value, scores in rounds:
+            history.append(inputs, g_value, scores)
+        T_reader.join()
+        history.close()
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
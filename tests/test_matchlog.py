@@ -0,0 +1,68 @@
+"""
+MatchLog与Replay的回归测试：写入的日志按记录的规则回放没有差异，逐轮计算与NumPy整块计算的报告相同。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import os
+import random
+import tempfile
+import unittest
+
+import MatchLog
+import Replay
+import Scoring
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, 'match.log')
+
+    def _write(self, players: int, rounds: int, absent: float = 0.0, seed: int = 9) -> list:
+        rng = random.Random(seed)
+        writer = MatchLog.MatchLogWriter(self.path, players)
+        scores = [0] * players
+        for round_ in range(rounds):
+            inputs = [rng.uniform(0.01, 99.99) if rng.random() >= absent else Scoring.ABSENT for _ in range(players)]
+            inputs[0] = float(rng.randint(1, 99))  # 至少一人到场
+            g_value, scores, _, _ = Scoring.score_round(inputs, scores)
+            writer.append(round_, inputs, g_value, scores)
+        writer.close()
+        return scores
+
+    def _replay(self, **kw) -> list:
+        engines = [False, True] if Scoring._load_numpy() is not None else [False]
+        return [Replay.replay(self.path, use_numpy=use_numpy, **kw) for use_numpy in engines]
+
+    def test_round_trip(self):
+        for players, absent in ((1, 0.0), (10, 0.0), (10, 0.3), (100, 0.1)):
+            with self.subTest(players=players, absent=absent):
+                scores = self._write(players, 500, absent)
+                # 小块读取，记录跨越块的边界
+                for report in self._replay(chunk_bytes=MatchLog.record_size(players) * 7 + 3):
+                    self.assertEqual(report['rounds'], 500)
+                    self.assertEqual((report['g_diffs'], report['score_diffs'], report['first_diff']), (0, 0, None))
+                    self.assertEqual(report['final_scores'], scores)
+                    self.assertEqual(report['recorded_final_scores'], scores)
+
+    def test_truncated_tail(self):
+        scores = self._write(5, 20)
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * (MatchLog.record_size(5) - 1))  # 写入时崩溃留下的不完整记录
+        for report in self._replay():
+            self.assertEqual(report['rounds'], 20)
+            self.assertEqual(report['final_scores'], scores)
+
+    def test_other_rules(self):
+        self._write(10, 50)
+        reports = self._replay(win_points=1, lose_points=0)
+        for report in reports:
+            self.assertGreater(report['score_diffs'], 0)
+            self.assertEqual(report['first_diff'], 0)
+        self.assertEqual(reports[0]['final_scores'], reports[-1]['final_scores'])
+
+
+if __name__ == '__main__':
+    unittest.main()
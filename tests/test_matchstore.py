@@ -0,0 +1,48 @@
+"""
+MatchStore的回归测试：写入线程遇到不合法的操作时只丢弃该操作，之后的操作照常写入，flush不会一直阻塞。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import os
+import tempfile
+import unittest
+from threading import Thread
+
+import MatchStore
+
+
+class WriterErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.store = MatchStore.MatchStore(os.path.join(self._dir.name, 'games.db'))
+        self.addCleanup(self.store.close)
+
+    def _flush(self):
+        T_flush = Thread(target=self.store.flush)
+        T_flush.setDaemon(True)
+        T_flush.start()
+        T_flush.join(timeout=10)
+        self.assertFalse(T_flush.is_alive(), 'flush() did not return')
+
+    def test_bad_operations_are_dropped(self):
+        match = self.store.begin_match(2)
+        self.store.add_round(match, 0, 10.0, [10.0, 20.0], [2, -2])
+        self.store.add_round(match, 1, 11.0, [11.0, 22.0], [2 ** 40, 0])  # OverflowError: 超出int32
+        self.store.add_round(match, 2, 12.0, [12.0, None], [4, -4])  # TypeError
+        self.store.finish_match(match, [{'id': 0}])  # KeyError
+        self.store.add_round(match, 3, 13.0, [13.0, 26.0], [6, -6])
+        self._flush()
+        rounds = list(self.store.match_rounds(match.match_id))
+        self.assertEqual([round_ for round_, _, _, _ in rounds], [0, 3])
+        self.assertEqual(rounds[1], (3, 13.0, [13.0, 26.0], [6, -6]))
+
+        # 写入线程仍在工作
+        self.store.finish_match(match, [])
+        self.store.add_round(self.store.begin_match(1), 0, 1.0, [1.0], [1])
+        self._flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+计分内核的回归测试：结果与原实现相同；逐轮计算（calculate_g、find_extremes）与整块计算（batch_extremes）逐位一致。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import math
+import random
+import unittest
+
+import Benchmark
+import Scoring
+
+
+def _random_table(rng: random.Random, rounds: int, players: int, absent: float = 0.0) -> list:
+    table = []
+    for _ in range(rounds):
+        row = [rng.uniform(0.01, 99.99) if rng.random() >= absent else Scoring.ABSENT for _ in range(players)]
+        if all(x != x for x in row):
+            row[0] = 50.0
+        table.append(row)
+    return table
+
+
+class LegacyScoresTest(unittest.TestCase):
+    """
+    与原GameBoard._calculate_scores（Benchmark._legacy_scores）对照。输入取整数以制造大量并列。
+    """
+
+    def test_kernels(self):
+        rng = random.Random(4)
+        kernels = [Scoring._find_extremes_python]
+        if Scoring._load_numpy() is not None:
+            kernels.append(Scoring._find_extremes_numpy)
+        for players in (1, 2, 10, 1000, 20000):
+            inputs = [float(rng.randint(1, 99)) for _ in range(players)]
+            last_scores = [rng.randint(-20, 200) for _ in range(players)]
+            expected = Benchmark._legacy_scores(inputs, last_scores)
+            g_value = Scoring.calculate_g(inputs)
+            for find_extremes in kernels:
+                with self.subTest(players=players, kernel=find_extremes.__name__):
+                    closest, farthest = find_extremes(inputs, g_value)
+                    self.assertEqual(Scoring.apply_points(last_scores, closest, farthest, players), expected)
+            self.assertEqual(Scoring.score_round(inputs, last_scores)[1], expected)
+
+
+@unittest.skipIf(Scoring._load_numpy() is None, 'batch_extremes requires NumPy')
+class BatchExtremesTest(unittest.TestCase):
+
+    def _check(self, table: list):
+        g_values, closest, farthest = Scoring.batch_extremes(Scoring.np.array(table, dtype=Scoring.np.float64))
+        for round_, inputs in enumerate(table):
+            g_value = Scoring.calculate_g(inputs)
+            self.assertEqual(g_value.hex(), float(g_values[round_]).hex(), f'round {round_}')
+            for find_extremes in (Scoring._find_extremes_python, Scoring._find_extremes_numpy):
+                expected = find_extremes(inputs, g_value)
+                self.assertEqual(expected[0], Scoring.np.flatnonzero(closest[round_]).tolist())
+                self.assertEqual(expected[1], Scoring.np.flatnonzero(farthest[round_]).tolist())
+
+    def test_random_floats(self):
+        rng = random.Random(4)
+        for players in (1, 2, 7, 100, 1000):
+            # 轮数多于玩家数和少于玩家数时，batch_extremes分别逐列累加和用cumsum
+            for rounds in (3, 2 * players + 1):
+                with self.subTest(players=players, rounds=rounds):
+                    self._check(_random_table(rng, rounds, players))
+
+    def test_absent_players(self):
+        rng = random.Random(5)
+        for players in (2, 10, 500):
+            with self.subTest(players=players):
+                self._check(_random_table(rng, 50, players, absent=0.3))
+
+    def test_sequential_sum(self):
+        # 补偿求和（math.fsum，以及Python 3.12起的内置sum）得到1.0，按顺序累加得到0.0
+        inputs = [1e16, 1.0, -1e16]
+        self.assertEqual(math.fsum(inputs), 1.0)
+        self.assertEqual(Scoring.calculate_g(inputs, ratio=1.0), 0.0)
+        self._check([inputs])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+AsyncServer广播结果时，发送缓冲区积压超过WRITE_BUFFER_LIMIT的客户端被断开，其他玩家照常收到结果。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import os
+import time
+import tempfile
+import unittest
+
+import AsyncNetwork
+import GameBoard
+import Network
+
+
+class SlowClientTest(unittest.TestCase):
+
+    def test_backlogged_client_is_dropped(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        board = GameBoard.GameBoard(2, AsyncNetwork.AsyncServer, rounds=1,
+                                    history_path=os.path.join(directory.name, 'server.rhst'))
+        board.game_exit = lambda: None
+        address = board.server.listen(0, '127.0.0.1')
+        board.start(listen=False)
+        clients = [Network.Client(reconnect=False) for _ in range(2)]
+        try:
+            for client in clients:
+                client.connect(*address)
+            slow_id = clients[1].get_player_id()
+            # 模拟一个不读取结果的客户端：它的发送缓冲区已经积压了超过上限的数据
+            transport = board.server.connections.conns[slow_id][0].transport
+            transport.get_write_buffer_size = lambda: AsyncNetwork.WRITE_BUFFER_LIMIT + 1
+            clients[0].send_input(30)
+            clients[1].send_input(60)
+            self.assertEqual(clients[0].get_round_result()[0], [30.0, 60.0] if slow_id else [60.0, 30.0])
+            board.wait_exit()
+            time.sleep(0.2)  # _client_dropped在事件循环中执行
+            counters = board.metrics.snapshot()['counters']
+            self.assertEqual(counters['slow_client_drops'], {slow_id: 1})
+            self.assertNotIn(slow_id, counters['messages_out'])
+            self.assertIsNone(board.server.connections.conns[slow_id])  # 保留ID等待重连
+        finally:
+            board.server.server_exit()
+
+
+if __name__ == '__main__':
+    unittest.main()
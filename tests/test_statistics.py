@@ -0,0 +1,61 @@
+"""
+Statistics的回归测试：Ranking的名次和前k名与每次重新排序全部分数的结果相同。
+
+运行方式：python -m pytest tests 或 python -m unittest discover tests（在仓库根目录）
+"""
+import random
+import unittest
+
+import Scoring
+import Statistics
+
+
+def _order(scores: list) -> list:
+    return sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+
+
+class RankingTest(unittest.TestCase):
+
+    def _check(self, ranking, scores: list):
+        order = _order(scores)
+        self.assertEqual(ranking.top(len(scores)), [(id_, scores[id_]) for id_ in order])
+        self.assertEqual([id_ for id_, _ in ranking.top(10)], order[:10])
+        for k, id_ in enumerate(order):
+            self.assertEqual(ranking.kth(k), id_)
+        for id_, score in enumerate(scores):
+            self.assertEqual(ranking.rank(id_), 1 + sum(s > score for s in scores))
+
+    def test_random_updates(self):
+        rng = random.Random(7)
+        for players in (1, 2, 50, 300):
+            with self.subTest(players=players):
+                ranking = Statistics.Ranking(players, seed=players)
+                scores = [0] * players
+                self._check(ranking, scores)
+                for _ in range(200):
+                    id_ = rng.randrange(players)
+                    scores[id_] = rng.randint(-10, 10)  # 分数范围小，大量同分
+                    ranking.update(id_, scores[id_])
+                self._check(ranking, scores)
+
+
+class PlayerStatsTest(unittest.TestCase):
+
+    def test_rounds(self):
+        rng = random.Random(8)
+        players = 200
+        stats = Statistics.PlayerStats(players)
+        scores = [0] * players
+        for _ in range(30):
+            inputs = [float(rng.randint(1, 99)) for _ in range(players)]
+            g_value, scores, closest, farthest = Scoring.score_round(inputs, scores)
+            stats.update(inputs, g_value, scores, closest, farthest)
+        order = _order(scores)
+        self.assertEqual([id_ for id_, _ in stats.top(10)], order[:10])
+        for id_ in range(players):
+            self.assertEqual(stats.score(id_), scores[id_])
+            self.assertEqual(stats.rank(id_), 1 + sum(s > scores[id_] for s in scores))
+
+
+if __name__ == '__main__':
+    unittest.main()